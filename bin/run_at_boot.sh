@@ -1,9 +1,6 @@
 #!/bin/bash
 python $DSS28CORE/identifySerialPorts.py
-screen -dmLS forx python $DSS28CORE/forx_server.py
-screen -dmLS power python $DSS28CORE/powerdbwriter.py
-screen -dmLS ups python $DSS28CORE/ups.py
-screen -dmLS tct python $DSS28CORE/tct_mon.py
+screen -dmLS monhost python $DSS28CORE/monitor_host.py
 screen -dmLS valon python $DSS28CORE/valonServer.py
 screen -dmLS ibobutil python $DSS28CORE/iBOBUtilServer.py
 screen -dmLS ibobproc python $DSS28CORE/iBOBProcessServer.py
@@ -0,0 +1,140 @@
+"""
+:mod:`dbbench`
+--------------
+
+Timing of the common GavrtDB query patterns, normally run against the SQLite stand-in database (see
+:mod:`sqlitedb`) so that changes to the database code can be profiled away from the site.
+
+Run as a program::
+
+    python dbbench.py [filename [days]]
+
+which creates and fills *filename* (default /tmp/gavrtdb_bench.sqlite) with *days* (default 1) of synthetic data if
+it does not exist, and prints the time taken by each benchmark. From Python::
+
+    import dbbench
+    results = dbbench.run(gdb,t0,t1)
+    print dbbench.report(results)
+"""
+import os
+import sys
+import time
+
+import numpy as np
+
+import gavrtdb
+import sqlitedb
+
+DEFAULT_FILENAME = '/tmp/gavrtdb_bench.sqlite'
+MIN_TIME = 0.5          # seconds each benchmark is repeated for
+
+def timeit(func,min_time=MIN_TIME):
+    """
+    Call func() repeatedly for at least *min_time* seconds. Returns a dictionary of number of calls, mean and
+    minimum seconds per call
+    """
+    times = []
+    start = time.time()
+    while True:
+        t = time.time()
+        func()
+        times.append(time.time() - t)
+        if time.time() - start > min_time:
+            break
+    return dict(calls=len(times),mean=np.mean(times),min=np.min(times))
+
+def benchmarks(gdb,t0,t1,ibob=0,ntimes=1000):
+    """
+    List of (name, function, items) for the benchmarks on *gdb*, whose data covers UnixTimes t0 to t1. *items* is the
+    number of lookups or rows one call of the function handles, for reporting time per item
+    """
+    rs = np.random.RandomState(1)
+    times = np.sort(rs.uniform(t0 + 0.1*(t1-t0),t1,ntimes))
+    hour = (max(t0,t1-3600),t1)
+    def uncached(func):
+        def run():
+            gavrtdb.invalidateCache()
+            return func()
+        return run
+    def perTime(func,n=20):
+        return lambda: [func(t) for t in times[:n]]
+    def queued():
+        for k in range(100):
+            gdb.queueRecord('tct_status',dict(UnixTime=time.time(),Status=0,Offset=0.0))
+        gavrtdb.flushInserts()
+    bench = [
+        ('getScanStatus',gdb.getScanStatus,1),
+        ('getScanStatus uncached',uncached(gdb.getScanStatus),1),
+        ('getPersonality',lambda: gdb.getPersonality(ibob),1),
+        ('getIBOBPersonalities',gdb.getIBOBPersonalities,1),
+        ('getRSSStatus',gdb.getRSSStatus,1),
+        ('getSPSSStatus',gdb.getSPSSStatus,1),
+        ('getRXStatusByIBob',lambda: gdb.getRXStatusByIBob(ibob),1),
+        ('getScanTypes',gdb.getScanTypes,1),
+        ('getRSSStatusAt',perTime(gdb.getRSSStatusAt),20),
+        ('getSPSSStatusAt',perTime(gdb.getSPSSStatusAt),20),
+        ('getIBOBStatusAt',perTime(lambda t: gdb.getIBOBStatusAt(t,ibob)),20),
+        ('getConfigAt',lambda: gdb.getConfigAt(times,ibob),len(times)),
+        ('get forx_mon hour',lambda: gdb.get("SELECT * FROM forx_mon WHERE UnixTime >= %s AND UnixTime < %s",hour),1),
+        ('get antenna_temp hour',lambda: gdb.get("SELECT * FROM antenna_temp WHERE UnixTime >= %s AND UnixTime < %s",
+                                                 hour),1),
+        ('getMonData',lambda: gdb.getMonData(1,2),1),
+        ('getLastRecord rss_config',lambda: gdb.getLastRecord('rss_config'),1),
+        ('insertRecord tct_status',lambda: gdb.insertRecord('tct_status',dict(UnixTime=time.time(),Status=0,
+                                                                                Offset=0.0)),1),
+        ('queueRecord tct_status',queued,100),
+    ]
+    try:
+        import dss28astro
+    except ImportError:
+        pass
+    else:
+        bench.extend([
+            ('getSourceAt',perTime(gdb.getSourceAt,5),5),
+            ('getSourcesAt',lambda: gdb.getSourcesAt(times),len(times)),
+        ])
+    return bench
+
+def run(gdb,t0,t1,names=None,min_time=MIN_TIME,**kwargs):
+    """
+    Run the benchmarks (all, or those in *names*) and return a list of (name, items, timing) where timing is as
+    returned by :func:`timeit`. Other keyword arguments are passed to :func:`benchmarks`
+    """
+    results = []
+    stdout = sys.stdout
+    for name,func,items in benchmarks(gdb,t0,t1,**kwargs):
+        if names is not None and name not in names:
+            continue
+        sys.stdout = open(os.devnull,'w')      # insertRecord prints every new record id
+        try:
+            func()      # warm up the connection pool and caches
+            results.append((name,items,timeit(func,min_time)))
+        finally:
+            sys.stdout.close()
+            sys.stdout = stdout
+    return results
+
+def report(results):
+    lines = ['%-28s %8s %12s %12s %12s' % ('benchmark','calls','mean ms','min ms','us/item')]
+    for name,items,timing in results:
+        lines.append('%-28s %8d %12.3f %12.3f %12.1f' % (name,timing['calls'],timing['mean']*1e3,timing['min']*1e3,
+                                                        timing['mean']*1e6/items))
+    return '\n'.join(lines)
+
+if __name__ == "__main__":
+    filename = DEFAULT_FILENAME
+    days = 1.0
+    if len(sys.argv) > 1:
+        filename = sys.argv[1]
+    if len(sys.argv) > 2:
+        days = float(sys.argv[2])
+    backend = sqlitedb.SQLiteBackend(filename)
+    if not os.path.exists(filename):
+        print "Generating %g days of synthetic data in %s" % (days,filename)
+        tic = time.time()
+        sqlitedb.generate(backend.connect(),days=days)
+        print "Generated in %.1f s" % (time.time()-tic)
+    gavrtdb.setBackend(backend)
+    gdb = gavrtdb.GavrtDB(rw=True)
+    times = gdb.get("SELECT MIN(UnixTime) AS t0, MAX(UnixTime) AS t1 FROM antenna_temp")
+    print report(run(gdb,times['t0'][0],times['t1'][0]))
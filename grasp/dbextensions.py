@@ -82,50 +82,109 @@ def insert_record(db,table,fields,update = False,keepid = False):
     print "new record id",id
     return id
 
+FETCH_CHUNK = 10000     # rows fetched from the server at a time by fetch_columns
+
+_FLOAT_TYPES = [0,4,5,246]          # MySQL field type codes for Decimal, Float, Double, NewDecimal
+_INT_TYPES = [1,2,3,8,9,13,16]      # Tiny, Short, Long, LongLong, Int24, Year, Bit
+
+def _server_cursor(db):
+    """
+    Unbuffered (server side) cursor if the client library provides one, so rows are streamed rather than all
+    held by the client before being read
+    """
+    try:
+        cursors = __import__(type(db).__module__.split('.')[0] + '.cursors',fromlist=['SSCursor'])
+        return db.cursor(cursors.SSCursor)
+    except Exception:
+        return db.cursor()
+
+def _column_dtype(typecode,asfloat):
+    if typecode in _FLOAT_TYPES:
+        return np.dtype('float64')
+    if typecode in _INT_TYPES:
+        if asfloat:
+            return np.dtype('float64')
+        return np.dtype('int64')
+    return np.dtype(object)
+
+def fetch_columns(db,*args,**kwargs):
+    """
+    Execute a query and return (names, columns) where columns is a list of one NumPy array per result column.
+
+    Rows are streamed from the server in chunks of *chunk* rows and written straight into typed arrays chosen from
+    the cursor description: float64 for floating point and decimal columns, int64 for integer columns (float64 if
+    *asfloat* is True) and object for everything else. NULLs in float columns become NaN; an integer column
+    containing NULL falls back to float64 (NaN) if *asfloat* is True, otherwise object (None).
+    """
+    asfloat = kwargs.get('asfloat',False)
+    chunk = kwargs.get('chunk',FETCH_CHUNK)
+    c = _server_cursor(db)
+    try:
+        c.execute(*args)
+        names = [d[0] for d in c.description]
+        dtypes = [_column_dtype(d[1],asfloat) for d in c.description]
+        size = 0
+        columns = [np.empty((chunk,),dtype=dt) for dt in dtypes]
+        while True:
+            rows = c.fetchmany(chunk)
+            if not rows:
+                break
+            n = len(rows)
+            if size + n > len(columns[0]):
+                capacity = max(2*len(columns[0]),size + n)
+                for k in range(len(columns)):
+                    grown = np.empty((capacity,),dtype=columns[k].dtype)
+                    grown[:size] = columns[k][:size]
+                    columns[k] = grown
+            for k,values in enumerate(zip(*rows)):
+                try:
+                    if columns[k].dtype == np.dtype(object):
+                        columns[k][size:size+n] = values
+                    else:
+                        columns[k][size:size+n] = np.fromiter(values,columns[k].dtype,n)
+                except (TypeError,ValueError):
+                    # NULLs in an integer column, or values which do not fit the column type
+                    if asfloat and columns[k].dtype != np.dtype(object):
+                        fallback = np.dtype('float64')
+                    else:
+                        fallback = np.dtype(object)
+                    if columns[k].dtype == fallback:
+                        fallback = np.dtype(object)
+                    columns[k] = columns[k].astype(fallback)
+                    try:
+                        columns[k][size:size+n] = values
+                    except (TypeError,ValueError):
+                        columns[k] = columns[k].astype(object)
+                        columns[k][size:size+n] = values
+            size += n
+    finally:
+        c.close()
+    return names,[col[:size].copy() if len(col) > size else col for col in columns]
+
 def get_as_rec(db,*args):
-    c = db.cursor()
-    print "executing"
-    c.execute(*args)
-    print "fetching"
-    res = c.fetchall()
-    print "toarray"
-    res = np.array(res)
-    dtypes = []
-    for n,d in enumerate(c.description):
-        if d[1] in [0,4,5,246]:     #Typecodes for Decimal,Float,Duble,NewDecimal
-            dtypes.append((d[0],float))
-        elif d[1] in [1,2,3,8,9]:
-            dtypes.append((d[0],int))
-        else:
-            dtypes.append((d[0],object))
-    resarr = np.empty((res.shape[0],),dtype=dtypes)
-    for n,d in enumerate(c.description):
-        resarr[d[0]] = res[:,n]
+    """
+    Execute a query and return the result as a structured array (see :func:`fetch_columns` for the column types)
+    """
+    names,columns = fetch_columns(db,*args)
+    resarr = np.empty((len(columns[0]) if columns else 0,),dtype=[(name,col.dtype) for name,col in zip(names,columns)])
+    for name,col in zip(names,columns):
+        resarr[name] = col
     return resarr
     
 
 def get_as_dict(db,*args,**kwargs):
+    """
+    Execute a query and return a dictionary of column name: array (see :func:`fetch_columns` for the column
+    types), or an empty dictionary if there are no rows
+    """
     try:
         asfloat = kwargs['asfloat']
     except:
         asfloat = True
-    c = db.cursor()
-    c.execute(*args)
-    res = np.array(c.fetchall())
-    if res.shape[0] == 0:
+    names,columns = fetch_columns(db,*args,**dict(asfloat=asfloat))
+    if not columns or len(columns[0]) == 0:
         return {}
-    descr = [x[0] for x in c.description]
-    if asfloat:
-        rd = {}
-        for x in range(res.shape[1]):
-            try:
-                r = res[:,x].astype('float')
-            except:
-                r = res[:,x]
-            rd[descr[x]] = r
-    else:
-        rd = dict([(descr[x],res[:,x]) for x in range(res.shape[1])])
-    return rd
+    return dict(zip(names,columns))
 
 def get_last_id(db,table):
     c = db.cursor()
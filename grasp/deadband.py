@@ -0,0 +1,117 @@
+"""
+:mod:`deadband`
+---------------
+
+Change-only recording for slowly varying monitor streams (forx_mon, spss_power, tct_status).
+
+Instead of inserting a row every cycle, a :class:`DeadbandRecorder` inserts a row only when some field has moved
+outside its deadband since the last row recorded, or when *heartbeat* seconds have passed since then (so a stuck
+writer can be told apart from a steady value). A recorded row therefore describes the stream from its time until
+the next row, to within the deadbands; :func:`readSeries` reconstructs the step-wise series on read.
+
+Example::
+
+    rec = deadband.DeadbandRecorder(gdb,'spss_power',dict(MeasuredVoltage=0.05,MeasuredCurrent=0.1))
+    while True:
+        rec.update(dict(UnixTime=time.time(),MeasuredVoltage=v,MeasuredCurrent=i,Status=s))
+        time.sleep(60)
+
+    d = deadband.readSeries(gdb,'spss_power',t0,t1,step=60)     # one value per minute, as before
+"""
+import time
+
+import numpy as np
+
+HEARTBEAT = 900.0       # seconds after which a row is recorded even if nothing changed
+
+class DeadbandRecorder(object):
+    """
+    Records rows to GavrtDB *table* through *gdb* (using :meth:`~gavrtdb.GavrtDB.queueRecord`) only on change
+
+    *deadbands* is a dictionary of field: deadband. A numeric field changes when it differs from the last recorded
+    value by more than its deadband; fields without a deadband (and non numeric fields) change on any difference.
+    *timecol* is the field holding the time of a row and is not compared.
+    """
+    def __init__(self,gdb,table,deadbands=None,heartbeat=HEARTBEAT,timecol='UnixTime'):
+        self.gdb = gdb
+        self.table = table
+        self.deadbands = dict(deadbands or {})
+        self.heartbeat = heartbeat
+        self.timecol = timecol
+        self.last = None
+        self.lastTime = None
+        self.stats = dict(updates=0,recorded=0)
+
+    def changed(self,rec):
+        """
+        Returns the list of fields of *rec* which are outside their deadband compared to the last recorded row
+        """
+        if self.last is None:
+            return [k for k in rec.keys() if k != self.timecol]
+        out = []
+        for k,v in rec.items():
+            if k == self.timecol:
+                continue
+            old = self.last.get(k)
+            try:
+                moved = abs(float(v) - float(old)) > self.deadbands.get(k,0.0)
+            except (TypeError,ValueError):
+                moved = v != old
+            if moved or (v != v) != (old != old):     # a value becoming or ceasing to be NaN is a change
+                out.append(k)
+        return out
+
+    def update(self,rec,now=None):
+        """
+        Offer a new row. It is recorded if it has changed or the heartbeat interval has passed. Returns True if
+        recorded
+        """
+        if now is None:
+            now = rec.get(self.timecol,time.time())
+        self.stats['updates'] += 1
+        if self.lastTime is not None and now - self.lastTime < self.heartbeat and not self.changed(rec):
+            return False
+        self.gdb.queueRecord(self.table,rec)
+        self.last = dict(rec)
+        self.lastTime = now
+        self.stats['recorded'] += 1
+        return True
+
+def readSeries(gdb,table,t0,t1,columns='*',step=None,timecol='UnixTime'):
+    """
+    Read a change-only recorded *table* for *t0* <= time < *t1*. Returns a dictionary of column arrays with the row
+    in effect at *t0* (if any) followed by the rows recorded in the span. *columns* is '*' or a comma separated list
+    of columns; ID and *timecol* are added to it if missing.
+
+    If *step* is given the series is reconstructed on a regular grid of times t0, t0+step, ... instead, each value
+    being held from the time it was recorded until the next row (NaN or None before the first row). The grid times
+    are in the *timecol* column.
+    """
+    if columns.strip() != '*':
+        names = [name.strip().strip('`') for name in columns.split(',')]
+        for name in [timecol,'ID']:
+            if name not in names:
+                columns = '`%s`,%s' % (name,columns)
+    hist = gdb.getConfigHistory(table,t0,t1,timecol=timecol,columns=columns)
+    if step is None:
+        return hist.rows
+    grid = np.arange(t0,t1,step)
+    idx = np.searchsorted(hist.times,grid,side='right') - 1
+    out = {}
+    for col,values in hist.rows.items():
+        values = np.asarray(values)
+        if len(values) == 0:
+            series = np.empty(grid.shape)
+            series[:] = np.nan
+        else:
+            series = values[np.maximum(idx,0)]
+            if (idx < 0).any():
+                if series.dtype.kind in 'biuf':
+                    series = series.astype('float64')
+                    series[idx < 0] = np.nan
+                else:
+                    series = series.astype(object)
+                    series[idx < 0] = None
+        out[col] = series
+    out[timecol] = grid
+    return out
@@ -20,9 +20,18 @@ import os
 
 import socket
 import struct
+import select
+import threading
+import contextlib
 
 from measurement import *
+import gavrtdb
 import personalities
+import historycatalog
+import downsample
+import channelwindow
+import spectralkurtosis
+import adcstats
 
 from multiprocessing import Lock
 
@@ -36,10 +45,67 @@ MAX_CHARS_PER_COMMENT = 512
 RCV_BUFFER_SIZE = 2**24
 
 SENDGET_ATTEMPTS = 10
+SENDGET_WINDOW = 8         # maximum number of commands in flight in sendget_many
+SENDGET_TIMEOUT = 0.2
+
+REGISTER_CACHE_TTL = 1.0   # seconds for which read_registers may return cached values
+SK_ACC_LEN_TTL = 10.0      # seconds between readbacks of acc_len for the SK flagger
+REFRESH_INTERVAL = 1.0     # seconds between checks for cached registers needing a readback
+ACC_MODULUS = 2**32        # AccNumber is a 32 bit counter in the packet header
 
 IBOB_NETWORK = '192.168.0.'
 IBOB_BASE_PORT = 59000
 
+def comment_table_description():
+    return {
+            "UserID" : tables.StringCol(20, dflt="User"),
+            "Comment" : tables.StringCol(MAX_CHARS_PER_COMMENT),
+            "Timestamp" : tables.Float64Col()
+           }
+
+def _create_history_file(filename,personality,reduction_config,window_config):
+    """
+    Create the history file *filename* with the groups, tables and empty arrays for *personality*, the
+    downsampled outputs in *reduction_config* and the channel windows in *window_config*, then close it. Called by
+    :meth:`IbobServer.prepare_next_file` with the HDF5 locks held so the file is ready before recording switches to it.
+    """
+    h5 = tables.openFile(filename,'w')
+    try:
+        h5.createTable(h5.root, "comment_table", comment_table_description())
+        iBOB_group = h5.root
+
+        h5.createTable(iBOB_group, "file_info", dict(personality=tables.StringCol(128,dflt=' ')))
+        iBOB_group.file_info.row['personality'] = personality.__class__.__name__
+        iBOB_group.file_info.row.append()
+
+        measurement_types = personality._measTypesDict
+        windower = channelwindow.ChannelWindower(measurement_types,window_config)
+        for measurement_type in measurement_types.keys():
+            meas_grp = h5.createGroup(iBOB_group,measurement_type)
+            h5.createTable(meas_grp, 'table', measurement_types[measurement_type]['table'], expectedrows=2000)
+            for name,(source,shape,overview) in windower.storedArrays(measurement_type).items():
+                fullshape = tuple([0]+list(shape))
+                if overview:
+                    atom = tables.Float32Atom()
+                else:
+                    atom = tables.Atom.from_dtype(personality._arrayDtype(measurement_type,source))
+                h5.createEArray(meas_grp, name, atom, fullshape)
+            if windower.config.has_key(measurement_type):
+                h5.createArray(meas_grp, 'windows', np.array(window_config[measurement_type]['windows'],dtype='int32'))
+                h5.createArray(meas_grp, 'window_freqs', np.array(window_config[measurement_type]['freqs']))
+            if reduction_config.has_key(measurement_type):
+                for interval in reduction_config[measurement_type]['rates']:
+                    tag = downsample.rateTag(interval)
+                    h5.createTable(meas_grp, 'table_'+tag, downsample.reducedTableDescription(), expectedrows=2000)
+                    for node,shape,dtype in downsample.reducedArrays(measurement_types[measurement_type]['arrays'],
+                                                                     tag).values():
+                        fullshape = tuple([0]+list(shape))
+                        h5.createEArray(meas_grp, node, tables.Atom.from_dtype(np.dtype(dtype)), fullshape)
+
+        h5.createTable(iBOB_group, "InfoTable", personality._infoTable, expectedrows = 2000)
+    finally:
+        h5.close()
+
 class IbobServer(Pyro.core.ObjBase):
     def __init__(self, ibobid):
         Pyro.core.ObjBase.__init__(self)
@@ -67,6 +133,9 @@ class IbobServer(Pyro.core.ObjBase):
         self.control_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         # 7 is the port on which the iBOB listens for commands
         self.control_sock.connect((self.iBOB_addr, 7))
+        # one command/response transaction on the control socket at a time: Pyro request threads and the register
+        # refresh thread share it, and each flushes the socket before sending
+        self.control_lock = threading.Lock()
 
         self.measurements_dict = {}
         self.measurements_list = []
@@ -74,6 +143,8 @@ class IbobServer(Pyro.core.ObjBase):
         self.realtime_infotable = None
         
         self.packets_received = 0
+        self.discard_until = 0      # packets are dropped until this time after a personality swap
+        self.swaps = 0              # personality swaps, numbering the side files (see swap_personality)
 
         self.data_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         self.data_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
@@ -84,6 +155,21 @@ class IbobServer(Pyro.core.ObjBase):
         self.number_of_measurements = 0
         self.h5 = None
         self.realtime_h5 = None
+        self.fileinfo = None
+        self.catalog = None
+        self.catalog_lock = threading.Lock()   # the catalog is used by the data loop and by Pyro requests
+        self.next_file = None       # history file prepared for the next start_writing
+        self.reduction_config = {}
+        self.window_config = {}
+        self.reducer = None
+        self.registers = {}
+        self.register_cache = {}    # register -> (value, time read)
+        self.sk_acc_len_read = 0    # time of the last readback of acc_len for the SK flagger
+        self.refresher = None
+        self.coefficients = {}
+        self.sk_flagger = None
+        self.sk_sigma = 3.0
+        self.realtime_occupancy = None
 
         self.ns = Pyro.naming.NameServerLocator().getNS()
         
@@ -116,6 +202,10 @@ class IbobServer(Pyro.core.ObjBase):
         
         self.data_sock.setblocking(False) # crucial to avoid deadlock in loop
 
+        self.refresher = threading.Thread(target=self._refresh_registers,name='%s registers' % self.name)
+        self.refresher.setDaemon(True)
+        self.refresher.start()
+
         while self.running:
             self.pd.handleRequests(1, [self.data_sock], self.processData)
         self.data_sock.close()
@@ -128,6 +218,8 @@ class IbobServer(Pyro.core.ObjBase):
             except:
                 return
             self.packets_received += 1
+            if self.discard_until and time.time() < self.discard_until:
+                continue
             measurement_piece = MeasurementPacket(d)
             self.reassemble_measurement(measurement_piece)
     def get_num_packets(self):
@@ -145,7 +237,7 @@ class IbobServer(Pyro.core.ObjBase):
     def quit(self):
         self.running = False
         self.stop_writing()
-        with self.realtime_lock:
+        with self._hdf5_locked():
             if self.realtime_h5:
                 self.realtime_h5.close()
                 self.realtime_h5 = None
@@ -159,7 +251,7 @@ class IbobServer(Pyro.core.ObjBase):
     def clear_personality(self):
         corelog.debug("%s Clearing personality" % self.name)
         self.personality = None
-        with self.realtime_lock:
+        with self._hdf5_locked():
             if self.realtime_h5:
                 self.realtime_h5.close()
                 self.realtime_h5 = None
@@ -174,13 +266,171 @@ class IbobServer(Pyro.core.ObjBase):
             return
         corelog.debug("%s Setting personality %s %s" % (self.name,str(personality), personalities.__file__))
         self.personality = personality(adcClock=adcClock)  # removed self as parent
+        self.coefficients = {}  # a new personality means the FPGA was reprogrammed, so no coefficients are known
+        self._init_skflagger()
+        self._init_snapshot_stats()
         try:
             self._init_rtbuf()
         except Exception,e:
             corelog.exception("Could not init realtime buf for ibob %d %s"%(self.id,str(self.personality)))
 
+    def swap_personality(self, personality, adcClock=1024.0, holdoff=0.0):
+        """
+        Replace the personality of a running server, e.g. after the iBOB is loaded with a new design, without
+        closing the data socket or restarting the server process.
+
+        The new personality's realtime buffers are built in a side file between measurements (PyTables is not thread
+        safe, so this holds the locks the data loop writes HDF5 under), and are then swapped in by renaming the side
+        file over the realtime h5 file (readers which already have the old file open keep a consistent view of it).
+        Incomplete measurements and packets queued in the socket for the old design are discarded, as are packets
+        arriving within *holdoff* seconds after the swap, for when the design is loaded after this call. Not
+        possible while writing a history file.
+
+        Returns the number of packets discarded, or None if the swap was refused or failed
+        """
+        if self.writing:
+            corelog.warning("%s cannot swap personality while writing" % self.name)
+            return None
+        old_name = 'None' if self.personality is None else self.personality.__class__.__name__
+        corelog.info("%s Swapping personality %s -> %s" % (self.name,old_name,personality.__name__))
+        if self.next_file is not None:
+            self._discard_next_file()     # laid out for the old personality
+        new_personality = personality(adcClock=adcClock)
+        self._init_snapshot_stats(new_personality)
+        sk_flagger = self._make_skflagger(new_personality)
+        filename = "/tmp/rt%d.h5" % self.id
+        # PyTables knows an open file by the name it was opened with, so the side file renamed into place by the
+        # last swap is still open as <filename>.swap<n>: alternate the side file names
+        self.swaps += 1
+        side = '%s.swap%d' % (filename,self.swaps % 2)
+        with self._hdf5_locked():
+            rtbuf = self._build_rtbuf(new_personality,sk_flagger,side)
+        if rtbuf is None:
+            corelog.error("%s could not build realtime buffers for %s, keeping %s" % (self.name,personality.__name__,
+                                                                                    old_name))
+            return None
+        with self.realtime_lock:
+            try:
+                os.rename(side,filename)
+                renamed = True
+            except OSError:
+                corelog.exception("%s could not move new realtime h5 file into place" % self.name)
+                renamed = False
+            if renamed:
+                old_h5 = self.realtime_h5
+                self.personality = new_personality
+                self.sk_flagger = sk_flagger
+                self.realtime_filename = filename
+                self._use_rtbuf(rtbuf)
+                self.coefficients = {}
+                self.registers = {}
+                self.register_cache = {}
+                self.sk_acc_len_read = 0
+                self.window_config = {}     # channel ranges were resolved for the old personality
+                self.acc = 0
+                discarded = len(self.measurements_list)
+                self.measurements_dict = {}
+                self.measurements_list = []
+                discarded += self._drain_data_socket()
+                self.discard_until = time.time() + holdoff
+            else:
+                old_h5 = rtbuf['h5']
+        if old_h5:
+            with self._hdf5_locked():
+                try:
+                    old_h5.close()
+                except Exception:
+                    corelog.exception("%s could not close old realtime h5 file" % self.name)
+        if not renamed:
+            try:
+                os.remove(side)
+            except OSError:
+                pass
+            return None
+        corelog.info("%s Swapped to %s, discarded %d incomplete measurements and queued packets" %
+                     (self.name,personality.__name__,discarded))
+        return discarded
+
+    @contextlib.contextmanager
+    def _hdf5_locked(self):
+        """
+        internal: hold both locks the data loop writes HDF5 files under (realtime_lock, then h5_lock), for PyTables
+        calls made outside the data loop
+        """
+        with self.realtime_lock:
+            with self.h5_lock:
+                yield
+
+    def _drain_data_socket(self):
+        """
+        internal: discard all packets waiting in the data socket. Returns the number discarded
+        """
+        n = 0
+        while True:
+            try:
+                self.data_sock.recv(4096)
+            except socket.error:
+                return n
+            n += 1
+
     def get_personality(self):
         return self.personality
+
+    def _init_skflagger(self):
+        """
+        internal: set up spectral kurtosis flagging if the personality provides SK accumulations
+        """
+        self.sk_flagger = self._make_skflagger(self.personality)
+
+    def _make_skflagger(self,personality):
+        """
+        internal: return an SK flagger for *personality*, or None if it does not provide SK accumulations
+        """
+        try:
+            spectral_arrays = personality._measTypesDict['SpectralPower']['arrays']
+        except KeyError:
+            return None
+        if spectral_arrays.has_key('SK') and spectral_arrays.has_key('SKFlag'):
+            return spectralkurtosis.SKFlagger(spectral_arrays['II'][0],sigma=self.sk_sigma)
+        return None
+
+    def _init_snapshot_stats(self,personality=None):
+        """
+        internal: add the SnapshotStats measurement type for personalities which provide ADC snapshots. The
+        personality is given its own copy of _measTypesDict, which may be shared with other instances
+        """
+        if personality is None:
+            personality = self.personality
+        if personality._measTypesDict.has_key('ADCSnapshot'):
+            measurement_types = dict(personality._measTypesDict)
+            measurement_types['SnapshotStats'] = adcstats.statsMeasType(measurement_types['ADCSnapshot']['arrays'])
+            personality._measTypesDict = measurement_types
+            personality._measTypes = measurement_types.keys()
+
+    def set_sk_sigma(self,sigma):
+        """
+        Set the spectral kurtosis flagging threshold in standard deviations
+        """
+        self.sk_sigma = sigma
+        if self.sk_flagger is not None:
+            self.sk_flagger.setSigma(sigma)
+
+    def reset_rfi_occupancy(self):
+        """
+        Clear the running per-channel RFI occupancy statistics
+        """
+        if self.sk_flagger is not None:
+            self.sk_flagger.reset()
+
+    def get_rfi_occupancy(self):
+        """
+        Returns a dictionary with the per channel number of flagged spectra (FlaggedCount), number of spectra (Count),
+        fraction flagged (Fraction) and time the statistics were last reset (Since), or None if SK flagging is not available
+        """
+        f = self.sk_flagger
+        if f is None:
+            return None
+        return dict(FlaggedCount=f.flagged.copy(),Count=f.count,Fraction=f.occupancy(),Since=f.since)
         
         
     def reassemble_measurement(self, piece):
@@ -231,122 +481,339 @@ class IbobServer(Pyro.core.ObjBase):
     def _init_rtbuf(self):
         self.realtime_filename = "/tmp/rt%d.h5" % self.id
         corelog.info("Starting realtime data capture. Creating %s" %self.realtime_filename)
-        # try to open the realtime h5 file for writing
-        with self.realtime_lock:
-            try:
-                self.realtime_h5 = tables.openFile(self.realtime_filename, "w")
-            except Exception, e:
-                corelog.exception("could not open new realtime h5 file for writing: %s" % self.realtime_filename)
-                self.realtime_h5 = None
+        with self._hdf5_locked():
+            rtbuf = self._build_rtbuf(self.personality,self.sk_flagger,self.realtime_filename)
+            self._use_rtbuf(rtbuf)
+            if rtbuf is None:
                 self.realtime_filename = None
-                return
-            
-            # if no iBOBs are registered, error and quit
-            personality = self.personality
-            iBOB_group = self.realtime_h5.root
-            
-            self.realtime_h5.createTable(iBOB_group, "file_info", dict(personality=tables.StringCol(128,dflt=' ')))
-            iBOB_group.file_info.row['personality'] = self.personality.__class__.__name__
-            iBOB_group.file_info.row.append()
-            iBOB_group.file_info.flush()
-            
-            corelog.debug("set personality: %s" % str(iBOB_group.file_info[:]))
-            
-            self.realtime_iBOB_group = iBOB_group
-            
-            self.realtime_measurements = {}
-            iBOB_meas = self.realtime_measurements
-            
-            measurement_types = personality._measTypesDict
-            for measurement_type in measurement_types.keys():
-                corelog.debug("adding measurement type: %s" % measurement_type)
-                iBOB_meas[measurement_type] = {}
-                meas_grp = self.realtime_h5.createGroup(iBOB_group,measurement_type)
-                iBOB_meas[measurement_type]['group'] = meas_grp
-                thistable = \
-                    self.realtime_h5.createTable(meas_grp, 'table',
-                                                 measurement_types[measurement_type]['table'],
-                                                 expectedrows=2000)
-                iBOB_meas[measurement_type]['table'] = thistable
-                iBOB_meas[measurement_type]['arrays'] = {}
-                iBOB_meas[measurement_type]['index'] = self.realtime_h5.createArray(meas_grp, 'index', np.zeros((1,),dtype='uint32'))
-                for name,shape in measurement_types[measurement_type]['arrays'].items():
-                    if (name.lower().find('adc') >= 0):
-                        fullshape = tuple([16]+list(shape)) # kludge to reduce wasted space on lots of adc snapshots
-                    elif shape[0] > 1024:
-                        fullshape = tuple([2**20/shape[0]]+list(shape)) #keep size = 1Mpoint
-                    else:
-                        fullshape = tuple([MAX_REALTIME_ROWS]+list(shape))
-                    thisarr = self.realtime_h5.createArray(meas_grp, name, np.zeros(fullshape,dtype='float32'))
-                    iBOB_meas[measurement_type]['arrays'][name] = thisarr
-    
-            self.realtime_infotable = \
-                    self.realtime_h5.createTable(iBOB_group, "InfoTable",
-                            personality._infoTable, expectedrows = 2000)
-                    
         corelog.debug("Finished realtime data capture init %s" % self.name)
 
-    def start_writing(self,filename):
+    def _use_rtbuf(self,rtbuf):
+        """
+        internal: make the realtime buffers *rtbuf* (from :meth:`_build_rtbuf`, or None) current. Call with
+        realtime_lock held
+        """
+        if rtbuf is None:
+            rtbuf = dict(h5=None,group=None,measurements={},infotable=None,occupancy=None)
+        self.realtime_h5 = rtbuf['h5']
+        self.realtime_iBOB_group = rtbuf['group']
+        self.realtime_measurements = rtbuf['measurements']
+        self.realtime_infotable = rtbuf['infotable']
+        self.realtime_occupancy = rtbuf['occupancy']
+
+    def _build_rtbuf(self,personality,sk_flagger,filename):
+        """
+        internal: create the realtime h5 file *filename* with the groups, tables and ring buffer arrays for
+        *personality*. Returns a dictionary of the open file and its nodes, or None if the file could not be created
+        """
+        # try to open the realtime h5 file for writing
+        try:
+            realtime_h5 = tables.openFile(filename, "w")
+        except Exception, e:
+            corelog.exception("could not open new realtime h5 file for writing: %s" % filename)
+            return None
+
+        iBOB_group = realtime_h5.root
+
+        realtime_h5.createTable(iBOB_group, "file_info", dict(personality=tables.StringCol(128,dflt=' ')))
+        iBOB_group.file_info.row['personality'] = personality.__class__.__name__
+        iBOB_group.file_info.row.append()
+        iBOB_group.file_info.flush()
+
+        corelog.debug("set personality: %s" % str(iBOB_group.file_info[:]))
+
+        iBOB_meas = {}
+
+        measurement_types = personality._measTypesDict
+        for measurement_type in measurement_types.keys():
+            corelog.debug("adding measurement type: %s" % measurement_type)
+            iBOB_meas[measurement_type] = {}
+            meas_grp = realtime_h5.createGroup(iBOB_group,measurement_type)
+            iBOB_meas[measurement_type]['group'] = meas_grp
+            thistable = \
+                realtime_h5.createTable(meas_grp, 'table',
+                                        measurement_types[measurement_type]['table'],
+                                        expectedrows=2000)
+            iBOB_meas[measurement_type]['table'] = thistable
+            iBOB_meas[measurement_type]['arrays'] = {}
+            iBOB_meas[measurement_type]['index'] = realtime_h5.createArray(meas_grp, 'index', np.zeros((1,),dtype='uint32'))
+            for name,shape in measurement_types[measurement_type]['arrays'].items():
+                if (name.lower().find('adc') >= 0):
+                    fullshape = tuple([16]+list(shape)) # kludge to reduce wasted space on lots of adc snapshots
+                elif shape[0] > 1024:
+                    fullshape = tuple([2**20/shape[0]]+list(shape)) #keep size = 1Mpoint
+                else:
+                    fullshape = tuple([MAX_REALTIME_ROWS]+list(shape))
+                dtype = personality._arrayDtype(measurement_type,name)
+                thisarr = realtime_h5.createArray(meas_grp, name, np.zeros(fullshape,dtype=dtype))
+                iBOB_meas[measurement_type]['arrays'][name] = thisarr
+
+        infotable = realtime_h5.createTable(iBOB_group, "InfoTable",
+                                            personality._infoTable, expectedrows = 2000)
+
+        occupancy = None
+        if sk_flagger is not None:
+            occ_grp = realtime_h5.createGroup(iBOB_group,'RFIOccupancy')
+            occupancy = {
+                    'FlaggedCount' : realtime_h5.createArray(occ_grp, 'FlaggedCount', sk_flagger.flagged),
+                    'Count' : realtime_h5.createArray(occ_grp, 'Count', np.zeros((1,),dtype='uint32')),
+                    'Since' : realtime_h5.createArray(occ_grp, 'Since', np.array([sk_flagger.since]))
+                    }
+        realtime_h5.flush()
+        return dict(h5=realtime_h5,group=iBOB_group,measurements=iBOB_meas,infotable=infotable,occupancy=occupancy)
+
+    def start_writing(self,filename,fileinfo=None,at_acc=None):
+        """
+        Start recording to the history file *filename*
+
+        *fileinfo* is an optional dictionary (RSSConfigID, SPSSConfigID, ScanID, SourceID, Source) which is
+        entered in the :class:`~historycatalog.HistoryCatalog` along with the file when writing stops
+
+        If already writing, the recording is rotated to *filename* without losing any integrations: the switch is
+        made between measurements, before the first spectrum with AccNumber >= *at_acc* (or before the next
+        measurement if *at_acc* is None), and the previous file is closed and catalogued. *at_acc* is compared
+        modulo the 32 bit AccNumber counter, so it may be given past a wraparound. Call :meth:`prepare_next_file`
+        beforehand so that the new file is already created when the switch is made.
+        """
+        if self.writing and self.h5:
+            if self.next_file is None or self.next_file['filename'] != filename:
+                self.prepare_next_file(filename,fileinfo)
+            elif fileinfo is not None:
+                self.next_file['fileinfo'] = fileinfo
+            self.next_file['at_acc'] = at_acc
+            self.next_file['due'] = True
+            corelog.info("%s rotating to %s at %s" % (self.name,filename,
+                                                       'next measurement' if at_acc is None else 'acc %d' % at_acc))
+            return
+        self.fileinfo = fileinfo
         self.prepare_for_writing(filename)
         self.writing = True
-    def prepare_for_writing(self, filename):
+
+    def prepare_next_file(self,filename,fileinfo=None):
         """
-        prepares the real h5 (history) file to be written
+        Create the history file *filename*, ready for the next :meth:`start_writing`. HDF5 is not thread safe, so the
+        file is created in this process with both HDF5 locks held (see :meth:`_hdf5_locked`), between measurements
         """
-
-        
-        self.filename = filename
+        if self.next_file is not None:
+            self._discard_next_file()
         if os.path.isfile(filename):
             corelog.warning("%s  h5 filename %s already exists, overwriting..." % (self.name,filename))
-        
-        with self.h5_lock:
-            # try to open the file for writing
+        reduction_config = dict(self.reduction_config)
+        window_config = dict(self.window_config)
+        created = True
+        with self._hdf5_locked():
             try:
-                self.h5 = tables.openFile(self.filename,'w')
+                _create_history_file(filename,self.personality,reduction_config,window_config)
             except Exception, e:
+                corelog.exception("%s could not create h5 file %s" % (self.name,filename))
+                created = False
+        self.next_file = dict(filename=filename,fileinfo=fileinfo,created=created,reduction_config=reduction_config,
+                              window_config=window_config,at_acc=None,due=False)
+
+    def _discard_next_file(self):
+        """
+        internal: forget a prepared history file which will not be used
+        """
+        next_file = self.next_file
+        self.next_file = None
+        try:
+            os.remove(next_file['filename'])
+        except OSError:
+            pass
+
+    def _wait_next_file(self):
+        """
+        internal: open the prepared history file. Returns the history dictionary (see :meth:`_open_history`) or
+        None if it could not be created. Call with h5_lock held
+        """
+        next_file = self.next_file
+        self.next_file = None
+        if not next_file['created']:
+            return None
+        try:
+            history = self._open_history(next_file['filename'],next_file['reduction_config'],
+                                         next_file['window_config'])
+        except Exception, e:
+            corelog.exception("%s could not open new h5 file for writing: %s" % (self.name,next_file['filename']))
+            return None
+        history['fileinfo'] = next_file['fileinfo']
+        return history
+
+    def _rotation_due(self,measurement_type,table_data):
+        """
+        internal: True if a requested rotation should happen before recording this measurement
+        """
+        next_file = self.next_file
+        if next_file is None or not next_file['due']:
+            return False
+        if next_file['at_acc'] is None:
+            return True
+        if measurement_type != 'SpectralPower':
+            return False
+        # AccNumber >= at_acc, allowing for the counter wrapping around
+        return (table_data.get('AccNumber',0) - next_file['at_acc']) % ACC_MODULUS < ACC_MODULUS//2
+
+    def prepare_for_writing(self, filename):
+        """
+        prepares the real h5 (history) file to be written
+        """
+        if self.next_file is None or self.next_file['filename'] != filename:
+            self.prepare_next_file(filename,self.fileinfo)
+        with self._hdf5_locked():
+            history = self._wait_next_file()
+            if history is None:
                 self.h5 = None
                 self.filename = None
-                corelog.exception("%s could not open new h5 file for writing: %s" % (self.name,self.filename))
                 return
-            
-            self.comment_table = self.h5.createTable(self.h5.root, "comment_table",
-                        self.comment_table_description())
-            # set up tables for each iBOB based on each iBOB's personality
-            personality = self.personality
-            iBOB_group = self.h5.root
-            
-            self.h5.createTable(iBOB_group, "file_info", dict(personality=tables.StringCol(128,dflt=' ')))
-            iBOB_group.file_info.row['personality'] = self.personality.__class__.__name__
-            iBOB_group.file_info.row.append()
-            self.h5.flush()
-    
-            self.iBOB_group = iBOB_group
-            
-            self.measurements = {}
-            iBOB_meas = self.measurements
-            
-            measurement_types = personality._measTypesDict
-            for measurement_type in measurement_types.keys():
-                iBOB_meas[measurement_type] = {}
-                meas_grp = self.h5.createGroup(iBOB_group,measurement_type)
-                iBOB_meas[measurement_type]['group'] = meas_grp
-                thistable = \
-                    self.h5.createTable(meas_grp, 'table',
-                                                 measurement_types[measurement_type]['table'],
-                                                 expectedrows=2000)
-                iBOB_meas[measurement_type]['table'] = thistable
-                iBOB_meas[measurement_type]['arrays'] = {}
-                for name,shape in measurement_types[measurement_type]['arrays'].items():
-                    fullshape = tuple([0]+list(shape))
-                    thisarr = self.h5.createEArray(meas_grp, name, 
-                                                   tables.Float32Atom(),fullshape)
-                    iBOB_meas[measurement_type]['arrays'][name] = thisarr
-    
-            self.spec_info_table = self.h5.createTable(iBOB_group, "InfoTable",
-                                personality._infoTable, expectedrows = 2000)
+            history['fileinfo'] = self.fileinfo
+            self._use_history(history)
 
         corelog.debug("Finished creating h5 for writing %s" % self.name)
-    
+
+    def _open_history(self,filename,reduction_config,window_config):
+        """
+        internal: open the history file *filename* created by :func:`_create_history_file` and return a dictionary
+        of the file and the nodes written to
+        """
+        h5 = tables.openFile(filename,'a')
+        measurements = {}
+        measurement_types = self.personality._measTypesDict
+        windower = channelwindow.ChannelWindower(measurement_types,window_config)
+        for measurement_type in measurement_types.keys():
+            meas_grp = h5.getNode(h5.root,measurement_type)
+            meas = dict(group=meas_grp,table=meas_grp.table,arrays={})
+            for name in windower.storedArrays(measurement_type).keys():
+                meas['arrays'][name] = meas_grp._f_getChild(name)
+            if reduction_config.has_key(measurement_type):
+                meas['reduced'] = {}
+                for interval in reduction_config[measurement_type]['rates']:
+                    tag = downsample.rateTag(interval)
+                    reduced = dict(table=meas_grp._f_getChild('table_'+tag),arrays={})
+                    for key,(node,shape,dtype) in downsample.reducedArrays(
+                            measurement_types[measurement_type]['arrays'],tag).items():
+                        reduced['arrays'][key] = meas_grp._f_getChild(node)
+                    meas['reduced'][tag] = reduced
+            measurements[measurement_type] = meas
+        return dict(h5=h5,filename=filename,measurements=measurements,iBOB_group=h5.root,
+                    comment_table=h5.root.comment_table,spec_info_table=h5.root.InfoTable,
+                    reducer=downsample.IntegrationReducer(measurement_types,reduction_config),windower=windower,
+                    fileinfo=None)
+
+    def _use_history(self,history):
+        """
+        internal: make *history* the file being written. Call with h5_lock held
+        """
+        self.h5 = history['h5']
+        self.filename = history['filename']
+        self.measurements = history['measurements']
+        self.iBOB_group = history['iBOB_group']
+        self.comment_table = history['comment_table']
+        self.spec_info_table = history['spec_info_table']
+        self.reducer = history['reducer']
+        self.windower = history['windower']
+        self.fileinfo = history['fileinfo']
+
+    def _detach_history(self):
+        """
+        internal: return the history dictionary of the file being written and stop writing to it. Call with h5_lock
+        held
+        """
+        history = dict(h5=self.h5,filename=self.filename,measurements=self.measurements,iBOB_group=self.iBOB_group,
+                       comment_table=self.comment_table,spec_info_table=self.spec_info_table,reducer=self.reducer,
+                       windower=self.windower,fileinfo=self.fileinfo)
+        self.h5 = None
+        self.filename = None
+        self.spec_info_table = None
+        self.reducer = None
+        return history
+
+    def _rotate(self):
+        """
+        internal: switch writing to the prepared history file, then close the previous one and enter it in the
+        history catalog
+        """
+        with self.h5_lock:
+            history = self._wait_next_file()
+            if history is None:
+                corelog.error("%s rotation failed, continuing to write %s" % (self.name,self.filename))
+                return
+            old = self._detach_history()
+            self._use_history(history)
+            timestamps = self._close_history(old)
+        corelog.info("%s now writing %s" % (self.name,self.filename))
+        self.catalog_file(old['filename'],timestamps,old['fileinfo'])
+
+    def _close_history(self,history):
+        """
+        internal: write the last downsampled bins and close a history file which is no longer being written.
+        Returns the timestamps for its history catalog entry. Call with h5_lock held
+        """
+        timestamps = {}
+        try:
+            self._flush_reduced(history['reducer'],history['measurements'])
+            for measurement_type,meas in history['measurements'].items():
+                try:
+                    timestamps[measurement_type] = meas['table'].col('Timestamp')
+                    for tag,reduced in meas.get('reduced',{}).items():
+                        timestamps['%s_%s' % (measurement_type,tag)] = reduced['table'].col('Timestamp')
+                except Exception, e:
+                    corelog.exception("%s could not read timestamps of %s for catalog" % (self.name,measurement_type))
+        finally:
+            history['h5'].close()
+        return timestamps
+
+    def set_reduction(self,measurement_type,rates,fullrate=True):
+        """
+        Configure online downsampling of *measurement_type* (eg. 'SpectralPower') for the history file.
+
+        *rates* is a list of output intervals in seconds, eg. [1.0, 10.0]. Averages, minima, maxima and the number
+        of measurements averaged are stored for each interval. If *fullrate* is False the full rate data are
+        not stored.
+
+        Takes effect at the next call to :meth:`start_writing`
+        """
+        if rates:
+            self.reduction_config[measurement_type] = dict(rates=list(rates),fullrate=fullrate)
+        elif self.reduction_config.has_key(measurement_type):
+            del self.reduction_config[measurement_type]
+        if self.writing:
+            corelog.warning("%s reduction settings will take effect at next start_writing" % self.name)
+
+    def get_reduction(self):
+        return self.reduction_config
+
+    def set_channel_windows(self,measurement_type,windows,rf=True,overview=16,fullrate=False):
+        """
+        Configure channel window (sparse) recording of *measurement_type* (eg. 'SpectralPower') for the history
+        file, see :mod:`~dss28core.channelwindow`.
+
+        *windows* is a list of (f1, f2) frequency ranges in MHz: sky frequencies for the current RSS configuration
+        of this iBOB if *rf* is True, otherwise baseband frequencies of the personality's _bbfrq(). Only these
+        channels are stored, plus a full band overview averaged over *overview* adjacent channels (0 for none), plus
+        the full resolution arrays if *fullrate* is True. An empty list of windows returns to full recording.
+
+        Takes effect at the next call to :meth:`start_writing`. Returns the list of (start, stop) channel ranges
+        """
+        if not windows:
+            if self.window_config.has_key(measurement_type):
+                del self.window_config[measurement_type]
+            return []
+        rxstatus = None
+        if rf:
+            rxstatus = gavrtdb.GavrtDB().getRXStatusByIBob(self.id)
+        freqs = channelwindow.channelFrequencies(self.personality,rxstatus)
+        ranges = channelwindow.resolveWindows(freqs,windows)
+        self.window_config[measurement_type] = dict(windows=ranges,nchan=len(freqs),overview=overview,
+                                                    fullrate=fullrate,
+                                                    freqs=[(freqs[start],freqs[stop-1]) for start,stop in ranges])
+        corelog.info("%s channel windows for %s: %s" % (self.name,measurement_type,str(ranges)))
+        if self.writing:
+            corelog.warning("%s channel windows will take effect at next start_writing" % self.name)
+        return ranges
+
+    def get_channel_windows(self):
+        return self.window_config
+
 
     def record_measurement(self, measurement):
         """
@@ -367,6 +834,8 @@ class IbobServer(Pyro.core.ObjBase):
         arrays = spec_measurement[1]
         table_data = spec_measurement[2]
 #        print measurement_type, len(table_data),table_data
+        if self.sk_flagger is not None and arrays.has_key('SK'):
+            arrays['SKFlag'] = self.sk_flagger.process(arrays['II'],arrays['SK'],self._sk_acc_length())
         if measurement_type == 'S':
             acc = table_data['AccNumber']
             if acc - self.acc != 1:
@@ -374,9 +843,56 @@ class IbobServer(Pyro.core.ObjBase):
             self.acc = acc
         #self.publish('msr', spec_measurement)
         self.number_of_measurements += 1
+        if self._rotation_due(measurement_type,table_data):
+            self._rotate()
+        self._record(measurement_type,arrays,table_data)
+        if measurement_type == 'ADCSnapshot' and personality._measTypesDict.has_key('SnapshotStats'):
+            stats_arrays,stats_table = adcstats.statsMeasurement(arrays,table_data)
+            self._record('SnapshotStats',stats_arrays,stats_table)
+
+    def _sk_acc_length(self):
+        """
+        internal: number of spectra per integration (M) for the SK flagger, from the cached value of the
+        personality's acc_len register (kept up to date by :meth:`_refresh_registers` and by register reads and
+        writes through this server). Returns None if the value is not known. Called by the data loop, so never does
+        control socket I/O
+        """
+        register = self.personality._accLenRegister
+        cached = self.register_cache.get(register)
+        if cached is None:
+            return None
+        return self.personality._accLength({register:cached[0]})
+
+    def _refresh_registers(self):
+        """
+        internal: thread reading back the acc_len register used by the SK flagger when its cached value is missing
+        or older than SK_ACC_LEN_TTL, at most once per SK_ACC_LEN_TTL (also after a failed read, so an iBOB which
+        does not answer does not hold the control socket continually)
+        """
+        while self.running:
+            time.sleep(REFRESH_INTERVAL)
+            personality = self.personality
+            if self.sk_flagger is None or personality is None:
+                continue
+            register = personality._accLenRegister
+            cached = self.register_cache.get(register)
+            now = time.time()
+            if cached is not None and now - cached[1] <= SK_ACC_LEN_TTL:
+                continue
+            if now - self.sk_acc_len_read < SK_ACC_LEN_TTL:
+                continue
+            self.sk_acc_len_read = now
+            try:
+                if self.read_registers([register],max_age=SK_ACC_LEN_TTL)[register] is None:
+                    corelog.warning("%s could not read %s for the SK flagger" % (self.name,register))
+            except Exception:
+                corelog.exception("%s could not read %s for the SK flagger" % (self.name,register))
+
+    def _record(self,measurement_type,arrays,table_data):
+        """
+        internal: write one measurement to the realtime h5 file and, if writing, to the history file
+        """
         # always write to realtime h5 file
-        
-#        table_string = "%s_%s" % (measurement_type, "table_description")
         if not self.realtime_h5:
             corelog.warning("%s no realtime_h5 file opened yet, record_measurement failed" % self.name)
             return
@@ -414,6 +930,10 @@ class IbobServer(Pyro.core.ObjBase):
                     raise e
             self.realtime_measurements[measurement_type]['index'][0] = \
                     (index + 1) % rtarrays[arrays.keys()[0]].shape[0]
+            if self.realtime_occupancy is not None and arrays.has_key('SKFlag'):
+                self.realtime_occupancy['FlaggedCount'][:] = self.sk_flagger.flagged
+                self.realtime_occupancy['Count'][0] = self.sk_flagger.count
+                self.realtime_occupancy['Since'][0] = self.sk_flagger.since
             self.realtime_h5.flush()
                 # array.removeRows(0, 1)
 #            print "added to array"
@@ -424,28 +944,43 @@ class IbobServer(Pyro.core.ObjBase):
                 corelog.warning("%s we are writing but no h5 file opened yet??, record_measurement failed" % self.name)
                 return
             with self.h5_lock:
-                table = self.measurements[measurement_type]['table']
-                for key in table_data.keys():
-                    try:
-                        table.row[key] = table_data[key]
-                    except Exception, e:
-                        corelog.exception("%s could not insert data for key %s" %(self.name,str(key)))
-#                    print "added data for ",key
-                try:
-                    table.row.append()
-                except Exception, e:
-                    corelog.exception("%s could not append row to h5 file" % self.name)
-                #print "appended row"
-                table.flush()
-                #print "added to table"
-                rtarrays = self.measurements[measurement_type]['arrays']
-                for array_name in arrays.keys():
-                    rtarray = rtarrays[array_name]
-                    array_data = arrays[array_name]
-                    # if too long, do wraparound, index is stored in 
-                    # table_dict[array_string + "_index"]
-                    
-                    rtarray.append(array_data[np.newaxis,:])
+                meas = self.measurements[measurement_type]
+                if self.reducer.fullrate(measurement_type):
+                    self._append_history(meas['table'],meas['arrays'],self.windower.select(measurement_type,arrays),
+                                         table_data)
+                for tag,rarrays,rtable in self.reducer.add(measurement_type,arrays,table_data):
+                    reduced = meas['reduced'][tag]
+                    self._append_history(reduced['table'],reduced['arrays'],rarrays,rtable)
+
+    def _append_history(self,table,h5arrays,arrays,table_data):
+        """
+        internal: append one row to a history file table and its arrays. Call with h5_lock held
+        """
+        for key in table_data.keys():
+            try:
+                table.row[key] = table_data[key]
+            except Exception, e:
+                corelog.exception("%s could not insert data for key %s" %(self.name,str(key)))
+        try:
+            table.row.append()
+        except Exception, e:
+            corelog.exception("%s could not append row to h5 file" % self.name)
+        table.flush()
+        for array_name in arrays.keys():
+            h5arrays[array_name].append(arrays[array_name][np.newaxis,:])
+
+    def _flush_reduced(self,reducer,measurements):
+        """
+        internal: write partially filled downsampling bins of *reducer* to the history file *measurements*
+        """
+        if reducer is None:
+            return
+        for measurement_type,(tag,rarrays,rtable) in reducer.flush():
+            try:
+                reduced = measurements[measurement_type]['reduced'][tag]
+                self._append_history(reduced['table'],reduced['arrays'],rarrays,rtable)
+            except Exception, e:
+                corelog.exception("%s could not write final %s %s bin" % (self.name,measurement_type,tag))
 
 
     # ======================================
@@ -456,23 +991,27 @@ class IbobServer(Pyro.core.ObjBase):
         """
         Send and receive control commands to iBOB using robust UDP protocol
         """
+        with self.control_lock:
+            return self._sendget_robust(message)
+
+    def _sendget_robust(self,message):
+        """
+        internal: :meth:`sendget_robust` with control_lock held
+        """
         header_fmt = '>IHBB'
         self.control_flush()
         
         
         tstart = time.time()
         while time.time() - tstart < 1.0:
-            msgid = (0xFF<<24)+self.msgid
-            self.msgid += 1
-            if self.msgid > 0xFFFF00:
-                self.msgid = 0
+            msgid = self._next_msgid()
             hdr = struct.pack(header_fmt,msgid,0,0,0)
             msg = hdr + message
             self.control_send_msg(msg)
             tsend = time.time()
             resp = ''
             nextseq = 0
-            while time.time() - tsend < 0.2:
+            while time.time() - tsend < SENDGET_TIMEOUT:
                 r = self.readone()
                 if len(r) >= 8:
                     #print "waiting for seq:",nextseq,("msgid:%08X" %msgid)
@@ -497,6 +1036,69 @@ class IbobServer(Pyro.core.ObjBase):
                             
             
                 
+    def _next_msgid(self):
+        msgid = (0xFF<<24)+self.msgid
+        self.msgid += 1
+        if self.msgid > 0xFFFF00:
+            self.msgid = 0
+        return msgid
+
+    def sendget_many(self,messages,ok=None,window=SENDGET_WINDOW):
+        """
+        Send a batch of control commands using the robust UDP protocol with up to *window* commands in flight at
+        once, rather than waiting for each response before sending the next command.
+
+        Commands which get no response within SENDGET_TIMEOUT, or whose response does not contain *ok* (if given),
+        are resent up to SENDGET_ATTEMPTS times.
+
+        Returns a list of responses in the order of *messages*, with None for commands which did not succeed
+        """
+        with self.control_lock:
+            return self._sendget_many(messages,ok,window)
+
+    def _sendget_many(self,messages,ok,window):
+        """
+        internal: :meth:`sendget_many` with control_lock held
+        """
+        header_fmt = '>IHBB'
+        self.control_flush()
+        responses = [None]*len(messages)
+        attempts = [0]*len(messages)
+        pending = range(len(messages)-1,-1,-1)     # pop() from the end sends in order
+        inflight = {}       # msgid -> [index, response so far, next sequence number, time sent]
+        while pending or inflight:
+            while pending and len(inflight) < window:
+                idx = pending.pop()
+                msgid = self._next_msgid()
+                attempts[idx] += 1
+                self.control_send_msg(struct.pack(header_fmt,msgid,0,0,0) + messages[idx])
+                inflight[msgid] = [idx,'',0,time.time()]
+            r = self.readone()
+            if len(r) >= 8:
+                rxid,seq,type,blah = struct.unpack(header_fmt,r[:8])
+                entry = inflight.get(rxid)
+                if entry is not None and seq == entry[2]:
+                    entry[1] += r[8:]
+                    entry[2] += 1
+                    if type == 2:
+                        del inflight[rxid]
+                        idx = entry[0]
+                        if ok is None or entry[1].find(ok) > -1:
+                            responses[idx] = entry[1]
+                        elif attempts[idx] < SENDGET_ATTEMPTS:
+                            pending.append(idx)
+                continue
+            now = time.time()
+            for msgid,entry in inflight.items():
+                if now - entry[3] > SENDGET_TIMEOUT:
+                    del inflight[msgid]
+                    if attempts[entry[0]] < SENDGET_ATTEMPTS:
+                        pending.append(entry[0])
+            if inflight:
+                select.select([self.control_sock],[],[],0.005)
+        corelog.debug("%s sent %d commands with %d attempts" % (self.name,len(messages),sum(attempts)))
+        return responses
+
     def readone(self):
         try:
             read = self.control_read()
@@ -546,15 +1148,82 @@ class IbobServer(Pyro.core.ObjBase):
         if read != "\r":
             print "Error: incorrect output read after sending command: regwrite %s 0x%x" \
                     % (register, value)
+        self.registers[register] = int(value)
+        self.register_cache[register] = (int(value),time.time())
         
         # TODO: possibly add code to log this action in debug mode (have a column
         # that stores as strings the commands run)
 
+    def write_coefficients(self, table, command, addresses, values, ok='OK', full=False):
+        """
+        Upload coefficients, sending only those which differ from the last values known to be on the iBOB.
+
+        *table* names the coefficient table (eg. 'idd', 'eq'); a shadow copy of each table is kept per iBOB and
+        cleared when the personality is set. *command* is the iBOB command for one coefficient, formatted with the
+        keys address and value, eg. 'setcoeff 0x%(address)08X 0x%(value)08X'. *addresses* and *values* are
+        sequences of integers. Commands are sent in batches with :meth:`sendget_many` and a coefficient counts as
+        written when the response contains *ok*. If *full* is True all coefficients are sent.
+
+        Returns the number of coefficients sent
+        """
+        shadow = self.coefficients.setdefault(table,{})
+        changed = []
+        for addr,value in zip(addresses,values):
+            addr = int(addr)
+            value = int(value)
+            if full or shadow.get(addr) != value:
+                changed.append((addr,value))
+        messages = [command % dict(address=addr,value=value) for (addr,value) in changed]
+        responses = self.sendget_many(messages,ok=ok)
+        failed = 0
+        for (addr,value),resp in zip(changed,responses):
+            if resp is None:
+                shadow.pop(addr,None)
+                failed += 1
+            else:
+                shadow[addr] = value
+        corelog.debug("%s %s: sent %d of %d coefficients" % (self.name,table,len(changed),len(values)))
+        if failed:
+            raise Exception("%s could not set %d %s coefficients" % (self.name,failed,table))
+        return len(changed)
+
+    def get_recent(self, measurement_type='SpectralPower', array_name='II', n=16):
+        """
+        Return the last *n* entries of a realtime array, oldest first, along with their timestamps
+        """
+        with self._hdf5_locked():
+            meas = self.realtime_measurements[measurement_type]
+            arr = meas['arrays'][array_name]
+            index = meas['index'][0]
+            nrows = min(n,len(meas['table']),arr.shape[0])
+            if index >= nrows:
+                data = arr[index-nrows:index]
+            else:
+                data = np.concatenate((arr[arr.shape[0]-(nrows-index):],arr[:index]))
+            table = meas['table']
+            timestamps = table.col('Timestamp')[len(table)-nrows:]
+        return data,timestamps
+
+    def clear_coefficients(self, table=None):
+        """
+        Forget the shadow copy of coefficient *table* (or of all tables), forcing a full upload next time
+        """
+        if table is None:
+            self.coefficients = {}
+        else:
+            self.coefficients.pop(table,None)
+
     def read_register(self, register):
         """
         given a register, tries to read the value of the register
         """
         resp = self.sendget_command("regread %s" % register)
+        value = self._parse_regread(resp)
+        if value is not None:
+            self.register_cache[register] = (value,time.time())
+        return value
+
+    def _parse_regread(self, resp):
         try:
             st = resp.find('0x')
             r = resp[st:st+10]
@@ -564,6 +1233,35 @@ class IbobServer(Pyro.core.ObjBase):
             print "received",resp,"could not parse"
             return None
 
+    def read_registers(self, registers, max_age=REGISTER_CACHE_TTL):
+        """
+        Read several registers at once, returning a dictionary of register: value (None if the read failed).
+
+        Values read (or written) within the last *max_age* seconds are returned from a cache, so dashboards and
+        personalities polling the same iBOB share one readback per interval. The remaining registers are read with
+        concurrent regread commands (see :meth:`sendget_many`).
+        """
+        now = time.time()
+        result = {}
+        toread = []
+        for register in registers:
+            cached = self.register_cache.get(register)
+            if cached is not None and now - cached[1] <= max_age:
+                result[register] = cached[0]
+            else:
+                toread.append(register)
+        if toread:
+            responses = self.sendget_many(["regread %s" % register for register in toread])
+            now = time.time()
+            for register,resp in zip(toread,responses):
+                value = None
+                if resp is not None:
+                    value = self._parse_regread(resp)
+                if value is not None:
+                    self.register_cache[register] = (value,now)
+                result[register] = value
+        return result
+
 
             
 
@@ -571,14 +1269,10 @@ class IbobServer(Pyro.core.ObjBase):
         """
         this should really be a constant, but it just returns the comment table description
         """
-        return {
-                "UserID" : tables.StringCol(20, dflt="User"),
-                "Comment" : tables.StringCol(MAX_CHARS_PER_COMMENT),
-                "Timestamp" : tables.Float64Col()
-               }
+        return comment_table_description()
 
     def write_comment(self, user_id, comment):
-        with self.h5_lock:
+        with self._hdf5_locked():
             if not self.h5:
                 print "Error: no h5 file open, cannot write comment"
                 return
@@ -593,40 +1287,54 @@ class IbobServer(Pyro.core.ObjBase):
         write the given spec_info_dict as spec data changes to the spec_info table
         """
         
-        table = self.realtime_infotable
-        print "write_spec_info"
-        with self.realtime_lock:
-            print "got lock"
+        now = time.time()
+        with self._hdf5_locked():
+            table = self.realtime_infotable
             if self.realtime_h5:
-                print "rt5 exists"
                 for attribute in spec_info_dict.keys():
-                    print "writing",attribute
                     table.row[attribute] = spec_info_dict[attribute]
-                    table.row["Timestamp"] = time.time()
-                    
+                table.row["Timestamp"] = now
                 table.row.append()
                 table.flush()
-                
-        table = self.spec_info_table
-        
-        with self.h5_lock:
+
+            table = self.spec_info_table
             if not self.h5:
-                print "Error: no h5 file open, cannot write spec info"
+                corelog.debug("%s no h5 file open, spec info only written to realtime file" % self.name)
                 return
             for attribute in spec_info_dict.keys():
                 table.row[attribute] = spec_info_dict[attribute]
-                table.row["Timestamp"] = time.time()
+            table.row["Timestamp"] = now
             table.row.append()
             table.flush()
     
 
     def stop_writing(self):
+        """
+        Stop recording, close the history file and enter it in the history catalog. A rotation requested by
+        :meth:`start_writing` which has not yet happened is cancelled; a file prepared by :meth:`prepare_next_file`
+        is kept for the next :meth:`start_writing`
+        """
         self.writing = False
+        if self.next_file is not None and self.next_file['due']:
+            corelog.warning("%s cancelling rotation to %s" % (self.name,self.next_file['filename']))
+            self._discard_next_file()
         if self.h5:
-            with self.h5_lock:
-                self.h5.close()
-                self.h5 = None
-                self.filename = None
+            with self._hdf5_locked():
+                history = self._detach_history()
+                timestamps = self._close_history(history)
+            self.catalog_file(history['filename'],timestamps,history['fileinfo'])
+
+    def catalog_file(self,filename,timestamps,fileinfo=None):
+        """
+        internal: enter a closed history file in the history catalog
+        """
+        try:
+            with self.catalog_lock:
+                if self.catalog is None:
+                    self.catalog = historycatalog.HistoryCatalog()
+                self.catalog.addFile(filename,self.id,self.personality.__class__.__name__,timestamps,fileinfo)
+        except Exception, e:
+            corelog.exception("%s could not add %s to history catalog" % (self.name,filename))
 
     
 
@@ -0,0 +1,99 @@
+"""
+:mod:`dss28core.adcstats`
+-------------------------
+
+Capture-time statistics of ADC snapshots.
+
+Each ADCSnapshot array (*adcI*, and *adcQ* for two input designs) is reduced to a histogram of the 256 possible
+8 bit sample values, the mean, RMS, fraction of clipped samples and a Welch averaged power spectrum. The
+moments are computed from the histogram, so the int8 samples are only converted to floating point for the FFT.
+
+The statistics are recorded by :class:`~dss28core.IbobServer.IbobServer` as the *SnapshotStats* measurement type,
+which is much cheaper to serve to dashboards than the raw snapshots.
+"""
+try:
+    import tables
+except:
+    import dummytables as tables
+
+import numpy as np
+
+NFFT = 256
+HISTOGRAM_BINS = 256
+
+_values = np.arange(-128,128)
+
+def histogram(samples):
+    """
+    Histogram of int8 *samples*. Bin k counts the samples with value k-128
+    """
+    return np.bincount(samples.view('uint8') ^ 0x80, minlength=HISTOGRAM_BINS)
+
+def welchSpectrum(samples,nfft=NFFT):
+    """
+    Welch averaged power spectrum (nfft/2+1 channels) of *samples* using non-overlapping Hann windowed segments
+    """
+    nseg = samples.shape[0]//nfft
+    segs = samples[:nseg*nfft].reshape((nseg,nfft)).astype('float32')
+    window = np.hanning(nfft).astype('float32')
+    spec = np.abs(np.fft.rfft(segs*window,axis=1))**2
+    return spec.mean(axis=0)/(window**2).sum()
+
+def snapshotStats(samples,nfft=NFFT):
+    """
+    Compute statistics of a single int8 ADC snapshot
+
+    Returns a dictionary with keys Histogram, Mean, RMS, ClipFraction and PSD
+    """
+    samples = np.asarray(samples)
+    if samples.dtype != np.int8:
+        samples = samples.astype('int8')
+    hist = histogram(samples)
+    n = float(hist.sum())
+    mean = np.dot(hist,_values)/n
+    rms = np.sqrt(np.dot(hist,_values**2)/n)
+    clip = (hist[0] + hist[-1])/n
+    return dict(Histogram=hist,Mean=mean,RMS=rms,ClipFraction=clip,PSD=welchSpectrum(samples,nfft))
+
+def _suffix(array_name):
+    # adcI -> I, adcQ -> Q
+    return array_name[3:]
+
+def statsMeasType(adcArrays,nfft=NFFT):
+    """
+    Build the _measTypesDict entry for the SnapshotStats measurement type given the ADCSnapshot *adcArrays*
+    dictionary of a personality
+    """
+    table = {
+             'ID':tables.Int64Col(),
+             'AccNumber':tables.Int64Col(),
+             'Timestamp':tables.Float64Col(),
+             }
+    arrays = {}
+    dtypes = {}
+    for name in adcArrays:
+        sfx = _suffix(name)
+        table['Mean'+sfx] = tables.Float32Col()
+        table['RMS'+sfx] = tables.Float32Col()
+        table['ClipFraction'+sfx] = tables.Float32Col()
+        arrays['hist'+sfx] = (HISTOGRAM_BINS,)
+        arrays['psd'+sfx] = (nfft/2+1,)
+        dtypes['hist'+sfx] = 'uint32'
+    return {"table":table, "arrays":arrays, "dtypes":dtypes}
+
+def statsMeasurement(arrays,table_data,nfft=NFFT):
+    """
+    Compute the SnapshotStats measurement for an ADCSnapshot measurement. Returns (arraydict, tabledict)
+    """
+    sarrays = {}
+    stable = {'Timestamp':table_data['Timestamp'],
+              'AccNumber':table_data.get('AccNumber',0)}
+    for name,samples in arrays.items():
+        sfx = _suffix(name)
+        st = snapshotStats(samples,nfft)
+        stable['Mean'+sfx] = st['Mean']
+        stable['RMS'+sfx] = st['RMS']
+        stable['ClipFraction'+sfx] = st['ClipFraction']
+        sarrays['hist'+sfx] = st['Histogram']
+        sarrays['psd'+sfx] = st['PSD']
+    return sarrays,stable
@@ -0,0 +1,125 @@
+"""
+:mod:`dss28core.channelwindow`
+------------------------------
+
+Channel window (sparse) recording for :class:`~dss28core.IbobServer.IbobServer`.
+
+For spectral line work only a few channel ranges of the spectra are of interest. When channel windows are set
+for a measurement type (see :meth:`~dss28core.IbobServer.IbobServer.set_channel_windows`), every array with one
+value per channel is stored in the history file as::
+
+    SpectralPower/II_w0         channels start0:stop0 of II
+    SpectralPower/II_w1         channels start1:stop1 of II
+    SpectralPower/II_overview   mean of II over groups of *overview* adjacent channels
+    SpectralPower/windows       (start, stop) channel index range of each window
+    SpectralPower/window_freqs  frequencies (MHz) of the first and last channel of each window
+
+The full resolution arrays are only stored as well if *fullrate* is set. Arrays with a different length (eg. the
+packed SKFlag bits) are always stored in full.
+"""
+
+import numpy as np
+
+def channelFrequencies(personality,rxstatus=None):
+    """
+    Channel frequencies (MHz) of *personality*: baseband, or sky frequencies if *rxstatus* (as returned by
+    :meth:`gavrtdb.GavrtDB.getRXStatusByIBob`) is given, computed as in
+    :meth:`~dss28core.datainterface.DataInterface._calcBBRF`
+    """
+    bb = np.asarray(personality._bbfrq(),dtype='float64')
+    if rxstatus is None:
+        return bb
+    if personality._adcClock < 200:
+        bb = bb + 2*personality._adcClock     #if clk is 128, we want bb to go from 256 MHz to 384 MHz
+    return rxstatus['f0'] + rxstatus['Sideband']*bb
+
+def resolveWindows(freqs,windows):
+    """
+    Convert frequency *windows* [(f1, f2), ...] in MHz to the channel index ranges [(start, stop), ...] of *freqs*
+    which they cover. A window covering channels which are not contiguous (eg. fftshifted spectra) gives one range
+    per contiguous run.
+    """
+    freqs = np.asarray(freqs)
+    ranges = []
+    for f1,f2 in windows:
+        lo,hi = min(f1,f2),max(f1,f2)
+        chans = np.flatnonzero((freqs >= lo) & (freqs <= hi))
+        if len(chans) == 0:
+            raise ValueError("window %g-%g MHz contains no channels, spectrum covers %g-%g MHz" %
+                             (lo,hi,freqs.min(),freqs.max()))
+        breaks = np.flatnonzero(np.diff(chans) != 1)
+        starts = np.concatenate(([chans[0]],chans[breaks+1]))
+        stops = np.concatenate((chans[breaks],[chans[-1]])) + 1
+        ranges.extend([(int(start),int(stop)) for start,stop in zip(starts,stops)])
+    return ranges
+
+class ChannelWindower(object):
+    """
+    Selects the stored arrays of each measurement according to *config*
+
+    *measTypesDict* is the personality's _measTypesDict
+
+    *config* is a dictionary mapping measurement type to a dictionary with keys:
+
+    * *windows* - list of (start, stop) channel index ranges
+    * *freqs* - list of (first, last) channel frequency of each window, stored for reference
+    * *nchan* - number of channels; arrays of this length are windowed
+    * *overview* - number of adjacent channels averaged for the full band overview (0 for none)
+    * *fullrate* - if True, the full resolution arrays are also stored
+    """
+    def __init__(self,measTypesDict,config):
+        self.config = {}
+        for measurement_type,cfg in config.items():
+            if measTypesDict.has_key(measurement_type):
+                self.config[measurement_type] = cfg
+        self.measTypesDict = measTypesDict
+
+    def windowed(self,measurement_type,name):
+        """
+        True if array *name* of *measurement_type* is stored as channel windows
+        """
+        cfg = self.config.get(measurement_type)
+        if cfg is None:
+            return False
+        return self.measTypesDict[measurement_type]['arrays'][name][0] == cfg['nchan']
+
+    def storedArrays(self,measurement_type):
+        """
+        Returns a dictionary of stored array name: (source array name, shape, overview) for *measurement_type*,
+        where overview is True for the full band overview arrays
+        """
+        cfg = self.config.get(measurement_type)
+        out = {}
+        for name,shape in self.measTypesDict[measurement_type]['arrays'].items():
+            if not self.windowed(measurement_type,name):
+                out[name] = (name,shape,False)
+                continue
+            if cfg.get('fullrate',False):
+                out[name] = (name,shape,False)
+            for k,(start,stop) in enumerate(cfg['windows']):
+                out['%s_w%d' % (name,k)] = (name,tuple([stop-start]+list(shape[1:])),False)
+            if cfg.get('overview',0):
+                out[name+'_overview'] = (name,tuple([shape[0]/cfg['overview']]+list(shape[1:])),True)
+        return out
+
+    def select(self,measurement_type,arrays):
+        """
+        Returns the dictionary of arrays to store for one measurement
+        """
+        cfg = self.config.get(measurement_type)
+        if cfg is None:
+            return arrays
+        out = {}
+        for name,data in arrays.items():
+            if not self.windowed(measurement_type,name):
+                out[name] = data
+                continue
+            if cfg.get('fullrate',False):
+                out[name] = data
+            for k,(start,stop) in enumerate(cfg['windows']):
+                out['%s_w%d' % (name,k)] = data[start:stop]
+            n = cfg.get('overview',0)
+            if n:
+                nout = data.shape[0]/n
+                out[name+'_overview'] = data[:nout*n].reshape((nout,n)+data.shape[1:]).mean(axis=1)
+        return out
@@ -27,7 +27,13 @@ class DataInterface(Pyro.core.ObjBase):
         self.Data = Storage
     def ping(self):
         return True
-    def getData(self,bbrf=True):
+    def getData(self,bbrf=True,snapshots=True):
+        """
+        Read the realtime data of all iBOBs.
+
+        If *snapshots* is False the raw ADCSnapshot arrays are skipped; the SnapshotStats measurement is usually
+        all a dashboard needs.
+        """
 #        print "getData"
         d = self.Data()
 
@@ -55,29 +61,12 @@ class DataInterface(Pyro.core.ObjBase):
                         ibc.file_info = meas[:]
                         ibc.personality = ibc.file_info[0]['personality'] 
                         continue
-                    mc = self.Data()
-                    shortname = ''
-                    for k in name:
-                        if k == k.upper():
-                            shortname += k
-                    ibc.__setattr__(shortname,mc)
-                    idx = meas.index[0]
-                    table = meas.table[:]
-                    for k in table.dtype.fields.keys():
-                    #    print "key",k
-                        mc.__setattr__(k,table[k])
-                    for arry in meas:
-                        
-                        name = arry._v_name
-                    #    print "arry",name
-                        if name in ['index','table']:
-                            continue
-                        a = arry[:]
-                        alen = a.shape[0]
-                        fixarry = np.empty_like(a)
-                        fixarry[:(alen-idx)] = a[idx:]
-                        fixarry[(alen-idx):] = a[:idx]
-                        mc.__setattr__(name,fixarry)
+                    if name in ['RFIOccupancy']:
+                        ibc.RFIOccupancy = self._readOccupancy(meas)
+                        continue
+                    if name in ['ADCSnapshot'] and not snapshots:
+                        continue
+                    ibc.__setattr__(self._shortName(name),self._readMeasurement(meas))
             except IOError, e:
                 pass
             
@@ -95,6 +84,75 @@ class DataInterface(Pyro.core.ObjBase):
 #        print "returning d"
         return d
     
+    def getRFIOccupancy(self,ib):
+        """
+        Return the running spectral kurtosis RFI occupancy of iBOB *ib*, with attributes FlaggedCount, Count,
+        Since and Fraction (per channel fraction of spectra flagged). Returns None if not available
+        """
+        return self._readRealtime(ib,lambda h5: self._readOccupancy(h5.root.RFIOccupancy))
+
+    def getSnapshotStats(self,ib):
+        """
+        Return only the SnapshotStats measurement (ADC histogram, mean, RMS, clip fraction and PSD of each recent
+        snapshot) of iBOB *ib*, or None if not available
+        """
+        return self._readRealtime(ib,lambda h5: self._readMeasurement(h5.root.SnapshotStats))
+
+    def _readRealtime(self,ib,read):
+        """
+        Open the realtime file of iBOB *ib*, return read(h5) and close the file. Returns None if the file or the
+        node read does not exist
+        """
+        h5 = None
+        try:
+            h5 = openFile(self._h5 % ib,'r')
+            return read(h5)
+        except (IOError, NoSuchNodeError):
+            return None
+        finally:
+            if h5 is not None:
+                h5.close()
+
+    def _shortName(self,name):
+        # SpectralPower -> SP
+        shortname = ''
+        for k in name:
+            if k == k.upper():
+                shortname += k
+        return shortname
+
+    def _readMeasurement(self,meas):
+        """
+        Read a realtime measurement group, unwrapping the ring buffer so the oldest entry comes first
+        """
+        mc = self.Data()
+        idx = meas.index[0]
+        table = meas.table[:]
+        for k in table.dtype.fields.keys():
+            mc.__setattr__(k,table[k])
+        for arry in meas:
+            name = arry._v_name
+            if name in ['index','table']:
+                continue
+            a = arry[:]
+            alen = a.shape[0]
+            fixarry = np.empty_like(a)
+            fixarry[:(alen-idx)] = a[idx:]
+            fixarry[(alen-idx):] = a[:idx]
+            mc.__setattr__(name,fixarry)
+        return mc
+
+    def _readOccupancy(self,grp):
+        occ = self.Data()
+        occ.FlaggedCount = grp.FlaggedCount[:]
+        occ.Count = grp.Count[0]
+        occ.Since = grp.Since[0]
+        if occ.Count:
+            occ.Fraction = occ.FlaggedCount/float(occ.Count)
+        else:
+            occ.Fraction = np.zeros(occ.FlaggedCount.shape)
+        return occ
+    
     def _setupPersonalities(self):
         self.spss = self._gdb.getSPSSStatus()
         self._personalities = {}
@@ -0,0 +1,196 @@
+"""
+:mod:`dss28core.downsample`
+---------------------------
+
+Streaming integration (downsampling) stage for :class:`~dss28core.IbobServer.IbobServer`.
+
+Running sums, minima and maxima of each array of a measurement type are kept for one or more coarser output
+rates. Whenever a measurement falls in a new time bin (bins are aligned to multiples of the output interval in
+UnixTime) the finished bin is emitted as the mean, min and max of each array along with the number of
+measurements averaged.
+
+In the history file the reduced data for an interval of 1 s of the SpectralPower measurement type are stored as::
+
+    SpectralPower/II_1s         mean
+    SpectralPower/II_1s_min     minimum
+    SpectralPower/II_1s_max     maximum
+    SpectralPower/table_1s      Timestamp (bin start), StartTime, EndTime, AccNumber (first), Count
+
+Bit packed flag arrays (:data:`PACKED_FLAG_ARRAYS`, eg. SKFlag) are not averaged: a single uint8 array holds the OR of
+the flags of the measurements in the bin, ie. a channel is flagged if it was flagged in any of them.
+"""
+try:
+    import tables
+except:
+    import dummytables as tables
+
+import numpy as np
+
+PACKED_FLAG_ARRAYS = ['SKFlag']     # arrays of flags packed 8 channels per byte, combined with OR
+
+def rateTag(interval):
+    """
+    Name suffix used for the arrays of an output interval (seconds). eg. 1 -> '1s', 0.5 -> '0p5s'
+    """
+    return ('%gs' % interval).replace('.','p')
+
+def reducedTableDescription():
+    return {
+            'Timestamp':tables.Float64Col(),
+            'StartTime':tables.Float64Col(),
+            'EndTime':tables.Float64Col(),
+            'AccNumber':tables.Int64Col(),
+            'Count':tables.UInt32Col()
+            }
+
+def reducedArrays(shapes,tag):
+    """
+    The reduced arrays stored for an output interval with name suffix *tag* of arrays with *shapes* (dictionary of
+    name: shape). Returns a dictionary of key in the reduced records: (h5 array name, shape, dtype)
+    """
+    out = {}
+    for name,shape in shapes.items():
+        if name in PACKED_FLAG_ARRAYS:
+            out[name] = ('%s_%s' % (name,tag),shape,'uint8')
+            continue
+        for suffix in ['','_min','_max']:
+            out[name+suffix] = ('%s_%s%s' % (name,tag,suffix),shape,'float32')
+    return out
+
+class RateAccumulator(object):
+    """
+    Running sums for a single output interval of a single measurement type
+    """
+    def __init__(self,interval,shapes):
+        self.interval = float(interval)
+        self.tag = rateTag(interval)
+        self.shapes = shapes
+        self.sums = {}
+        self.mins = {}
+        self.maxs = {}
+        self.counts = {}
+        self.ors = {}
+        for name,shape in shapes.items():
+            if name in PACKED_FLAG_ARRAYS:
+                self.ors[name] = np.zeros(shape,dtype='uint8')
+                continue
+            self.sums[name] = np.zeros(shape,dtype='float64')
+            self.mins[name] = np.empty(shape,dtype='float64')
+            self.maxs[name] = np.empty(shape,dtype='float64')
+        self._reset(None)
+
+    def _reset(self,bin):
+        self.bin = bin
+        self.count = 0
+        self.start = None
+        self.end = None
+        self.accnum = 0
+        for name in self.sums:
+            self.sums[name][...] = 0
+            self.mins[name][...] = np.inf
+            self.maxs[name][...] = -np.inf
+        for name in self.ors:
+            self.ors[name][...] = 0
+        for name in self.shapes:
+            self.counts[name] = 0
+
+    def add(self,timestamp,arrays,table):
+        """
+        Add one measurement. Returns the finished record of the previous bin if this measurement starts a new bin,
+        otherwise None
+        """
+        bin = int(np.floor(timestamp/self.interval))
+        done = None
+        if bin != self.bin:
+            done = self.flush()
+            self.bin = bin
+        if self.count == 0:
+            self.start = timestamp
+            self.accnum = table.get('AccNumber',0)
+        self.end = timestamp
+        self.count += 1
+        for name,data in arrays.items():
+            if self.ors.has_key(name):
+                np.bitwise_or(self.ors[name],data,self.ors[name])
+                self.counts[name] += 1
+                continue
+            if not self.sums.has_key(name):
+                continue
+            np.add(self.sums[name],data,self.sums[name])
+            np.minimum(self.mins[name],data,self.mins[name])
+            np.maximum(self.maxs[name],data,self.maxs[name])
+            self.counts[name] += 1
+        return done
+
+    def flush(self):
+        """
+        Return the record for the current bin (or None if empty) and clear the running sums
+        """
+        if self.count == 0:
+            return None
+        table = dict(Timestamp=self.bin*self.interval,StartTime=self.start,EndTime=self.end,
+                     AccNumber=self.accnum,Count=self.count)
+        arrays = {}
+        for name in self.ors:
+            arrays[name] = self.ors[name].copy()
+        for name in self.sums:
+            n = self.counts[name]
+            if n:
+                arrays[name] = self.sums[name]/n
+                arrays[name+'_min'] = self.mins[name].copy()
+                arrays[name+'_max'] = self.maxs[name].copy()
+            else:
+                arrays[name] = np.nan*np.ones(self.shapes[name])
+                arrays[name+'_min'] = arrays[name]
+                arrays[name+'_max'] = arrays[name]
+        self._reset(self.bin)
+        return (self.tag,arrays,table)
+
+class IntegrationReducer(object):
+    """
+    Reduces the measurements of a personality according to *config*
+
+    *measTypesDict* is the personality's _measTypesDict
+
+    *config* is a dictionary mapping measurement type to a dictionary with keys:
+
+    * *rates* - list of output intervals in seconds, eg. [1.0, 10.0]
+    * *fullrate* - if False, the full rate data are not written to the history file
+    """
+    def __init__(self,measTypesDict,config):
+        self.config = config
+        self.accumulators = {}
+        for measurement_type,cfg in config.items():
+            if not measTypesDict.has_key(measurement_type):
+                continue
+            shapes = measTypesDict[measurement_type]['arrays']
+            self.accumulators[measurement_type] = [RateAccumulator(interval,shapes) for interval in cfg['rates']]
+
+    def fullrate(self,measurement_type):
+        try:
+            return self.config[measurement_type].get('fullrate',True)
+        except KeyError:
+            return True
+
+    def add(self,measurement_type,arrays,table):
+        """
+        Add one measurement. Returns a list of finished (tag, arraydict, tabledict) records
+        """
+        out = []
+        for acc in self.accumulators.get(measurement_type,[]):
+            done = acc.add(table['Timestamp'],arrays,table)
+            if done is not None:
+                out.append(done)
+        return out
+
+    def flush(self):
+        """
+        Returns a list of (measurement_type, (tag, arraydict, tabledict)) for all partially filled bins
+        """
+        out = []
+        for measurement_type,accs in self.accumulators.items():
+            for acc in accs:
+                done = acc.flush()
+                if done is not None:
+                    out.append((measurement_type,done))
+        return out
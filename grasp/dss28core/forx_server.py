@@ -11,6 +11,9 @@ The 100 MHz reference transmitter monitor point (FOTXMon) should typically read
 
 The SPSS 1 Rack temperature at the LabJack data recorder is also recorded.
 
+Rows are only recorded when a monitor point changes by more than its deadband (see :data:`deadbands`) or every
+:data:`deadband.HEARTBEAT` seconds; use :func:`grasp.deadband.readSeries` to read them back as a regular series.
+
 This should be started automatically, simply running forx_server
 
 """
@@ -20,6 +23,7 @@ import sys, time
 import myu3 as u3
 
 import grasp.gavrtdb as gavrtdb
+import grasp.deadband as deadband
 import time
 
 from loggers import corelog
@@ -36,6 +40,10 @@ channelmap = {0:'Minus12V',
             14:'FORXMon3',
             15:'FORXMon1',
             }
+deadbands = dict([(name,0.05) for name in channelmap.values()])    # V
+deadbands['Minus12V'] = deadbands['Plus12V'] = 0.2
+deadbands['RackTemp'] = 0.5     # C
+
 class FORXServer():
     """
     This class wraps the LabJack and provides a single getStatus method.
@@ -46,6 +54,12 @@ class FORXServer():
 #        self.lj.setFIODir(4,0)
         #self.lj.getCalibrationData()
         
+    def close(self):
+        """
+        Close the LabJack
+        """
+        self.lj.close()
+
     def setRssCubeReset(self,state=0):
         """
         Set RSS Cube Reset signal
@@ -93,50 +107,35 @@ class FORXDBWriter():
     """
     Creates a :class:`~FORXServer` and repeatedly polls the monitor points and stores them in the gavrtdb.
     
-    This class should be instantiated, then the :meth:`~loop` method called which loops indefinitely.
+    This class should be instantiated, then the :meth:`~loop` method called which loops indefinitely. A *gdb* may be
+    passed in to share one with other writers (see :mod:`monitor_host`).
     """
-    def __init__(self):
-        try:
-            self.pdb = gavrtdb.GavrtDB(rw=True)
-        except:
-            corelog.exception("Could not connect to GavrtDB")
+    def __init__(self,gdb=None):
+        if gdb is None:
+            try:
+                gdb = gavrtdb.GavrtDB(rw=True)
+            except:
+                corelog.exception("Could not connect to GavrtDB")
+        self.pdb = gdb
+        self.recorder = deadband.DeadbandRecorder(self.pdb,'forx_mon',deadbands)
         try:
             self.fs = FORXServer()
         except:
             corelog.exception("Could not connect to Fiber Monitor LabJack. Perhaps FORX mon already running?")
+            raise
+    def poll(self):
+        """
+        Read the monitor points once and record them
+        """
+        rec = dict(self.fs.getStatus())
+        rec['UnixTime'] = time.time()
+        self.recorder.update(rec)
     def loop(self):
         while True:
             try:
-                data = self.fs.getStatus()
+                self.poll()
             except:
                 corelog.exception("Could not get Fiber Monitor data from LabJack")
-                time.sleep(60)
-                continue
-            
-            keystr = ''
-            valstr = ''
-            values = []
-            for k,v in data.items():
-                keystr = keystr + k + ', '
-                valstr = valstr + '%s, '
-                values.append(v)
-            keystr = keystr + 'UnixTime'
-            valstr = valstr + '%s'
-            values.append(time.time())
-            try:
-                c = self.pdb.cursor()
-                c.executemany(
-                         "INSERT INTO forx_mon (" + keystr + ") VALUES (" + valstr + ");",
-                         [tuple(values)])
-                print "INSERT INTO forx_mon (" + keystr + ") VALUES (" + valstr + ");",tuple(values)
-                self.pdb.commit()
-            except Exception, e:
-                corelog.exception("Could not log to GavrtDB, will try reconnecting")
-                try:
-                    self.pdb = gavrtdb.GavrtDB(rw=True)
-                except Exception, e:
-                    corelog.exception("Could not reconnect to GavrtDB")
-                
             time.sleep(60)
             
 if __name__ == "__main__":
@@ -63,6 +63,25 @@ class iBOBProcessServer(Pyro.core.ObjBase):
             self.iBOBProxies[ib] = thisiBOB
             corelog.info("Set personality for ibob %d" % ib)
 
+    def _swapPersonalities(self,ibs):
+        """
+        Switch running iBOB servers to the personality now in the database (e.g. after loading new designs)
+        without restarting them. Servers which are not running are started
+        """
+        ns = Pyro.naming.NameServerLocator().getNS()
+        start = []
+        for ib in ibs:
+            if not self.iBOBProxies.has_key(ib):
+                start.append(ib)
+                continue
+            tupd,pers,clk = self.gdb.getPersonality(ib)
+            corelog.info("Swapping iBOB %d to personality: %s clock rate %f MHz" % (ib,pers,clk))
+            thisiBOB = ns.resolve(':IBOB.%d'%ib).getProxy()
+            if thisiBOB.swap_personality(getattr(personalities,pers),clk) is None:
+                corelog.warning("Could not swap personality for iBOB %d" % ib)
+        if start:
+            self._startIbobServers(start)
+
     def _stopIbobServer(self,ib):
         corelog.info("Stopping IBOB %d server" % ib)
         ns = Pyro.naming.NameServerLocator().getNS()
@@ -85,9 +104,43 @@ class iBOBProcessServer(Pyro.core.ObjBase):
             os.chmod(datapath,stat.S_IRWXO | stat.S_IRWXG | stat.S_IRWXU)
         except:
             corelog.exception("Couldn't create data path %s" % datapath)
+        fileinfo = self._getFileInfo()
         for id,ibob in self.iBOBProxies.items():
             if id in ibobids:
-                ibob.start_writing(os.path.join(datapath,'ibob%d.h5' % id))
+                ibob.start_writing(os.path.join(datapath,'ibob%d.h5' % id),fileinfo)
+
+    def _prepareRecord(self,ibobids,datapath):
+        """
+        Create the history files for the next :meth:`_startRecord` with the same arguments in advance, so that
+        back to back scans switch files without losing integrations
+        """
+        corelog.info("Preparing to record from ibobs: %s In path: %s" % (str(ibobids),datapath))
+        try:
+            os.mkdir(datapath)
+            os.chmod(datapath,stat.S_IRWXO | stat.S_IRWXG | stat.S_IRWXU)
+        except:
+            corelog.exception("Couldn't create data path %s" % datapath)
+        for id,ibob in self.iBOBProxies.items():
+            if id in ibobids:
+                ibob.prepare_next_file(os.path.join(datapath,'ibob%d.h5' % id))
+
+    def _getFileInfo(self):
+        """
+        Collect the configuration IDs and scan source to be stored with each history file in the history catalog
+        """
+        if self.gdb is None:
+            return None
+        fileinfo = {}
+        try:
+            fileinfo['RSSConfigID'] = int(self.gdb.getRSSStatus()['ID'])
+            fileinfo['SPSSConfigID'] = int(self.gdb.getSPSSStatus()['ID'])
+            sc = self.gdb.getScanStatus()
+            fileinfo['ScanID'] = int(sc['ID'])
+            fileinfo['SourceID'] = int(sc['SourceID'])
+            fileinfo['Source'] = sc['Source']
+        except Exception:
+            corelog.exception("Couldn't get configuration info for history catalog")
+        return fileinfo
         
 
 if __name__=="__main__":
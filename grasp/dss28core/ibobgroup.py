@@ -0,0 +1,207 @@
+"""
+:mod:`dss28core.ibobgroup`
+--------------------------
+
+Controller for applying the same operation to a group of iBOBs concurrently.
+
+Each iBOB gets a dedicated worker thread which owns that iBOB's Pyro proxy and personality (Pyro proxies and
+database connections must not be shared between threads). A call is queued to every worker at once, so an
+operation costing several control round trips and database inserts per iBOB takes about as long for eight iBOBs
+as for one. The personality is looked up in the SPSS configuration before every call and made again when the
+design or ADC clock has changed, e.g. after :meth:`~dss28core.IbobServer.IbobServer.swap_personality`.
+
+Example::
+
+    from dss28core.ibobgroup import IbobGroup
+    g = IbobGroup(range(8))
+    r = g.call('setIntegrationTime',40e-3)
+    print r                 # total and per iBOB latency, errors
+    r = g.call('requestAdcSnapshot')
+    r = g.sync()            # arm all on the same PPS edge
+    r = g.callServer('read_registers',['ctrl','period'])
+    r.results[3]            # result for iBOB 3
+    r.raiseErrors()
+"""
+from __future__ import with_statement
+import math
+import time
+import threading
+import Queue
+
+import Pyro.core
+import Pyro.naming
+
+import gavrtdb
+import personalities
+
+from loggers import corelog
+
+GROUP_TIMEOUT = 30.0        # seconds to wait for all iBOBs to complete a call
+
+class GroupError(Exception):
+    pass
+
+class GroupResult(object):
+    """
+    Aggregated outcome of a group call.
+
+    * *results* - dictionary of iBOB: return value for iBOBs which succeeded
+    * *errors* - dictionary of iBOB: error message for iBOBs which failed or timed out
+    * *latency* - dictionary of iBOB: seconds taken by that iBOB
+    * *elapsed* - total seconds for the whole group
+    """
+    def __init__(self,name):
+        self.name = name
+        self.results = {}
+        self.errors = {}
+        self.latency = {}
+        self.elapsed = 0.0
+
+    def ok(self):
+        return not self.errors
+
+    def raiseErrors(self):
+        if self.errors:
+            raise GroupError("%s failed on iBOBs %s" % (self.name,
+                             ', '.join(['%d: %s' % (ib,err) for ib,err in sorted(self.errors.items())])))
+
+    def __str__(self):
+        lines = ["%s: %d ok, %d failed in %.3f s" % (self.name,len(self.results),len(self.errors),self.elapsed)]
+        for ib in sorted(set(self.results.keys()+self.errors.keys())):
+            if self.errors.has_key(ib):
+                status = 'ERROR %s' % self.errors[ib]
+            else:
+                status = 'ok'
+            lines.append("  iBOB %d: %.3f s %s" % (ib,self.latency.get(ib,float('nan')),status))
+        return '\n'.join(lines)
+    __repr__ = __str__
+
+class _IbobWorker(threading.Thread):
+    def __init__(self,ibob):
+        threading.Thread.__init__(self,name='ibobgroup-%d' % ibob)
+        self.setDaemon(True)
+        self.ibob = ibob
+        self.queue = Queue.Queue()
+        self.server = None
+        self.gdb = None
+        self.personality = None
+        self.design = None      # (update time, personality, adcClock) the personality was made for
+
+    def _connect(self):
+        """
+        Connect to the iBOB's server if not connected, and make its personality if there is none or the SPSS
+        configuration has been updated since it was made
+        """
+        if self.server is None:
+            ns = Pyro.naming.NameServerLocator().getNS()
+            self.server = ns.resolve(':IBOB.%d' % self.ibob).getProxy()
+            self.gdb = gavrtdb.GavrtDB()
+        design = self.gdb.getPersonality(self.ibob)
+        if self.personality is None or design != self.design:
+            tupd,pers,clk = design
+            self.personality = getattr(personalities,pers)(parent=self.server,adcClock=clk)
+            self.design = design
+
+    def run(self):
+        while True:
+            job = self.queue.get()
+            if job is None:
+                return
+            func,done = job
+            t = time.time()
+            try:
+                self._connect()
+                done(self.ibob,True,func(self),time.time()-t)
+            except Exception, e:
+                corelog.exception("iBOB %d group call failed" % self.ibob)
+                # connect again on the next call, in case the server was restarted or the design changed
+                self.server = None
+                self.personality = None
+                done(self.ibob,False,"%s: %s" % (e.__class__.__name__,e),time.time()-t)
+
+class IbobGroup(object):
+    """
+    Group of iBOBs (list of iBOB numbers) to be controlled together. Connections are made in the worker threads on
+    first use.
+    """
+    def __init__(self,ibobs=range(8),timeout=GROUP_TIMEOUT):
+        self.ibobs = list(ibobs)
+        self.timeout = timeout
+        self._workers = {}
+        for ib in self.ibobs:
+            w = _IbobWorker(ib)
+            w.start()
+            self._workers[ib] = w
+
+    def apply(self,func,name=None,ibobs=None):
+        """
+        Run func(worker) for each iBOB concurrently, where worker.personality and worker.server are that iBOB's
+        personality and IbobServer proxy. Returns a :class:`GroupResult`. Raises :class:`GroupError`, before
+        anything is queued, if *ibobs* includes iBOBs which are not in the group
+        """
+        if ibobs is None:
+            ibobs = self.ibobs
+        unknown = [ib for ib in ibobs if not self._workers.has_key(ib)]
+        if unknown:
+            raise GroupError("iBOBs %s are not in this group %s" % (sorted(unknown),self.ibobs))
+        result = GroupResult(name or getattr(func,'__name__','call'))
+        lock = threading.Lock()
+        finished = threading.Event()
+        remaining = [len(ibobs)]
+        closed = [False]    # iBOBs finishing after the timeout are not added to the returned result
+        def done(ib,ok,value,latency):
+            with lock:
+                if closed[0]:
+                    return
+                if ok:
+                    result.results[ib] = value
+                else:
+                    result.errors[ib] = value
+                result.latency[ib] = latency
+                remaining[0] -= 1
+                if remaining[0] == 0:
+                    finished.set()
+        t = time.time()
+        for ib in ibobs:
+            self._workers[ib].queue.put((func,done))
+        if ibobs:
+            finished.wait(self.timeout)
+        with lock:
+            for ib in ibobs:
+                if not result.latency.has_key(ib):
+                    result.errors[ib] = 'timed out after %.1f s' % self.timeout
+            result.elapsed = time.time() - t
+            closed[0] = True
+        corelog.debug(str(result))
+        return result
+
+    def call(self,method,*args,**kwargs):
+        """
+        Call personality *method* with the same arguments on every iBOB
+        """
+        return self.apply(lambda w: getattr(w.personality,method)(*args,**kwargs),name=method)
+
+    def callEach(self,method,args):
+        """
+        Call personality *method* with per iBOB arguments; *args* is a dictionary of iBOB: argument tuple
+        """
+        return self.apply(lambda w: getattr(w.personality,method)(*args[w.ibob]),name=method,ibobs=args.keys())
+
+    def callServer(self,method,*args,**kwargs):
+        """
+        Call :class:`~dss28core.IbobServer.IbobServer` *method* with the same arguments on every iBOB
+        """
+        return self.apply(lambda w: getattr(w.server,method)(*args,**kwargs),name=method)
+
+    def sync(self,guard=1.0):
+        """
+        Arm every iBOB's PPS synchronization for the same PPS edge. Each personality sleeps until its sync phase
+        within a common UNIX second starting at least *guard* seconds from now; the armed seconds are in the results
+        and the wakeup errors in ppstiming.jitter
+        """
+        second = int(math.ceil(time.time() + guard))
+        return self.apply(lambda w: w.personality.sync(second),name='sync')
+
+    def close(self):
+        for w in self._workers.values():
+            w.queue.put(None)
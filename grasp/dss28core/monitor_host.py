@@ -0,0 +1,330 @@
+"""
+:mod:`dss28core.monitor_host`
+-----------------------------
+
+Monitor host program. This module should be automatically run as a standalone program, in place of separate
+forx_server, powerdbwriter, tct_mon and ups processes. It also keeps the :mod:`~grasp.monseries` store of the RSS
+monitor points up to date.
+
+Each device is polled by a :class:`PollTask` in its own thread, so a slow or hung device does not hold up the
+others. All the tasks share one :class:`~grasp.gavrtdb.GavrtDB`, whose connections come from the process wide pool
+and whose rows are written in batches by the background insert queue.
+
+A task which fails is retried with an exponentially increasing delay (up to :data:`MAX_BACKOFF` seconds), and after
+:data:`RESET_FAILURES` failures in a row its device is closed and opened again. A poll taking longer than the task's
+timeout is reported, and the device is closed and opened again once the poll returns.
+
+The :class:`~MonitorHost` is accessible through Pyro as **MonitorHost**; its :meth:`~MonitorHost.status` method
+gives the state and timing of every task and the database insert queue and connection pool statistics. The TCT
+monitor is also registered as **TCTServer**, as when run by itself.
+"""
+import time
+import threading
+import Pyro4
+import grasp.gavrtdb as gavrtdb
+from loggers import corelog
+
+MAX_BACKOFF = 600.0     # seconds
+RESET_FAILURES = 3      # failures in a row after which a task's device is closed and opened again
+CHECK_INTERVAL = 1.0    # seconds between checks for tasks which have overrun their timeout
+
+class PollTask():
+    """
+    Periodically poll one device.
+
+    *setup* is called with no arguments to open the device and returns an object which is passed to *poll* every
+    *interval* seconds. Either may raise an exception to signal failure. A poll which takes longer than *timeout*
+    seconds (default: *interval*) counts as failed. *teardown*, if given, is called with the object to close the
+    device before it is opened again and when the task stops.
+    """
+    def __init__(self,name,setup,poll,interval,timeout=None,maxBackoff=MAX_BACKOFF,teardown=None):
+        self.name = name
+        self.setup = setup
+        self.poll = poll
+        self.teardown = teardown
+        self.interval = interval
+        if timeout is None:
+            timeout = interval
+        self.timeout = timeout
+        self.maxBackoff = max(maxBackoff,interval)
+        self.device = None
+        self.running = False
+        self.thread = None
+        self.state = 'stopped'
+        self.started = None     # start time of the poll in progress
+        self.nextRun = 0
+        self.overrun = False
+        self.stats = dict(runs=0,failures=0,consecutiveFailures=0,timeouts=0,lastRun=0,lastSuccess=0,
+                          lastError='',lastDuration=0,maxDuration=0,totalDuration=0)
+        self._wake = threading.Event()
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self._loop,name=self.name)
+        self.thread.setDaemon(True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        self._wake.set()
+
+    def check(self,now=None):
+        """
+        Report a poll which has been running for longer than the timeout. Called periodically by the host
+        """
+        if now is None:
+            now = time.time()
+        started = self.started
+        if started is not None and not self.overrun and now - started > self.timeout:
+            self.overrun = True
+            self.state = 'timeout'
+            self.stats['timeouts'] += 1
+            corelog.warning("%s poll has taken more than %.1f s" % (self.name,self.timeout))
+
+    def getStatus(self):
+        """
+        Returns a dictionary describing the task
+        """
+        status = dict(self.stats)
+        status.update(state=self.state,interval=self.interval,timeout=self.timeout,nextRun=self.nextRun)
+        if self.stats['runs']:
+            status['meanDuration'] = self.stats['totalDuration']/self.stats['runs']
+        recorder = getattr(self.device,'recorder',None)
+        if recorder is not None:
+            status['recorded'] = recorder.stats['recorded']
+            status['updates'] = recorder.stats['updates']
+        return status
+
+    def _close(self):
+        """
+        internal: close the device, if open
+        """
+        device = self.device
+        self.device = None
+        if device is None or self.teardown is None:
+            return
+        try:
+            self.teardown(device)
+            corelog.info("%s device closed" % self.name)
+        except Exception, e:
+            corelog.exception("%s could not close device" % self.name)
+
+    def _once(self):
+        if self.device is None:
+            self.state = 'setup'
+            self.device = self.setup()
+            corelog.info("%s device opened" % self.name)
+        self.state = 'polling'
+        self.overrun = False
+        self.started = time.time()
+        try:
+            self.poll(self.device)
+        finally:
+            duration = time.time() - self.started
+            self.started = None
+            self.stats['runs'] += 1
+            self.stats['lastRun'] = time.time()
+            self.stats['lastDuration'] = duration
+            self.stats['totalDuration'] += duration
+            self.stats['maxDuration'] = max(self.stats['maxDuration'],duration)
+        if self.overrun:
+            raise Exception("poll took %.1f s, more than the timeout of %.1f s" % (duration,self.timeout))
+
+    def _loop(self):
+        self.nextRun = time.time()
+        while self.running:
+            try:
+                self._once()
+            except Exception, e:
+                self.stats['failures'] += 1
+                self.stats['consecutiveFailures'] += 1
+                self.stats['lastError'] = '%s: %s' % (e.__class__.__name__,e)
+                corelog.exception("%s poll failed (%d in a row)" % (self.name,self.stats['consecutiveFailures']))
+                if self.overrun or self.stats['consecutiveFailures'] % RESET_FAILURES == 0:
+                    self._close()
+                delay = min(self.interval*2**(self.stats['consecutiveFailures']-1),self.maxBackoff)
+                self.state = 'backoff'
+                self.nextRun = time.time() + delay
+            else:
+                self.stats['consecutiveFailures'] = 0
+                self.stats['lastSuccess'] = self.stats['lastRun']
+                self.state = 'idle'
+                # keep to the schedule, skipping any slots missed by a slow poll
+                now = time.time()
+                self.nextRun += self.interval
+                if self.nextRun < now:
+                    self.nextRun = now + self.interval - (now - self.nextRun) % self.interval
+            self._wake.wait(max(self.nextRun - time.time(),0))
+        self._close()
+        self.state = 'stopped'
+
+def forxTask(gdb):
+    """
+    FORX monitor points from the LabJack, as :mod:`forx_server`
+    """
+    def setup():
+        import forx_server
+        return forx_server.FORXDBWriter(gdb)
+    return PollTask('forx',setup,lambda writer: writer.poll(),interval=60,timeout=30,
+                    teardown=lambda writer: writer.fs.close())
+
+def powerTask(gdb):
+    """
+    SPSS power supply status, as :mod:`powerdbwriter`
+    """
+    def setup():
+        import powerdbwriter
+        return powerdbwriter.PowerDBWriter(gdb)
+    return PollTask('power',setup,lambda writer: writer.poll(),interval=60,timeout=30,
+                    teardown=lambda writer: writer.ps.close())
+
+def tctTask(gdb,host=None):
+    """
+    TCT status and offset, as :mod:`tct_mon`. The TCT sends its time every second, so this task is polled
+    continuously. If *host* is given the TCTServer is registered with its Pyro daemon
+    """
+    def setup():
+        import tct_mon
+        tct = tct_mon.TCTServer(gdb=gdb)
+        if host is not None:
+            host.register('TCTServer',tct)
+        return tct
+    def teardown(tct):
+        if host is not None:
+            host.unregister('TCTServer',tct)
+        tct.close()
+    return PollTask('tct',setup,lambda tct: tct.update(),interval=1,timeout=10,teardown=teardown)
+
+def upsTask(gdb):
+    """
+    UPS log retrieved by FTP, as :mod:`ups`
+    """
+    def setup():
+        import ups
+        return ups.UPS(gdb=gdb)
+    def poll(u):
+        u.getData()
+        u.insertData()
+    return PollTask('ups',setup,poll,interval=3600,timeout=600)
+
+def monseriesTask(gdb):
+    """
+    Copy new rss_mon rows into the :mod:`~grasp.monseries` store every SYNC_INTERVAL. The first sync copies the
+    whole table, which can take longer than the timeout; it is committed chunk by chunk, so the next poll carries on
+    """
+    import grasp.monseries as monseries
+    def setup():
+        return monseries.MonitorSeries()
+    def poll(ms):
+        n = ms.sync(gdb)
+        if n:
+            corelog.info("monseries copied %d rss_mon rows" % n)
+    return PollTask('monseries',setup,poll,interval=monseries.SYNC_INTERVAL,timeout=600,
+                    teardown=lambda ms: ms.close())
+
+class MonitorHost():
+    """
+    Runs a set of :class:`PollTask` and reports on them through Pyro
+    """
+    def __init__(self,tasks=None,daemon=None):
+        self.gdb = gavrtdb.GavrtDB(rw=True)
+        self.daemon = daemon
+        self.ns = None
+        self.running = True
+        self.started = time.time()
+        if tasks is None:
+            tasks = [forxTask(self.gdb),powerTask(self.gdb),tctTask(self.gdb,self),upsTask(self.gdb),
+                     monseriesTask(self.gdb)]
+        self.tasks = tasks
+
+    def register(self,name,obj):
+        """
+        Make *obj* available through Pyro as *name*
+        """
+        if self.daemon is None:
+            return
+        uri = self.daemon.register(obj)
+        if self.ns is not None:
+            self.ns.register(name,uri)
+
+    def unregister(self,name,obj):
+        """
+        Remove *obj*, registered as *name* by :meth:`register`, from Pyro
+        """
+        if self.daemon is None:
+            return
+        if self.ns is not None:
+            try:
+                self.ns.unregister(name)
+            except Exception, e:
+                corelog.exception("Could not unregister %s from the name server" % name)
+        self.daemon.unregister(obj)
+
+    def start(self):
+        for task in self.tasks:
+            task.start()
+
+    def quit(self):
+        """
+        Stop all tasks and quit the main loop
+        """
+        for task in self.tasks:
+            task.stop()
+        self.running = False
+
+    def ping(self):
+        """
+        Allows remote checking that the Pyro object is still alive
+        """
+        return True
+
+    def check(self):
+        now = time.time()
+        for task in self.tasks:
+            task.check(now)
+
+    def status(self):
+        """
+        Returns a dictionary with:
+
+        * tasks - dictionary of task name: dictionary of task state and statistics (see :meth:`PollTask.getStatus`)
+        * inserts - statistics of the database insert queue
+        * pool - statistics of the database connection pool
+        * uptime - seconds since the host started
+        """
+        return dict(tasks=dict([(task.name,task.getStatus()) for task in self.tasks]),
+                    inserts=gavrtdb.insertStats(),pool=gavrtdb.poolStats(),uptime=time.time()-self.started)
+
+
+if __name__=="__main__":
+    import select
+    Pyro4.config.SERVERTYPE = "multiplex"
+    ns = Pyro4.locateNS()
+    for name in ['MonitorHost','TCTServer']:
+        try:
+            old = ns.lookup(name)
+            Pyro4.Proxy(old).quit()
+            corelog.info("Quit existing %s" % name)
+            time.sleep(1)
+        except:
+            pass
+        try:
+            ns.unregister(name)
+        except:
+            pass
+    daemon = Pyro4.Daemon()
+    host = MonitorHost(daemon=daemon)
+    host.ns = ns
+    host.register('MonitorHost',host)
+    host.start()
+    corelog.info("Monitor host started with tasks: %s" % ', '.join([task.name for task in host.tasks]))
+
+    lastCheck = 0
+    while host.running:
+        s,_,_ = select.select(daemon.sockets,[],[],CHECK_INTERVAL)
+        if s:
+            daemon.events(s)
+        if time.time() - lastCheck > CHECK_INTERVAL:
+            host.check()
+            lastCheck = time.time()
+    gavrtdb.flushInserts()
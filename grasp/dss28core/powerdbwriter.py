@@ -3,8 +3,12 @@
 ------------------------------
 
 Reads status from the Lambda Power supply (provides +5 V to IBOBs and BEE2) and stores in the GavrtDB
+
+Rows are only recorded when a value changes by more than its deadband (see :data:`deadbands`) or every
+:data:`deadband.HEARTBEAT` seconds; use :func:`grasp.deadband.readSeries` to read them back as a regular series.
 """
 import grasp.gavrtdb as gavrtdb
+import grasp.deadband as deadband
 import time
 import serial
 
@@ -21,42 +25,35 @@ fields = {
           'Fault' : lambda : 'FR'
           }
 
+deadbands = {'MeasuredVoltage':0.05,      # V
+             'MeasuredCurrent':0.1}       # A
+
 class PowerDBWriter():
-    def __init__(self):
+    def __init__(self,gdb=None):
         self.ps = SPSSPowerServer()
-        try:
-            self.pdb = gavrtdb.GavrtDB(rw=True)
-        except Exception, e:
-            corelog.exception("Could not connect to database")
-    def loop(self):
-        while True:
-            data = self.ps.getStatus()
-
-            keystr = ''
-            valstr = ''
-            values = []
-            for k,v in fields.items():
-                keystr = keystr + k + ', '
-                valstr = valstr + '%s, '
-                val = v()
-                if data.has_key(val):
-                    val = data[val]
-                values.append(val)
-            keystr = keystr[:-2]    #strip final ,
-            valstr = valstr[:-2] 
+        if gdb is None:
             try:
-                c = self.pdb.cursor()
-                c.executemany(
-                         "INSERT INTO spss_power (" + keystr + ") VALUES (" + valstr + ");",
-                         [tuple(values)])
-                print "INSERT INTO spss_power (" + keystr + ") VALUES (" + valstr + ");" , values
-                self.pdb.commit()
+                gdb = gavrtdb.GavrtDB(rw=True)
             except Exception, e:
-                corelog.exception("Error inserting power info")
-                try:
-                    self.pdb = gavrtdb.GavrtDB(rw=True)
-                except Exception, e:
-                    corelog.exception("Could not reconnect to database")
+                corelog.exception("Could not connect to database")
+        self.pdb = gdb
+        self.recorder = deadband.DeadbandRecorder(self.pdb,'spss_power',deadbands)
+    def poll(self):
+        """
+        Read the power supply status once and record it
+        """
+        data = self.ps.getStatus()
+
+        rec = {}
+        for k,v in fields.items():
+            val = v()
+            if data.has_key(val):
+                val = data[val]
+            rec[k] = val
+        self.recorder.update(rec)
+    def loop(self):
+        while True:
+            self.poll()
             time.sleep(60)
             
             
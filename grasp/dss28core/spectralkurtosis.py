@@ -0,0 +1,102 @@
+"""
+:mod:`dss28core.spectralkurtosis`
+---------------------------------
+
+Streaming spectral kurtosis (SK) RFI flagging for the kurtosis spectrometer personalities
+(:class:`~personalities.OnePolReal.OnePolRealKurtosisSpectrometer` and
+:class:`~personalities.OnePolReal.OnePolReal512ChannelKurtosisSpectrometer`).
+
+These designs accumulate both the power (*II* = S1) and the power squared (*SK* = S2) of *M* spectra in each
+channel. The SK estimator is
+
+    SK = (M+1)/(M-1) * (M*S2/S1**2 - 1)
+
+which has expectation 1 and variance 4*M**2/((M-1)*(M+2)*(M+3)) for Gaussian noise. Channels whose estimator
+falls more than *sigma* standard deviations from 1 are flagged. The flags of each spectrum are packed eight
+channels per byte (see numpy.packbits), and running per-channel occupancy (number of times each channel was
+flagged) is kept.
+"""
+import time
+import numpy as np
+
+def skEstimator(s1,s2,M):
+    """
+    Return the SK estimator for accumulated power *s1*, accumulated squared power *s2* and *M* accumulations.
+    Channels with no power are returned as nan.
+    """
+    s1 = np.asarray(s1,dtype='float64')
+    s2 = np.asarray(s2,dtype='float64')
+    M = float(M)
+    with np.errstate(divide='ignore',invalid='ignore'):
+        sk = ((M+1)/(M-1))*(M*s2/(s1*s1) - 1)
+    sk[s1 == 0] = np.nan
+    return sk
+
+def skThresholds(M,sigma=3.0):
+    """
+    Return (lower, upper) SK thresholds for *M* accumulations at *sigma* standard deviations
+    """
+    M = float(M)
+    std = np.sqrt(4*M**2/((M-1)*(M+2)*(M+3)))
+    return (1-sigma*std, 1+sigma*std)
+
+def unpackFlags(packed,nchan):
+    """
+    Convert a packed flag array back to a boolean array of *nchan* channels
+    """
+    return np.unpackbits(np.asarray(packed,dtype='uint8'))[:nchan].astype('bool')
+
+class SKFlagger(object):
+    """
+    Computes SK flags for each spectrum and keeps per channel occupancy statistics
+
+    *nchan* is the number of spectral channels
+    """
+    def __init__(self,nchan,sigma=3.0):
+        self.nchan = nchan
+        self.sigma = sigma
+        self._M = None
+        self._thresholds = None
+        self.reset()
+
+    def reset(self):
+        """
+        Clear the occupancy statistics
+        """
+        self.flagged = np.zeros((self.nchan,),dtype='uint32')
+        self.count = 0
+        self.since = time.time()
+
+    def setSigma(self,sigma):
+        self.sigma = sigma
+        self._M = None
+
+    def thresholds(self,M):
+        if M != self._M:
+            self._thresholds = skThresholds(M,self.sigma)
+            self._M = M
+        return self._thresholds
+
+    def process(self,s1,s2,M):
+        """
+        Flag one spectrum. Returns the packed flag array (uint8, one bit per channel). Nothing is flagged if the
+        number of accumulated spectra *M* is not known (None)
+        """
+        if M is None or M < 2:
+            flags = np.zeros((self.nchan,),dtype='bool')
+        else:
+            lo,hi = self.thresholds(M)
+            sk = skEstimator(s1[:self.nchan],s2[:self.nchan],M)
+            with np.errstate(invalid='ignore'):
+                flags = (sk < lo) | (sk > hi)
+        self.flagged += flags
+        self.count += 1
+        return np.packbits(flags)
+
+    def occupancy(self):
+        """
+        Return the fraction of spectra in which each channel has been flagged since the last reset
+        """
+        if self.count == 0:
+            return np.zeros((self.nchan,))
+        return self.flagged/float(self.count)
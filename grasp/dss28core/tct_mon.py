@@ -7,6 +7,8 @@ TCT Monitoring program. This module should be automatically run as a standalone
 Periodically checks the serial time output of the TCT and checks it against the local time. 
 The TCT status and time difference are logged in the GavrtDB.
 Thus both the TCT status and the NTP time updating of the local machine can both be checked.
+Rows are only recorded when the status changes, the offset moves by more than :data:`OFFSET_DEADBAND`, or every
+:data:`deadband.HEARTBEAT` seconds.
 
 The :class:`~TCTServer` is accessible through Pyro as **TCTServer** 
 """
@@ -15,9 +17,12 @@ import serial
 import calendar
 import Pyro4
 import grasp.gavrtdb as gavrtdb
+import grasp.deadband as deadband
 from loggers import corelog
 import config
 
+OFFSET_DEADBAND = 0.1   # seconds
+
 
 class TCTServer():
     """
@@ -26,8 +31,10 @@ class TCTServer():
     The TCT serial port can be explicitly passed in (/dev/ttyUSB*), but by default it will be obtained using the :attr:`~config.serialPortMap` dictionary.
     
     Note the TCT uses 9600 7-Odd-1 format  
+    
+    A *gdb* may be passed in to share one with other writers (see :mod:`monitor_host`).
     """
-    def __init__(self,port=None):
+    def __init__(self,port=None,gdb=None):
         if port is None:
             try:
                 port =config.serialPortMap['TCT']
@@ -43,7 +50,10 @@ class TCTServer():
         
         self.ser.flushInput()
         self.running = True
-        self.gdb = gavrtdb.GavrtDB(rw=True)
+        if gdb is None:
+            gdb = gavrtdb.GavrtDB(rw=True)
+        self.gdb = gdb
+        self.recorder = deadband.DeadbandRecorder(self.gdb,'tct_status',dict(Offset=OFFSET_DEADBAND))
         
     def quit(self):
         """
@@ -148,23 +158,13 @@ class TCTServer():
     
     def update(self):
         """
-        Get the TCT time and status and insert it in the database.
+        Get the TCT time and status and insert it in the database if the status or offset changed.
         """
         res = self.get()
         if res is None:
             return
         ut,status,offset =res
-        try:
-            c = self.gdb.db.cursor()
-            c.execute("INSERT INTO tct_status (UnixTime,Status,Offset) VALUES (%s,%s,%s);",
-                      (ut,status,offset))
-            self.gdb.db.commit()
-        except Exception, e:
-            corelog.exception("Couldn't write to database")
-            try:
-                self.gdb = gavrtdb.GavrtDB(rw=True)
-            except Exception, e:
-                corelog.exception("Couldn't reconnect to database")
+        self.recorder.update(dict(UnixTime=ut,Status=status,Offset=offset))
 
 
 if __name__=="__main__":
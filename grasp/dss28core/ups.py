@@ -15,13 +15,15 @@ from loggers import corelog,DSS28
 from grasp.private import SPSS_UPS
 
 class UPS():
-    def __init__(self, old = None,ipaddr=SPSS_UPS.host):
+    def __init__(self, old = None,ipaddr=SPSS_UPS.host,gdb=None):
         if old:
             self.data = old.data
             self.gdb = old.gdb
         else:
             self.data = None
-            self.gdb = gavrtdb.GavrtDB(rw=True)
+            if gdb is None:
+                gdb = gavrtdb.GavrtDB(rw=True)
+            self.gdb = gdb
             
         self.addr = ipaddr
     
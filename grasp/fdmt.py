@@ -0,0 +1,398 @@
+"""
+:mod:`fdmt`
+-----------
+
+Software dispersion measure search of recorded or streaming spectra using the Fast Dispersion Measure Transform
+(FDMT, Zackay & Ofek 2017).
+
+The dedispersion personalities (:class:`~personalities.DedispSpec.DDCDedisp` and
+:class:`~personalities.DedispSpec.WideX4Dedisp`) dedisperse a single DM in hardware. This module searches a whole
+grid of DMs in software from the SpectralPower/II spectra instead. The FDMT computes the sums along all dispersion
+sweeps with delays of 0 to *maxDT*-1 samples across the band in O(maxDT*T*log2(nchan)) operations, which for the
+256 channels of these personalities at a 40 ms dump rate is far faster than realtime on a single CPU core.
+
+Each row of the DM-time plane is normalized to unit robust standard deviation after smoothing with a set of
+boxcar widths, and every contiguous run of samples above the threshold is reported as one candidate.
+
+Times in the DM-time plane refer to the arrival time at the lowest frequency of the band.
+
+Example::
+
+    import fdmt
+    spectra,timestamps,freqs = fdmt.loadSpectra('/data/ibob3.h5',rf0=2250.0,sideband=1)
+    search = fdmt.DMSearch(freqs,tsamp=40e-3,dmMax=1000.0)
+    plane,candidates = search.search(spectra,timestamps,processes=4)
+
+or in near realtime::
+
+    search = fdmt.StreamingSearch(freqs,tsamp=40e-3,dmMax=1000.0)
+    while True:
+        ...
+        for c in search.process(spectra,timestamps):
+            print c
+"""
+import time
+import multiprocessing
+
+import numpy as np
+
+K_DM = 4.148808e3   # dispersion constant in MHz**2 pc**-1 cm**3 s
+
+def dmDelay(dm,f_lo,f_hi):
+    """
+    Dispersion delay in seconds of *f_lo* relative to *f_hi* (MHz) for dispersion measure *dm* (pc/cm**3)
+    """
+    return K_DM*dm*(1.0/f_lo**2 - 1.0/f_hi**2)
+
+def _initialize(data,f_min,f_max,maxDT):
+    nchan,ntime = data.shape
+    deltaF = (f_max - f_min)/float(nchan)
+    deltaT = int(np.ceil((maxDT-1)*(1./f_min**2 - 1./(f_min + deltaF)**2)/(1./f_min**2 - 1./f_max**2)))
+    state = np.zeros((nchan,deltaT+1,ntime),dtype='float32')
+    state[:,0,:] = data
+    for dt in range(1,deltaT+1):
+        state[:,dt,dt:] = state[:,dt-1,dt:] + data[:,:-dt]
+    return state
+
+def _iterate(state,maxDT,nchan,f_min,f_max,iteration):
+    deltaF = 2**iteration*(f_max - f_min)/float(nchan)
+    dF = (f_max - f_min)/float(nchan)
+    deltaT = int(np.ceil((maxDT-1)*(1./f_min**2 - 1./(f_min + deltaF)**2)/(1./f_min**2 - 1./f_max**2)))
+    nsub = state.shape[0]//2
+    ntime = state.shape[2]
+    out = np.zeros((nsub,deltaT+1,ntime),dtype='float32')
+    correction = dF/2.
+    norm = 1./f_min**2 - 1./f_max**2
+    for sub in range(nsub):
+        f_start = (f_max - f_min)/float(nsub)*sub + f_min
+        f_end = (f_max - f_min)/float(nsub)*(sub+1) + f_min
+        f_middle = (f_end - f_start)/2. + f_start - correction
+        f_middle_larger = (f_end - f_start)/2. + f_start + correction
+        span = 1./f_end**2 - 1./f_start**2
+        deltaTLocal = int(np.ceil((maxDT-1)*(1./f_start**2 - 1./f_end**2)/norm))
+        lower = state[2*sub]
+        upper = state[2*sub+1]
+        for dt in range(deltaTLocal+1):
+            dt_middle = int(round(dt*(1./f_middle**2 - 1./f_start**2)/span))
+            dt_larger = int(round(dt*(1./f_middle_larger**2 - 1./f_start**2)/span))
+            dt_rest = dt - dt_larger
+            row = out[sub,dt]
+            row[:dt_larger] = lower[dt_middle,:dt_larger]
+            np.add(lower[dt_middle,dt_larger:],upper[dt_rest,:ntime-dt_larger],row[dt_larger:])
+    return out
+
+def fdmt(data,f_min,f_max,maxDT):
+    """
+    Fast dispersion measure transform of *data* (nchan x ntime, channels in ascending frequency, nchan a power of
+    two). *f_min* and *f_max* are the lower edge of the first channel and the upper edge of the last channel.
+
+    Returns the (maxDT x ntime) DM-time plane: row k is the sum along the dispersion sweep with a delay of k samples
+    between *f_max* and *f_min*. The first maxDT-1 samples are partial sums.
+    """
+    nchan = data.shape[0]
+    niter = int(round(np.log2(nchan)))
+    if 2**niter != nchan:
+        raise ValueError("number of channels must be a power of two, got %d" % nchan)
+    state = _initialize(np.asarray(data,dtype='float32'),f_min,f_max,maxDT)
+    for iteration in range(1,niter+1):
+        state = _iterate(state,maxDT,nchan,f_min,f_max,iteration)
+    return state[0,:maxDT,:]
+
+def _rowStats(plane):
+    """
+    internal: robust mean (median) and standard deviation (scaled MAD) of each row of *plane*
+    """
+    med = np.median(plane,axis=1)[:,np.newaxis]
+    mad = np.median(np.abs(plane - med),axis=1)[:,np.newaxis]*1.4826
+    mad[mad == 0] = 1.0
+    return med,mad
+
+def _robustNormalize(plane,stats=None):
+    if stats is None:
+        stats = _rowStats(plane)
+    med,mad = stats
+    return (plane - med)/mad
+
+def _boxcar(plane,width):
+    if width == 1:
+        return plane
+    cs = np.cumsum(plane,axis=1)
+    out = np.empty_like(plane)
+    out[:,:width] = cs[:,:width]
+    out[:,width:] = cs[:,width:] - cs[:,:-width]
+    return out
+
+def _snrPlane(plane,widths,stats=None):
+    """
+    internal: S/N plane (maximum over the boxcar *widths*) and best width index of each sample of *plane*. *stats*
+    is a list of the per row statistics (see _rowStats) to normalize with for each width, by default those of *plane*
+    """
+    snr = None
+    best = None
+    for k,width in enumerate(widths):
+        s = _robustNormalize(_boxcar(plane,width),None if stats is None else stats[k])
+        if snr is None:
+            snr = s
+            best = np.zeros(s.shape,dtype='uint8')
+        else:
+            better = s > snr
+            snr[better] = s[better]
+            best[better] = k
+    return snr,best
+
+def _runs(snr,best,threshold,widths):
+    """
+    internal: (sample, dmIndex, snr, width) of the peak of each contiguous run of samples of *snr* above
+    *threshold*, and the (start, stop) sample range of each run
+    """
+    peak = snr.argmax(axis=0)
+    peaksnr = snr[peak,np.arange(snr.shape[1])]
+    above = np.flatnonzero(peaksnr > threshold)
+    candidates = []
+    runs = []
+    if above.shape[0]:
+        breaks = np.flatnonzero(np.diff(above) > 1)
+        for run in np.split(above,breaks+1):
+            t = run[peaksnr[run].argmax()]
+            candidates.append((int(t),int(peak[t]),float(peaksnr[t]),widths[best[peak[t],t]]))
+            runs.append((int(run[0]),int(run[-1])+1))
+    return candidates,runs
+
+def findCandidates(plane,threshold,widths=(1,)):
+    """
+    Find candidates in a DM-time plane.
+
+    Returns the S/N plane (maximum over the boxcar *widths*), the best width index of each sample, and a list of
+    (sample, dmIndex, snr, width) tuples, one per contiguous run of samples with S/N above *threshold*.
+    """
+    snr,best = _snrPlane(plane,widths)
+    candidates,runs = _runs(snr,best,threshold,widths)
+    return snr,best,candidates
+
+def _searchChunk(args):
+    (data,f_min,f_max,maxDT,threshold,widths,discard) = args
+    plane = fdmt(data,f_min,f_max,maxDT)[:,discard:]
+    snr,best,candidates = findCandidates(plane,threshold,widths)
+    return plane,candidates
+
+class DMSearch(object):
+    """
+    FDMT dispersion measure search over spectra with channel center frequencies *freqs* (MHz, uniformly spaced in
+    either order) and sample interval *tsamp* (s) for DMs from 0 to *dmMax*.
+
+    Channels are zero padded to a power of two. Each channel is normalized to zero mean and unit variance over the
+    data searched; channels which are constant (or contain non-finite values) are excluded.
+    """
+    def __init__(self,freqs,tsamp,dmMax,threshold=6.0,widths=(1,2,4,8)):
+        freqs = np.asarray(freqs,dtype='float64')
+        self.order = np.argsort(freqs)
+        freqs = freqs[self.order]
+        self.nchan = freqs.shape[0]
+        self.df = (freqs[-1] - freqs[0])/float(self.nchan - 1)
+        self.npad = 2**int(np.ceil(np.log2(self.nchan)))
+        self.f_min = freqs[0] - self.df/2.
+        self.f_max = self.f_min + self.npad*self.df
+        self.tsamp = tsamp
+        self.threshold = threshold
+        self.widths = tuple(widths)
+        self.maxDT = max(2,int(np.ceil(dmDelay(dmMax,self.f_min,self.f_max)/tsamp)) + 1)
+        self.dms = np.arange(self.maxDT)*tsamp/dmDelay(1.0,self.f_min,self.f_max)
+
+    def prepare(self,spectra):
+        """
+        Convert *spectra* (ntime x nchan, as recorded) to the normalized, ascending frequency, zero padded
+        (npad x ntime) array searched by the FDMT
+        """
+        x = np.asarray(spectra,dtype='float32')[:,self.order].T
+        good = np.isfinite(x).all(axis=1)
+        x = np.where(good[:,np.newaxis],x,0)
+        mean = x.mean(axis=1)[:,np.newaxis]
+        std = x.std(axis=1)[:,np.newaxis]
+        good &= (std[:,0] > 0)
+        std[std == 0] = 1.0
+        data = np.zeros((self.npad,x.shape[1]),dtype='float32')
+        data[:self.nchan] = np.where(good[:,np.newaxis],(x - mean)/std,0)
+        return data
+
+    def dmTime(self,spectra):
+        """
+        Return the DM-time plane of *spectra* (ntime x nchan)
+        """
+        return fdmt(self.prepare(spectra),self.f_min,self.f_max,self.maxDT)
+
+    def _candidates(self,found,timestamps,offset=0):
+        return [dict(Timestamp=timestamps[t],Sample=t+offset,DM=self.dms[dm],DMIndex=dm,SNR=snr,Width=w)
+                for (t,dm,snr,w) in found]
+
+    def search(self,spectra,timestamps,chunk=4096,processes=None):
+        """
+        Search *spectra* (ntime x nchan) with sample times *timestamps*.
+
+        The data are processed in chunks of *chunk* samples, overlapped by maxDT-1 samples so no sweep is missed, in
+        a pool of *processes* worker processes (None for one per CPU, 1 to run in this process).
+
+        Returns the DM-time plane (maxDT x ntime) and a list of candidate dictionaries with keys Timestamp, Sample,
+        DM, DMIndex, SNR and Width (boxcar width in samples).
+        """
+        data = self.prepare(spectra)
+        ntime = data.shape[1]
+        overlap = self.maxDT - 1
+        jobs = []
+        starts = range(0,ntime,chunk)
+        for start in starts:
+            first = max(0,start - overlap)
+            jobs.append((data[:,first:start+chunk],self.f_min,self.f_max,self.maxDT,self.threshold,self.widths,
+                         start - first))
+        if processes == 1 or len(jobs) == 1:
+            results = map(_searchChunk,jobs)
+        else:
+            pool = multiprocessing.Pool(processes)
+            try:
+                results = pool.map(_searchChunk,jobs)
+            finally:
+                pool.close()
+                pool.join()
+        plane = np.empty((self.maxDT,ntime),dtype='float32')
+        found = []
+        for start,(p,c) in zip(starts,results):
+            plane[:,start:start+p.shape[1]] = p
+            found.extend([(t+start,dm,s,w) for (t,dm,s,w) in c])
+        return plane,self._candidates(found,np.asarray(timestamps))
+
+class StreamingSearch(DMSearch):
+    """
+    Near realtime version of :class:`DMSearch`. Spectra are passed to :meth:`process` as they arrive, one dump or
+    a block at a time.
+
+    Spectra are buffered until *block* (default: maxDT) new ones have arrived and at least maxDT have been
+    received; the FDMT is then run over the new spectra plus the previous maxDT-1, so sweeps spanning blocks are
+    found and each spectrum is transformed once. Each run of the FDMT has a fixed overhead, so a *block* much
+    smaller than maxDT costs more per spectrum and only shortens the latency.
+
+    Channel statistics and the per DM noise estimate used for the S/N are taken from the last *history* spectra
+    and DM-time plane columns, so they do not depend on the block size; the per DM statistics are updated after
+    every maxDT spectra. A candidate whose run of samples above the threshold is still going on at the end of a
+    block is reported once the run ends (or by :meth:`flush`).
+    """
+    def __init__(self,freqs,tsamp,dmMax,threshold=6.0,widths=(1,2,4,8),history=1024,block=None):
+        super(StreamingSearch,self).__init__(freqs,tsamp,dmMax,threshold=threshold,widths=widths)
+        if block is None:
+            block = self.maxDT
+        self.block = max(int(block),1)
+        self.history = max(history,self.maxDT,self.block)
+        self._spectra = None        # the last spectra transformed, at least maxDT-1 of them
+        self._timestamps = None
+        self._buffer = []           # (spectra, timestamps) received since
+        self._plane = None          # the DM-time plane of the last *history* processed spectra
+        self._nsamples = 0          # spectra received
+        self._pending = 0           # spectra received but not yet transformed
+        self._open = 0              # columns at the end of _plane in a run above threshold which had not ended
+        self._stats = None          # per DM row statistics of _plane for each boxcar width
+        self._sinceStats = 0        # columns added to _plane since they were computed
+
+    def process(self,spectra,timestamps):
+        """
+        Add new *spectra* (ntime x nchan, or a single spectrum) with sample times *timestamps*. Returns a list of
+        candidates found; Sample counts spectra since the first call
+        """
+        spectra = np.asarray(spectra,dtype='float32')
+        timestamps = np.atleast_1d(np.asarray(timestamps,dtype='float64'))
+        if spectra.ndim == 1:
+            spectra = spectra[np.newaxis,:]
+        self._buffer.append((spectra,timestamps))
+        self._nsamples += spectra.shape[0]
+        self._pending += spectra.shape[0]
+        if self._pending < self.block or self._nsamples < self.maxDT:
+            return []
+        return self._search(False)
+
+    def flush(self):
+        """
+        Search the spectra buffered so far, even if fewer than *block*, and report runs which have not ended.
+        Returns a list of candidates
+        """
+        if not self._pending and not self._open:
+            return []
+        if self._nsamples < self.maxDT:
+            return []
+        return self._search(True)
+
+    def _search(self,final):
+        if self._buffer:
+            old = [] if self._spectra is None else [(self._spectra,self._timestamps)]
+            keep = max(self.history,self._pending + self.maxDT - 1)
+            self._spectra = np.concatenate([x for x,t in old + self._buffer])[-keep:]
+            self._timestamps = np.concatenate([t for x,t in old + self._buffer])[-keep:]
+            self._buffer = []
+        if self._pending:
+            data = self.prepare(self._spectra)[:,-(self._pending + self.maxDT - 1):]
+            plane = fdmt(data,self.f_min,self.f_max,self.maxDT)[:,-self._pending:]
+            if self._plane is not None:
+                plane = np.concatenate((self._plane,plane),axis=1)
+            self._plane = plane[:,-self.history:]
+        self._sinceStats += self._pending
+        if self._stats is None or self._sinceStats >= self.maxDT:
+            self._stats = [_rowStats(_boxcar(self._plane,width)) for width in self.widths]
+            self._sinceStats = 0
+        nnew = min(self._pending + self._open,self._plane.shape[1])
+        self._pending = 0
+        # the boxcars of the columns searched reach back max(widths)-1 columns
+        tail = self._plane[:,-min(nnew + max(self.widths) - 1,self._plane.shape[1]):]
+        snr,best = _snrPlane(tail,self.widths,self._stats)
+        found,runs = _runs(snr[:,-nnew:],best[:,-nnew:],self.threshold,self.widths)
+        self._open = 0
+        if found and not final and runs[-1][1] == nnew and nnew - runs[-1][0] < self.history//2:
+            # the last run reaches the newest sample: report it once it has ended
+            found.pop()
+            self._open = nnew - runs[-1][0]
+        first = self._nsamples - nnew       # sample number of the first column searched
+        base = self._nsamples - self._timestamps.shape[0]
+        return [dict(Timestamp=self._timestamps[t+first-base],Sample=t+first,DM=self.dms[dm],DMIndex=dm,SNR=s,
+                     Width=w) for (t,dm,s,w) in found]
+
+def loadSpectra(filename,start=None,stop=None,freqs=None,rf0=None,sideband=1,adcClock=1024.0):
+    """
+    Read the SpectralPower/II spectra of a history file.
+
+    If *freqs* is None the baseband channel frequencies are taken from the personality recorded in the file and,
+    if *rf0* is given, converted to sky frequencies as rf0 + sideband*baseband (see
+    :meth:`~dss28core.datainterface.DataInterface._calcBBRF`). Dispersion delays only depend on the frequency axis,
+    so sky frequencies should be used for physically meaningful DMs.
+
+    Returns (spectra, timestamps, freqs)
+    """
+    import tables
+    import personalities
+    h5 = tables.openFile(filename,'r')
+    try:
+        spectra = h5.root.SpectralPower.II[start:stop]
+        timestamps = h5.root.SpectralPower.table.col('Timestamp')[start:stop]
+        if freqs is None:
+            name = h5.root.file_info[0]['personality']
+            p = getattr(personalities,name)(adcClock=adcClock)
+            freqs = np.asarray(p._bbfrq(),dtype='float64')
+            if rf0 is not None:
+                freqs = rf0 + sideband*freqs
+    finally:
+        h5.close()
+    return spectra,timestamps,freqs
+
+def searchFile(filename,dmMax,tsamp=None,threshold=6.0,widths=(1,2,4,8),chunk=4096,processes=None,**kwargs):
+    """
+    Load a history file with :func:`loadSpectra` (extra keyword arguments are passed on) and search it for DMs up
+    to *dmMax*. *tsamp* defaults to the median spacing of the timestamps.
+
+    Returns (search, plane, candidates) where *search* is the :class:`DMSearch` used (see its *dms* attribute for
+    the DM of each row of the plane)
+    """
+    spectra,timestamps,freqs = loadSpectra(filename,**kwargs)
+    if tsamp is None:
+        tsamp = float(np.median(np.diff(timestamps)))
+    search = DMSearch(freqs,tsamp,dmMax,threshold=threshold,widths=widths)
+    t = time.time()
+    plane,candidates = search.search(spectra,timestamps,chunk=chunk,processes=processes)
+    elapsed = time.time() - t
+    print "searched %d spectra (%.1f s of data) over %d DMs in %.2f s" % (spectra.shape[0],
+                                                                          spectra.shape[0]*tsamp,
+                                                                          search.maxDT,elapsed)
+    return search,plane,candidates
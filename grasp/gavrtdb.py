@@ -1,11 +1,19 @@
+import os
 import time
+import json
+import errno
+import atexit
+import threading
 
 from dbextensions import * 
 
 import numpy as np
 from gavrt_constants import ibob_fiber_map
 
-from private import GAVRTDB
+try:
+    from private import GAVRTDB
+except ImportError:
+    GAVRTDB = None      # no MySQL server configured, only a stand-in backend (see setBackend) can be used
 
 def rget(d,la,ld,ch):
     """ return unixtime and voltage for senor at la,ld,ch"""
@@ -14,10 +22,659 @@ def rget(d,la,ld,ch):
 
 
 
+POOL_SIZE = 4           # idle connections kept per access mode (read / write) in each process
+PING_INTERVAL = 30.0    # seconds a pooled connection may sit idle before it is pinged on reuse
+
+_driver = None
+
+def _getDriver():
+    """
+    Returns (module, conversions, compress) for the MySQL client library: pymysql if available, else MySQLdb
+    """
+    global _driver
+    if _driver is not None:
+        return _driver
+    try:
+        import pymysql as MySQLdb
+        import pymysql.converters
+        conv_dict = pymysql.converters.conversions.copy()
+        conv_dict[pymysql.constants.FIELD_TYPE.DECIMAL] = pymysql.converters.convert_float
+        conv_dict[pymysql.constants.FIELD_TYPE.NEWDECIMAL] = pymysql.converters.convert_float
+        pymysql.converters.encoders[np.float64] = pymysql.converters.escape_float
+        pymysql.converters.encoders[np.float32] = pymysql.converters.escape_float
+        MySQLdb.converters = pymysql.converters
+        _sqlcompress = False # compression not supported by pymysql yet
+    except:
+        import MySQLdb
+        import MySQLdb.converters
+        conv_dict = MySQLdb.converters.conversions.copy()
+        conv_dict[246] = float  # Convert Decimal fields to float automatically
+
+        _sqlcompress = True
+    _driver = (MySQLdb,conv_dict,_sqlcompress)
+    return _driver
+
+class ConnectionPool(object):
+    """
+    Process wide pool of open database connections, kept separately for read only and read/write access.
+
+    Connections are in autocommit mode, so every statement sees the latest data without the commit round trip
+    which used to precede each call. A connection which has been idle for more than *ping_interval* seconds is
+    pinged before reuse; connection errors during a call cause the connection to be dropped and replaced.
+
+    Connections are never shared between processes: after a fork the inherited connections are abandoned (not
+    closed, which would close them for the parent too) and new ones are made.
+    """
+    def __init__(self,size=POOL_SIZE,ping_interval=PING_INTERVAL):
+        self.size = size
+        self.ping_interval = ping_interval
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._idle = {False:[],True:[]}     # rw: list of (connection, time released)
+        self._abandoned = []
+        self.stats = dict(created=0,reused=0,pings=0,dead=0,errors=0,inuse=0)
+
+    def _connect(self,rw):
+        if _backend is not None:
+            return _backend.connect(rw)
+        MySQLdb,conv_dict,_sqlcompress = _getDriver()
+        if rw:
+            db = MySQLdb.connect(host = GAVRTDB.host, port=GAVRTDB.port ,user=GAVRTDB.write_user,passwd=GAVRTDB.write_passwd,db=GAVRTDB.db,conv=conv_dict,compress=_sqlcompress)
+        else:
+            db = MySQLdb.connect(host = GAVRTDB.host, port=GAVRTDB.port ,user=GAVRTDB.read_user,passwd=GAVRTDB.read_passwd,db=GAVRTDB.db,conv=conv_dict,compress=_sqlcompress)
+        db.autocommit(True)
+        return db
+
+    def acquire(self,rw=False):
+        """
+        Returns an open connection for read/write (*rw* True) or read only access
+        """
+        with self._lock:
+            if os.getpid() != self._pid:
+                abandoned = self._idle[False] + self._idle[True] + self._abandoned
+                self._reset()
+                self._abandoned = abandoned
+            while self._idle[rw]:
+                db,released = self._idle[rw].pop()
+                if time.time() - released > self.ping_interval:
+                    self.stats['pings'] += 1
+                    try:
+                        db.ping()
+                    except Exception:
+                        self.stats['dead'] += 1
+                        self._close(db)
+                        continue
+                self.stats['reused'] += 1
+                self.stats['inuse'] += 1
+                return db
+        db = self._connect(rw)      # counted only once connected, a failed connect raises here
+        with self._lock:
+            self.stats['created'] += 1
+            self.stats['inuse'] += 1
+        return db
+
+    def release(self,db,rw=False):
+        """
+        Return a connection obtained from :meth:`acquire` to the pool
+        """
+        with self._lock:
+            if os.getpid() != self._pid:
+                self._abandoned.append(db)
+                return
+            self.stats['inuse'] -= 1
+            if len(self._idle[rw]) < self.size:
+                self._idle[rw].append((db,time.time()))
+                return
+        self._close(db)
+
+    def discard(self,db):
+        """
+        Drop a connection which failed instead of returning it to the pool
+        """
+        with self._lock:
+            if os.getpid() != self._pid:
+                self._abandoned.append(db)
+                return
+            self.stats['inuse'] -= 1
+            self.stats['errors'] += 1
+        self._close(db)
+
+    def _close(self,db):
+        try:
+            db.close()
+        except Exception:
+            pass
+
+    def getStats(self):
+        """
+        Returns a dictionary of pool statistics: connections created, reused, pinged, found dead on ping, dropped
+        after errors, in use and idle
+        """
+        with self._lock:
+            stats = dict(self.stats)
+            stats['idle_read'] = len(self._idle[False])
+            stats['idle_write'] = len(self._idle[True])
+        return stats
+
+_pool = ConnectionPool()
+
+_backend = None
+
+def setBackend(backend=None):
+    """
+    Use *backend* instead of the MySQL server for all GavrtDB access in this process, or go back to the MySQL server
+    if None. *backend* provides connect(rw), returning a MySQLdb style connection, and isConnectionError(e); see
+    :class:`sqlitedb.SQLiteBackend`. Pooled connections and cached results from the previous backend are dropped
+    """
+    global _backend,_pool
+    _backend = backend
+    _pool = ConnectionPool()
+    if globals().has_key('_cache'):
+        _cache.invalidate()
+
+def poolStats():
+    """
+    Statistics of this process's database connection pool, see :meth:`ConnectionPool.getStats`
+    """
+    return _pool.getStats()
+
+def _isConnectionError(e):
+    if _backend is not None:
+        return _backend.isConnectionError(e)
+    MySQLdb = _getDriver()[0]
+    return isinstance(e,(MySQLdb.OperationalError,MySQLdb.InterfaceError))
+
+def _fetch_one_dict(db,*args):
+    crs = db.cursor()
+    crs.execute(*args)
+    vals = list(crs.fetchone())
+    keys = [b[0] for b in crs.description]
+    return dict(zip(keys,vals))
+
+INSERT_BATCH_SIZE = 500         # rows per multi-row INSERT, and queued rows which trigger an immediate write
+INSERT_FLUSH_INTERVAL = 0.5     # seconds queued rows may wait before being written
+INSERT_SPOOL_DIR = os.environ.get('GAVRTDB_SPOOL','/tmp/gavrtdb_spool')
+
+def _plain(value):
+    if isinstance(value,np.generic):
+        return value.item()
+    return value
+
+def _multirow_insert(db,table,columns,update,rows):
+    """
+    Insert *rows* (tuples of values for *columns*) into *table* with a single multi-row INSERT statement
+    """
+    placeholders = '(' + ', '.join(['%s']*len(columns)) + ')'
+    stmt = "INSERT INTO " + table + " (" + ', '.join(['`%s`' % col for col in columns]) + ") VALUES " + \
+           ', '.join([placeholders]*len(rows))
+    if update:
+        stmt += ' ON DUPLICATE KEY UPDATE ' + ', '.join(['`%s` = VALUES(`%s`)' % (col,col) for col in columns
+                                                        if col != 'ID'])
+    args = []
+    for row in rows:
+        args.extend(row)
+    c = db.cursor()
+    c.execute(stmt + ';',args)
+
+class InsertQueue(object):
+    """
+    Process wide background writer for rows which the caller does not need to wait for.
+
+    Queued rows are grouped per table (and set of columns) and written by a background thread as multi-row INSERT
+    statements, whenever *batch* rows are queued or *interval* seconds have passed. While the database cannot be
+    reached, rows are appended to a spool file in *spooldir* (one JSON row per line) and replayed, in order, once
+    writes succeed again; spool files left by processes which have exited are replayed too. A row which the
+    database rejects is written to a .rejected file next to the spool instead of being retried forever.
+    """
+    def __init__(self,batch=INSERT_BATCH_SIZE,interval=INSERT_FLUSH_INTERVAL,spooldir=INSERT_SPOOL_DIR):
+        self.batch = batch
+        self.interval = interval
+        self.spooldir = spooldir
+        self._cond = threading.Condition(threading.Lock())
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._pending = {}      # (table, columns, update): list of row tuples
+        self._order = []        # keys of _pending in the order first queued
+        self._queued = 0
+        self._busy = False
+        self._thread = None
+        self._stopping = False
+        self._spooled = True    # check for spool files left by earlier processes
+        self.stats = dict(queued=0,inserted=0,statements=0,spooled=0,replayed=0,rejected=0)
+
+    def _spoolName(self,pid=None):
+        return os.path.join(self.spooldir,'%d.spool' % (pid or os.getpid()))
+
+    def put(self,table,rec,update=False):
+        """
+        Queue one row (dictionary of column: value) for *table*. Returns immediately
+        """
+        columns = tuple(sorted([k for k in rec.keys() if k != 'ID' or update]))
+        row = tuple([_plain(rec[k]) for k in columns])
+        key = (table,columns,update)
+        with self._cond:
+            if os.getpid() != self._pid:
+                self._reset()       # forked: the parent's queue and thread are not ours
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop,name='gavrtdb inserts')
+                self._thread.setDaemon(True)
+                self._thread.start()
+            if not self._pending.has_key(key):
+                self._pending[key] = []
+                self._order.append(key)
+            self._pending[key].append(row)
+            self._queued += 1
+            self.stats['queued'] += 1
+            if self._queued >= self.batch:
+                self._cond.notifyAll()
+
+    def flush(self,timeout=10.0):
+        """
+        Wait until all rows queued so far have been written or spooled. Returns True if the queue emptied
+        """
+        end = time.time() + timeout
+        with self._cond:
+            self._cond.notifyAll()
+            while (self._queued or self._busy) and self._thread is not None:
+                remaining = end - time.time()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(min(remaining,0.1))
+        return True
+
+    def getStats(self):
+        with self._cond:
+            stats = dict(self.stats)
+            stats['pending'] = self._queued
+        stats['spool_files'] = len(self._spoolFiles())
+        return stats
+
+    def _take(self):
+        pending = [(key,self._pending[key]) for key in self._order]
+        self._pending = {}
+        self._order = []
+        self._queued = 0
+        return pending
+
+    def close(self,timeout=10.0):
+        """
+        Write or spool everything queued and stop the background thread
+        """
+        self.flush(timeout)
+        with self._cond:
+            thread = self._thread
+            self._stopping = True
+            self._cond.notifyAll()
+        if thread is not None and os.getpid() == self._pid:
+            thread.join(timeout)
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                if self._stopping:
+                    return
+                if not self._queued:
+                    self._cond.wait(self.interval)
+                pending = self._take()
+                self._busy = True
+            try:
+                # spooled rows go first so rows reach the database in the order they were queued
+                if self._replay():
+                    self._write(pending)
+                else:
+                    self._spool(pending)
+            except Exception, e:
+                print "gavrtdb insert queue error:",e
+            with self._cond:
+                self._busy = False
+                self._cond.notifyAll()
+
+    def _write(self,pending):
+        """
+        internal: write the (key, rows) batches in *pending*, spooling what is left if the database becomes
+        unreachable. Cached copies of the tables written to are invalidated once the rows are in the database.
+        Returns False if anything was spooled
+        """
+        pending = [item for item in pending if item[1]]
+        if not pending:
+            return True
+        try:
+            db = _pool.acquire(True)
+        except Exception, e:
+            self._spool(pending)
+            return False
+        written = set()
+        try:
+            try:
+                for n in range(len(pending)):
+                    while pending[n][1]:
+                        (table,columns,update),rows = pending[n]
+                        try:
+                            _multirow_insert(db,table,columns,update,rows[:self.batch])
+                        except Exception, e:
+                            if _isConnectionError(e):
+                                raise
+                            written.add(table)
+                            self._insertEach(db,pending,n,self.batch)
+                            continue
+                        written.add(table)
+                        self.stats['statements'] += 1
+                        self.stats['inserted'] += len(rows[:self.batch])
+                        pending[n] = (pending[n][0],rows[self.batch:])
+            except Exception, e:
+                _pool.discard(db)
+                self._spool(pending)
+                return False
+        finally:
+            # connections are in autocommit mode, so the rows are visible to other readers by now
+            for table in written:
+                if isCached(table):
+                    invalidateCache(table)
+        _pool.release(db,True)
+        return True
+
+    def _insertEach(self,db,pending,n,count):
+        """
+        internal: after a batch was rejected, insert the first *count* rows of pending[n] one at a time, setting
+        aside the ones which fail. pending[n] is kept up to date so nothing is written twice if the connection is lost
+        """
+        key = pending[n][0]
+        for k in range(min(count,len(pending[n][1]))):
+            row = pending[n][1][0]
+            try:
+                _multirow_insert(db,key[0],key[1],key[2],[row])
+                self.stats['statements'] += 1
+                self.stats['inserted'] += 1
+            except Exception, e:
+                if _isConnectionError(e):
+                    raise
+                print "gavrtdb rejected row for %s: %s" % (key[0],e)
+                self._appendRows(self._spoolName() + '.rejected',[(key,[row])])
+                self.stats['rejected'] += 1
+            pending[n] = (key,pending[n][1][1:])
+
+    def _appendRows(self,filename,pending):
+        if not os.path.isdir(self.spooldir):
+            os.makedirs(self.spooldir)
+        f = open(filename,'a')
+        try:
+            for (table,columns,update),rows in pending:
+                for row in rows:
+                    f.write(json.dumps([table,columns,update,row]) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        finally:
+            f.close()
+
+    def _spool(self,pending):
+        pending = [item for item in pending if item[1]]
+        if not pending:
+            return
+        self._appendRows(self._spoolName(),pending)
+        self.stats['spooled'] += sum([len(rows) for key,rows in pending])
+        self._spooled = True
+
+    def _spoolFiles(self):
+        """
+        internal: spool files of this process and of processes which no longer exist, and spool files whose
+        replay was interrupted (<pid>.spool.<replaying pid>.replay) by a process which no longer exists, oldest first
+        """
+        try:
+            names = os.listdir(self.spooldir)
+        except OSError:
+            return []
+        files = []
+        for name in names:
+            parts = name.split('.')
+            try:
+                if name.endswith('.spool'):
+                    owner = int(parts[0])
+                elif name.endswith('.replay'):
+                    owner = int(parts[-2]) if len(parts) == 4 else int(parts[0])
+                else:
+                    continue
+            except ValueError:
+                continue
+            if owner != os.getpid() and _processAlive(owner):
+                continue        # still running, it will replay its own spool
+            path = os.path.join(self.spooldir,name)
+            files.append((os.path.getmtime(path),path))
+        files.sort()
+        return [path for t,path in files]
+
+    def _replay(self):
+        """
+        internal: write spooled rows to the database. Returns False if rows remain spooled
+        """
+        if not self._spooled:
+            return True
+        for path in self._spoolFiles():
+            # renaming claims the file, so only one process replays it
+            replaying = '%s.%d.replay' % (path[:path.rindex('.spool')+len('.spool')],os.getpid())
+            if replaying != path:
+                try:
+                    os.rename(path,replaying)
+                except OSError:
+                    continue
+            pending = []
+            for line in open(replaying):
+                try:
+                    table,columns,update,row = json.loads(line)
+                except ValueError:
+                    continue        # partial last line of a process which died while spooling
+                key = (str(table),tuple([str(col) for col in columns]),update)
+                if pending and pending[-1][0] == key:
+                    pending[-1][1].append(tuple(row))
+                else:
+                    pending.append((key,[tuple(row)]))
+            n = sum([len(rows) for key,rows in pending])
+            ok = self._write(pending)      # whatever cannot be written goes back into our own spool
+            os.remove(replaying)
+            if not ok:
+                return False
+            self.stats['replayed'] += n
+            print "gavrtdb replayed %d spooled rows from %s" % (n,path)
+        self._spooled = False
+        return True
+
+def _processAlive(pid):
+    """
+    internal: True if process *pid* exists, including processes of other users which may not be signalled
+    """
+    try:
+        os.kill(pid,0)
+    except OSError, e:
+        return e.errno == errno.EPERM
+    return True
+
+_inserts = InsertQueue()
+
+def insertStats():
+    """
+    Statistics of this process's background insert queue
+    """
+    return _inserts.getStats()
+
+def flushInserts(timeout=10.0):
+    """
+    Wait until all rows queued with :meth:`GavrtDB.queueRecord` in this process have been written or spooled
+    """
+    return _inserts.flush(timeout)
+
+atexit.register(_inserts.close)
+
+if os.environ.get('GAVRTDB_SQLITE'):
+    import sqlitedb
+    setBackend(sqlitedb.SQLiteBackend(os.environ['GAVRTDB_SQLITE']))
+
+CACHE_TTL = 600.0       # seconds a cached copy of a slowly changing table is served before being reloaded
+
+CACHED_TABLES = ['ibob_designs','projects','observers','gavrt_sources.source','information_schema']
+
+def _tableName(table):
+    return table.replace('`','').strip()
+
+class TableCache(object):
+    """
+    Process wide read-through cache for query results on static and slowly changing tables (see CACHED_TABLES).
+
+    Each result is cached under (table, key) along with the time it was loaded and the table's version number. A
+    result is served from memory until it is older than *ttl* seconds or the table is invalidated, which increments
+    its version (see :func:`invalidateCache`). GavrtDB invalidates a table whenever it writes to it (rows queued
+    with :meth:`GavrtDB.queueRecord` once they are inserted), so only changes made by other processes can take up to
+    *ttl* seconds to be seen.
+    """
+    def __init__(self,ttl=CACHE_TTL):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = {}      # (table, key): (version, load time, value)
+        self._versions = {}     # table: version
+        self.stats = dict(hits=0,misses=0,invalidations=0)
+
+    def get(self,table,key,load):
+        """
+        Return the cached result for *key* on *table*, calling load() to get it if not cached or stale
+        """
+        table = _tableName(table)
+        with self._lock:
+            version = self._versions.get(table,0)
+            entry = self._entries.get((table,key))
+            if entry is not None and entry[0] == version and time.time() - entry[1] < self.ttl:
+                self.stats['hits'] += 1
+                return self._copy(entry[2])
+            self.stats['misses'] += 1
+        loaded = time.time()
+        value = load()
+        with self._lock:
+            if self._versions.get(table,0) == version:      # not invalidated while loading
+                self._entries[(table,key)] = (version,loaded,value)
+        return self._copy(value)
+
+    def _copy(self,value):
+        # callers may modify the dictionaries they are given (eg. getScanStatus)
+        if isinstance(value,dict):
+            return dict(value)
+        return value
+
+    def invalidate(self,table=None):
+        """
+        Drop cached results for *table*, or for all tables if None
+        """
+        with self._lock:
+            if table is None:
+                tables = set([k[0] for k in self._entries.keys()] + self._versions.keys())
+            else:
+                tables = [_tableName(table)]
+            for table in tables:
+                self._versions[table] = self._versions.get(table,0) + 1
+            self._entries = dict([(k,v) for k,v in self._entries.items() if k[0] not in tables])
+            self.stats['invalidations'] += 1
+
+    def getStats(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats['entries'] = len(self._entries)
+        return stats
+
+_cache = TableCache()
+
+def isCached(table):
+    return _tableName(table) in CACHED_TABLES
+
+def invalidateCache(table=None):
+    """
+    Make this process reload *table* (or all cached tables if None) on next use, eg. after it was changed by another
+    program
+    """
+    _cache.invalidate(table)
+
+def cacheStats():
+    """
+    Statistics of this process's :class:`TableCache`
+    """
+    return _cache.getStats()
+
+def _take(values,idx):
+    """
+    internal: values[idx] with NaN (None for non-numeric values) where idx is -1
+    """
+    values = np.asarray(values)
+    missing = idx < 0
+    if len(values) == 0:
+        out = np.empty(idx.shape,dtype='float64')
+        out[:] = np.nan
+        return out
+    out = values[np.where(missing,0,idx)]
+    if missing.any():
+        if out.dtype.kind in 'biuf':
+            out = out.astype('float64')
+            out[missing] = np.nan
+        else:
+            out = out.astype(object)
+            out[missing] = None
+    return out
+
+class ConfigHistory(object):
+    """
+    Change history of one configuration table, for looking up the configuration in effect at many times at once
+    (see :meth:`GavrtDB.getConfigHistory`)
+
+    *rows* is a dictionary of column: array as returned by :meth:`GavrtDB.get` and *timecol* the column holding the
+    time each row took effect. As for :meth:`GavrtDB.getRSSStatusAt` etc., the row in effect at time t is the last
+    one which took effect strictly before t.
+    """
+    def __init__(self,rows,timecol):
+        self.timecol = timecol
+        if not rows:
+            self.rows = {}
+            self.times = np.zeros((0,))
+            return
+        order = np.lexsort((rows['ID'],rows[timecol]))
+        self.rows = dict([(k,np.asarray(v)[order]) for k,v in rows.items()])
+        self.times = self.rows[timecol].astype('float64')
+
+    def __len__(self):
+        return len(self.times)
+
+    def row(self,k):
+        """
+        Row *k* as a dictionary, like the result of :meth:`GavrtDB.getRSSStatusAt`
+        """
+        return dict([(col,values[k]) for col,values in self.rows.items()])
+
+    def index(self,t):
+        """
+        Index of the row in effect at each of the times *t*, -1 for times before the first row
+        """
+        return np.searchsorted(self.times,np.asarray(t,dtype='float64'),side='left') - 1
+
+    def at(self,t,columns=None):
+        """
+        Dictionary of column: array of the value in effect at each of the times *t*, NaN (or None) for times before
+        the first row. By default all columns are returned
+        """
+        idx = self.index(t)
+        if columns is None:
+            columns = self.rows.keys()
+        return dict([(col,_take(self.rows.get(col,[]),idx)) for col in columns])
+
 class GavrtDB():
+    """
+    Interface to the GAVRT MySQL database.
+
+    Each call borrows a connection from the process wide :class:`ConnectionPool` and returns it afterwards, so
+    creating GavrtDB objects is cheap and they may be used from several threads. The :attr:`db` attribute gives a
+    connection held by this object for code which needs one directly.
+    """
     def __init__(self, rw=False):
         self.rw = rw
-        self.connect()
+        self._db = None
+        self._dbchecked = 0
 #        self.getMonitorPoints()
     def getMonitorPoints(self):
         self.rssMonPoints = self.get("SELECT * FROM rss_monitor_points")
@@ -30,75 +687,133 @@ class GavrtDB():
         for mp in self.rssMonPoints:
             key = (mp['LatchAddress'],mp['LatchData'],mp['AdcChan'])
             self.rssMonPointsDict[key] = mp
-        
-        
-    def connect(self):
-        rw = self.rw
+
+    def _run(self,func,retry=True):
+        """
+        internal: call func(connection) with a pooled connection. If the connection turns out to be dead the call is
+        retried once on a new connection when *retry* is True (use False for statements which must not be repeated)
+        """
+        db = _pool.acquire(self.rw)
         try:
-            import pymysql as MySQLdb
-            import pymysql.converters
-            conv_dict = pymysql.converters.conversions.copy()
-            conv_dict[pymysql.constants.FIELD_TYPE.DECIMAL] = pymysql.converters.convert_float
-            conv_dict[pymysql.constants.FIELD_TYPE.NEWDECIMAL] = pymysql.converters.convert_float
-            pymysql.converters.encoders[np.float64] = pymysql.converters.escape_float
-            pymysql.converters.encoders[np.float32] = pymysql.converters.escape_float
-            MySQLdb.converters = pymysql.converters
-            _sqlcompress = False # compression not supported by pymysql yet
-        except:
-            import MySQLdb
-            import MySQLdb.converters
-            conv_dict = MySQLdb.converters.conversions.copy()
-            conv_dict[246] = float  # Convert Decimal fields to float automatically
-
-            _sqlcompress = True
+            result = func(db)
+        except Exception, e:
+            if not _isConnectionError(e):
+                _pool.release(db,self.rw)
+                raise
+            _pool.discard(db)
+            if not retry:
+                raise
+            db = _pool.acquire(self.rw)
+            try:
+                result = func(db)
+            except Exception:
+                _pool.discard(db)
+                raise
+        _pool.release(db,self.rw)
+        return result
 
-        if rw:
-            self.db = MySQLdb.connect(host = GAVRTDB.host, port=GAVRTDB.port ,user=GAVRTDB.write_user,passwd=GAVRTDB.write_passwd,db=GAVRTDB.db,conv=conv_dict,compress=_sqlcompress)
-        else:
-            self.db = MySQLdb.connect(host = GAVRTDB.host, port=GAVRTDB.port ,user=GAVRTDB.read_user,passwd=GAVRTDB.read_passwd,db=GAVRTDB.db,conv=conv_dict,compress=_sqlcompress)
+    def _getdb(self):
+        if self._db is None:
+            self._db = _pool.acquire(self.rw)
+        return self._db
+    db = property(_getdb,doc="connection held by this object until :meth:`close`")
+
+    def connect(self):
+        """
+        Replace the connection held by this object with a new one
+        """
+        if self._db is not None:
+            _pool.discard(self._db)
+            self._db = None
+        return self.db
+
+    def close(self):
+        """
+        Return the connection held by this object to the pool
+        """
+        if self._db is not None:
+            _pool.release(self._db,self.rw)
+            self._db = None
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
 
-        self.c = self.db.cursor()
-        
     def checkDB(self):
+        """
+        Make sure the connection held by this object is alive, pinging it if unused for more than PING_INTERVAL
+        """
+        if self._db is not None and time.time() - self._dbchecked < PING_INTERVAL:
+            self._dbchecked = time.time()
+            return
         try:
-            self.db.commit()
-        except:
+            self.db.ping()
+        except Exception:
             self.connect()
-        self.db.commit()
-        
+        self._dbchecked = time.time()
+
     def cursor(self):
         self.checkDB()
         return self.db.cursor()
     
     def commit(self):
         return self.db.commit()
-        
+
+    def poolStats(self):
+        return poolStats()
+
+    def queueRecord(self,table,rec,update=False):
+        """
+        Queue a row for *table* to be inserted in the background (see :class:`InsertQueue`) and return immediately.
+        Use :func:`flushInserts` where a following query must see the row. Configuration rows which are read back
+        as the current state (rss_config, ibob_config) are written with :meth:`insertRecord` instead. A cached
+        table (see :class:`TableCache`) is invalidated when the row has been inserted, not when it is queued
+        """
+        _inserts.put(table,rec,update=update)
+
+    def insertStats(self):
+        return insertStats()
+
+    def cacheStats(self):
+        return cacheStats()
+
+    def invalidateCache(self,table=None):
+        invalidateCache(table)
+
+    def cached(self,table,key,load):
+        """
+        Read-through cache for slowly changing tables: return the result of load() for *key* on *table*, reusing the
+        result of an earlier call until *table* changes or CACHE_TTL has passed (see :class:`TableCache`)
+        """
+        return _cache.get(table,key,load)
+
     def insertRecord(self,table,rec,keepid=False,update=False):
-        self.checkDB()
-        return insert_record(self.db, table, rec,keepid = keepid, update = update)
+        if isCached(table):
+            invalidateCache(table)
+        return self._run(lambda db: insert_record(db, table, rec,keepid = keepid, update = update),retry=False)
     def getLastId(self,table):
-        self.checkDB()
-        return get_last_id(self.db,table)
+        return self._run(lambda db: get_last_id(db,table))
     def getLastRecord(self,table):
-        self.checkDB()
-        return get_last_record(self.db,table)
+        return self._run(lambda db: get_last_record(db,table))
     def getRecordById(self,table,id,idname='ID'):
-        self.checkDB()
-        return get_record_by_id(self.db,table,id,idname=idname)
+        load = lambda: self._run(lambda db: get_record_by_id(db,table,id,idname=idname))
+        if isCached(table):
+            return self.cached(table,('id',idname,id),load)
+        return load()
     def getMonData(self,addr,data):
-        self.checkDB()
-        self.c = self.db.cursor()
-        self.c.execute("""SELECT * FROM rss_mon WHERE `LatchAddress` = %s AND `LatchData` = %s;""",(addr,data))
-        res = np.array(self.c.fetchall())
-        return res
+        def query(db):
+            c = db.cursor()
+            c.execute("""SELECT * FROM rss_mon WHERE `LatchAddress` = %s AND `LatchData` = %s;""",(addr,data))
+            return np.array(c.fetchall())
+        return self._run(query)
     
     def get(self,*args):
-        self.checkDB()
-        return get_as_dict(self.db,*args,**dict(asfloat=True))
+        return self._run(lambda db: get_as_dict(db,*args,**dict(asfloat=True)))
     
     def getRec(self,*args):
-        self.checkDB()
-        return get_as_rec(self.db,*args)
+        return self._run(lambda db: get_as_rec(db,*args))
                            
     def getScanStatus(self):
         sc = self.getLastRecord('scans')
@@ -125,38 +840,27 @@ class GavrtDB():
         return self.get("SELECT * FROM scans WHERE ProjectID=%s AND Session=%s AND Scan=%s",(projectid,sessionid,scanid))
     
     def getScanTypes(self):
-        self.checkDB()
-        c = self.db.cursor()
-        c.execute("""SELECT COLUMN_TYPE FROM INFORMATION_SCHEMA.COLUMNS WHERE TABLE_NAME = 'scans' AND COLUMN_NAME = 'ScanType';""")
-        r = c.fetchone()[0]
-        return eval(r[4:])
+        def load():
+            r = self._run(lambda db: _fetch_one_dict(db,"""SELECT COLUMN_TYPE FROM INFORMATION_SCHEMA.COLUMNS WHERE TABLE_NAME = 'scans' AND COLUMN_NAME = 'ScanType';"""))['COLUMN_TYPE']
+            return eval(r[4:])
+        return self.cached('information_schema',('enum','scans','ScanType'),load)
     
     def getPersonality(self,ibob,spss=None):
         assert ibob in range(8)
-        self.checkDB()
         if spss is None:
-            c = self.db.cursor()
-            c.execute("""SELECT UnixTime,iBOBDesignID%d,iBOBADCClock%d FROM spss_config ORDER BY ID DESC LIMIT 1;""" % (ibob,ibob))
-            res = c.fetchone()
-            descr = [x[0] for x in c.description]
-            resd =  dict(zip(descr,res))
+            resd = self._run(lambda db: _fetch_one_dict(db,"""SELECT UnixTime,iBOBDesignID%d,iBOBADCClock%d FROM spss_config ORDER BY ID DESC LIMIT 1;""" % (ibob,ibob)))
         else:
             resd = spss
         clk = float(resd['iBOBADCClock%d' % ibob])
         dsgnid = resd['iBOBDesignID%d' %ibob]
         
         tupd = float(resd['UnixTime'])
-        c = self.db.cursor()
-        c.execute("""SELECT * FROM ibob_designs WHERE `ID` = %s;""",(dsgnid,))
-        res = c.fetchone()
-        descr = [x[0] for x in c.description]
-        resd =  dict(zip(descr,res))
+        resd = self.getRecordById('ibob_designs',dsgnid)
         pers = resd['Personality']
         
         return (tupd,pers,clk) #update time, personality, adcClock
     
     def getIBOBPersonalities(self,ibobs=range(8),spss=None):
-        self.checkDB()
         if spss is None:
             resd = self.get("""SELECT * FROM spss_config ORDER BY ID DESC LIMIT 1;""")
         else:
@@ -164,7 +868,7 @@ class GavrtDB():
         clks = [float(resd['iBOBADCClock%d' % ibob]) for ibob in ibobs]
         dsgnids = [resd['iBOBDesignID%d' %ibob] for ibob in ibobs]
         
-        dsgns = self.get("""SELECT * FROM ibob_designs;""")
+        dsgns = self.cached('ibob_designs','all',lambda: self.get("""SELECT * FROM ibob_designs;"""))
         
         tupd = float(resd['UnixTime'])
         psltys = []
@@ -198,17 +902,10 @@ class GavrtDB():
         return dict(Fiber=fib,Channel=chan,RX=rx, Sideband=sb,Polarization=pol,Synthesizer=syn,f0=f0,Feed=feed, PolarizationBasis=basis)
     
     def getRSSStatus(self):
-        self.checkDB()
-        crs = self.db.cursor()
         q = r"""SELECT * FROM rss_config ORDER BY ID DESC LIMIT 1;"""
-        crs.execute(q)
-        vals = list(crs.fetchone())
-        keys = [b[0] for b in crs.description]
-        rss = dict(zip(keys,vals))
-        return rss
+        return self._run(lambda db: _fetch_one_dict(db,q))
     
     def getIBOBStatusAt(self,t,ibob):
-        self.checkDB()
         rec = self.get("SELECT * FROM ibob_config WHERE iBOB = %s AND UnixTime < %s ORDER BY ID DESC LIMIT 1;",(ibob,t))
         res = {}
         for k in rec:
@@ -218,35 +915,82 @@ class GavrtDB():
         return res
     
     def getRSSStatusAt(self,t):
-        self.checkDB()
-        crs = self.db.cursor()
         q = r"""SELECT * FROM rss_config WHERE ReadyTime < %s ORDER BY ID DESC LIMIT 1;"""
-        crs.execute(q,t)
-        vals = list(crs.fetchone())
-        keys = [b[0] for b in crs.description]
-        rss = dict(zip(keys,vals))
-        return rss
+        return self._run(lambda db: _fetch_one_dict(db,q,t))
     
     def getSPSSStatusAt(self,t):
-        self.checkDB()
-        crs = self.db.cursor()
         q = r"""SELECT * FROM spss_config WHERE UnixTime < %s ORDER BY ID DESC LIMIT 1;"""
-        crs.execute(q,t)
-        vals = list(crs.fetchone())
-        keys = [b[0] for b in crs.description]
-        rss = dict(zip(keys,vals))
-        return rss
+        return self._run(lambda db: _fetch_one_dict(db,q,t))
     
+    def getConfigHistory(self,table,t0,t1,timecol='UnixTime',where=None,args=(),columns='*'):
+        """
+        Load the rows of configuration *table* in effect at any time t0 <= t <= t1 (the row in effect at t0 and the
+        rows which took effect after it) as a :class:`ConfigHistory`. *timecol* is the column holding the time each
+        row took effect, *where* an optional extra SQL condition with parameters *args*, and *columns* the columns to
+        load (must include ID and *timecol*)
+        """
+        cond = ''
+        if where is not None:
+            cond = ' AND ' + where
+        before = self._run(lambda db: get_as_dict(db,"SELECT %s FROM %s WHERE `%s` < %%s%s ORDER BY ID DESC LIMIT 1;" %
+                                                  (columns,table,timecol,cond),(t0,)+tuple(args),**dict(asfloat=False)))
+        during = self._run(lambda db: get_as_dict(db,"SELECT %s FROM %s WHERE `%s` >= %%s AND `%s` < %%s%s ORDER BY ID;" %
+                                                  (columns,table,timecol,timecol,cond),(t0,t1)+tuple(args),
+                                                  **dict(asfloat=False)))
+        if before and during:
+            rows = dict([(k,np.concatenate((before[k],during[k]))) for k in before.keys()])
+        else:
+            rows = before or during
+        return ConfigHistory(rows,timecol)
+
+    def getConfigAt(self,t,ibob):
+        """
+        Bulk version of :meth:`getRSSStatusAt`, :meth:`getSPSSStatusAt` and :meth:`getIBOBStatusAt` for offline
+        analysis: the configuration of *ibob* at each of the times in the array *t* (eg. the Timestamp column of a
+        history file). The configuration changes over the span of *t* are loaded once and each time is matched to
+        its row with a binary search, instead of querying each table once per time.
+
+        Returns a dictionary of column: array with one value per time (NaN or None before the first configuration):
+
+        * RSSConfigID, SPSSConfigID, IBOBConfigID - ID of the configuration row in effect
+        * Fiber, Channel, RX, Sideband, Polarization, Synthesizer, f0, Feed, PolarizationBasis - as returned by
+          :meth:`getRXStatusByIBob`
+        * ADCClock, DesignID, Personality - of *ibob* from the spss_config and ibob_designs tables
+        * Registers - dictionary of control register name: array of values logged in ibob_config
+        """
+        t = np.atleast_1d(np.asarray(t,dtype='float64'))
+        t0 = t.min() if len(t) else 0
+        t1 = t.max() if len(t) else 0
+        out = {}
+
+        rss = self.getConfigHistory('rss_config',t0,t1,timecol='ReadyTime')
+        idx = rss.index(t)
+        out['RSSConfigID'] = _take(rss.rows.get('ID',[]),idx)
+        rx = [self.getRXStatusByIBob(ibob,rss=rss.row(k)) for k in range(len(rss))]
+        for key in ['Fiber','Channel','RX','Sideband','Polarization','Synthesizer','f0','Feed','PolarizationBasis']:
+            out[key] = _take([r[key] for r in rx],idx)
+
+        spss = self.getConfigHistory('spss_config',t0,t1)
+        cols = spss.at(t,['ID','iBOBDesignID%d' % ibob,'iBOBADCClock%d' % ibob])
+        out['SPSSConfigID'] = cols['ID']
+        out['DesignID'] = cols['iBOBDesignID%d' % ibob]
+        out['ADCClock'] = np.array(list(cols['iBOBADCClock%d' % ibob]),dtype='float64')
+        personalities = self.getPersonalities()
+        out['Personality'] = np.array([personalities.get(d) for d in out['DesignID']],dtype=object)
+
+        ibc = self.getConfigHistory('ibob_config',t0,t1,where='iBOB = %s',args=(ibob,))
+        idx = ibc.index(t)
+        out['IBOBConfigID'] = _take(ibc.rows.get('ID',[]),idx)
+        status = [eval(s) for s in ibc.rows.get('StatusDict',[])]
+        names = set()
+        for s in status:
+            names.update(s.keys())
+        out['Registers'] = dict([(name,_take([s.get(name,np.nan) for s in status],idx)) for name in names])
+        return out
+
     def getSPSSStatus(self):
-        self.checkDB()
-        crs = self.db.cursor()
         q = r"""SELECT * FROM spss_config ORDER BY ID DESC LIMIT 1;"""
-        crs.execute(q)
-        vals = list(crs.fetchone())
-        keys = [b[0] for b in crs.description]
-        spss = dict(zip(keys,vals))
-        
-        return spss
+        return self._run(lambda db: _fetch_one_dict(db,q))
     
     def getSourceAt(self,t):
         """
@@ -315,11 +1059,20 @@ class GavrtDB():
             return scansource
         
          
+    def getSourcesAt(self,t):
+        """
+        Batch version of :meth:`getSourceAt` for an array of UnixTimes *t*, using a few range queries in all and a
+        cached index of the source catalog. See :func:`sourceid.identifySources`
+        """
+        import sourceid
+        return sourceid.identifySources(self,t)
+
     def getPersonalities(self):
-        self.checkDB()
-        crs = self.db.cursor()
-        crs.execute("""SELECT ID,Personality FROM ibob_designs;""")
-        vals = list(crs.fetchall())
+        def query(db):
+            crs = db.cursor()
+            crs.execute("""SELECT ID,Personality FROM ibob_designs;""")
+            return list(crs.fetchall())
+        vals = self.cached('ibob_designs','personalities',lambda: self._run(query))
         pdict = {}
         for v in vals:
             pdict[v[0]] = v[1]
@@ -327,15 +1080,15 @@ class GavrtDB():
     
     
     def getIPF(self,ipfid):
-        self.checkDB()
-        crs = self.db.cursor()
-        crs.execute("SELECT `IPF`,`Directory` FROM ibob_designs WHERE ibob_designs.ID = %d" % ipfid)
-        vals = list(crs.fetchone())
-        if len(vals) <1:
-            raise Exception("No such IPF_ID")
-        keys = [b[0] for b in crs.description]
-        resd = dict(zip(keys,vals))
-        return resd
+        def query(db):
+            crs = db.cursor()
+            crs.execute("SELECT `IPF`,`Directory` FROM ibob_designs WHERE ibob_designs.ID = %d" % ipfid)
+            res = crs.fetchone()
+            if not res:
+                raise Exception("No such IPF_ID")
+            keys = [b[0] for b in crs.description]
+            return dict(zip(keys,res))
+        return self.cached('ibob_designs',('ipf',ipfid),lambda: self._run(query))
     
     def updateValues(self,vald,table):
         """
@@ -0,0 +1,186 @@
+"""
+:mod:`historycatalog`
+---------------------
+
+Catalog of the iBOB history (h5) files written by :class:`~dss28core.IbobServer.IbobServer`.
+
+Each history file is entered in the catalog when it is closed (see :meth:`~dss28core.IbobServer.IbobServer.stop_writing`).
+The catalog stores the file path, iBOB, personality, time span, the RSS/SPSS configuration IDs in effect when
+recording started, and for every measurement type the number of rows and the row timestamps. This allows a
+query such as "all SpectralPower rows from iBOB 3 on source X last month" to be resolved to exact file/row
+ranges without opening any h5 files.
+
+The catalog is kept in a local SQLite file ($DSS28/history_catalog.sqlite by default) so it is available
+even when the GavrtDB is not.
+
+Example::
+
+    import historycatalog
+    cat = historycatalog.HistoryCatalog()
+    for r in cat.find(t0,t1,ibob=3,source='3C286'):
+        h5 = tables.openFile(r['Path'])
+        spec = h5.root.SpectralPower.II[r['StartRow']:r['StopRow']]
+"""
+import sqlite3
+import time
+import zlib
+
+import numpy as np
+
+import utils
+
+CATALOG_FILENAME = 'history_catalog.sqlite'
+
+_schema = [
+    """CREATE TABLE IF NOT EXISTS history_files (
+        ID INTEGER PRIMARY KEY AUTOINCREMENT,
+        Path TEXT NOT NULL,
+        iBOB INTEGER,
+        Personality TEXT,
+        StartTime REAL,
+        EndTime REAL,
+        RSSConfigID INTEGER,
+        SPSSConfigID INTEGER,
+        ScanID INTEGER,
+        SourceID INTEGER,
+        Source TEXT,
+        CatalogTime REAL
+    );""",
+    """CREATE TABLE IF NOT EXISTS history_measurements (
+        FileID INTEGER NOT NULL,
+        MeasurementType TEXT NOT NULL,
+        Rows INTEGER,
+        StartTime REAL,
+        EndTime REAL,
+        Timestamps BLOB
+    );""",
+    """CREATE INDEX IF NOT EXISTS history_files_time ON history_files (StartTime, EndTime);""",
+    """CREATE INDEX IF NOT EXISTS history_measurements_file ON history_measurements (FileID, MeasurementType);""",
+]
+
+_fileinfoKeys = ['RSSConfigID','SPSSConfigID','ScanID','SourceID','Source']
+
+def _packTimestamps(ts):
+    return sqlite3.Binary(zlib.compress(np.asarray(ts,dtype='float64').tostring()))
+
+def _unpackTimestamps(blob):
+    return np.fromstring(zlib.decompress(str(blob)),dtype='float64')
+
+class HistoryCatalog():
+    """
+    *filename* is the SQLite catalog file. By default $DSS28/history_catalog.sqlite
+
+    Several processes (one per iBOB server) may add to the same catalog; SQLite serializes the writes.
+    """
+    def __init__(self,filename=None):
+        if filename is None:
+            filename = utils.dss28Path(CATALOG_FILENAME)
+        self.filename = filename
+        self.db = sqlite3.connect(filename,timeout=30)
+        for stmt in _schema:
+            self.db.execute(stmt)
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+    def addFile(self,path,ibob,personality,measurements,fileinfo=None):
+        """
+        Add a closed history file to the catalog
+
+        *measurements* is a dictionary mapping measurement type (eg. 'SpectralPower') to the array of row timestamps
+
+        *fileinfo* is an optional dictionary with any of the keys RSSConfigID, SPSSConfigID, ScanID, SourceID, Source
+
+        Returns the catalog ID of the new entry
+        """
+        if fileinfo is None:
+            fileinfo = {}
+        starts = [ts[0] for ts in measurements.values() if len(ts)]
+        ends = [ts[-1] for ts in measurements.values() if len(ts)]
+        if starts:
+            tstart = float(min(starts))
+            tend = float(max(ends))
+        else:
+            tstart = tend = None
+        values = [path,ibob,personality,tstart,tend] + [fileinfo.get(k) for k in _fileinfoKeys] + [time.time()]
+        c = self.db.cursor()
+        c.execute("""INSERT INTO history_files (Path,iBOB,Personality,StartTime,EndTime,RSSConfigID,SPSSConfigID,ScanID,SourceID,Source,CatalogTime)
+                     VALUES (?,?,?,?,?,?,?,?,?,?,?);""",values)
+        fileid = c.lastrowid
+        for name,ts in measurements.items():
+            ts = np.asarray(ts,dtype='float64')
+            if len(ts):
+                span = (float(ts[0]),float(ts[-1]))
+            else:
+                span = (None,None)
+            c.execute("""INSERT INTO history_measurements (FileID,MeasurementType,Rows,StartTime,EndTime,Timestamps)
+                         VALUES (?,?,?,?,?,?);""",(fileid,name,len(ts),span[0],span[1],_packTimestamps(ts)))
+        self.db.commit()
+        return fileid
+
+    def removeFile(self,path):
+        """
+        Remove all catalog entries for *path*
+        """
+        c = self.db.cursor()
+        c.execute("SELECT ID FROM history_files WHERE Path = ?;",(path,))
+        ids = [r[0] for r in c.fetchall()]
+        for fileid in ids:
+            c.execute("DELETE FROM history_measurements WHERE FileID = ?;",(fileid,))
+            c.execute("DELETE FROM history_files WHERE ID = ?;",(fileid,))
+        self.db.commit()
+        return len(ids)
+
+    def files(self,t0,t1,ibob=None,personality=None,source=None):
+        """
+        Return a list of dictionaries describing the files which overlap the time range *t0* to *t1* (UnixTime)
+
+        *source* may be a source name or a source ID
+        """
+        q = "SELECT * FROM history_files WHERE StartTime <= ? AND EndTime >= ?"
+        args = [t1,t0]
+        if ibob is not None:
+            q += " AND iBOB = ?"
+            args.append(ibob)
+        if personality is not None:
+            q += " AND Personality = ?"
+            args.append(personality)
+        if source is not None:
+            if isinstance(source,basestring):
+                q += " AND Source = ?"
+            else:
+                q += " AND SourceID = ?"
+                source = int(source)
+            args.append(source)
+        q += " ORDER BY StartTime;"
+        c = self.db.cursor()
+        c.execute(q,args)
+        descr = [x[0] for x in c.description]
+        return [dict(zip(descr,r)) for r in c.fetchall()]
+
+    def find(self,t0,t1,ibob=None,personality=None,source=None,measurement='SpectralPower'):
+        """
+        Resolve a time range to the history file rows which contain it
+
+        Returns a list of dictionaries, one per file, with keys Path, iBOB, Personality, Source, MeasurementType,
+        StartRow, StopRow (python slice convention), StartTime and EndTime (timestamps of first and last selected rows).
+        Files with no rows in the time range are omitted.
+        """
+        out = []
+        c = self.db.cursor()
+        for f in self.files(t0,t1,ibob=ibob,personality=personality,source=source):
+            c.execute("""SELECT Timestamps FROM history_measurements WHERE FileID = ? AND MeasurementType = ?;""",
+                      (f['ID'],measurement))
+            r = c.fetchone()
+            if r is None:
+                continue
+            ts = _unpackTimestamps(r[0])
+            start = np.searchsorted(ts,t0,side='left')
+            stop = np.searchsorted(ts,t1,side='right')
+            if stop <= start:
+                continue
+            out.append(dict(Path=f['Path'],iBOB=f['iBOB'],Personality=f['Personality'],Source=f['Source'],
+                            MeasurementType=measurement,StartRow=int(start),StopRow=int(stop),
+                            StartTime=ts[start],EndTime=ts[stop-1]))
+        return out
@@ -0,0 +1,290 @@
+"""
+:mod:`monseries`
+----------------
+
+Time series store for the RSS monitor points (the rss_mon table of the GavrtDB), for plotting long spans quickly.
+
+Samples are copied from rss_mon into a local SQLite file ($DSS28/monitor_series.sqlite by default) where they are
+indexed by sensor and time, so reading one sensor does not mean reading (and masking) every sensor on the same
+latch address. As samples are added, 1 minute and 1 hour rollups (count, min, mean, max per bin, bins aligned to
+multiples of the interval in UnixTime) are updated, and :meth:`MonitorSeries.query` reads whichever resolution
+gives no more than the requested number of points for the span.
+
+A sensor is identified by its (LatchAddress, LatchData, AdcChan) tuple or by its name in rss_monitor_points.
+
+Example::
+
+    import gavrtdb, monseries
+    ms = monseries.MonitorSeries()
+    ms.sync(gavrtdb.GavrtDB())          # copy new rss_mon rows (the monitor host does this every SYNC_INTERVAL)
+    d = ms.query((1,2,0),time.time()-30*86400,time.time(),maxpoints=2000)
+    plot(d['UnixTime'],d['Value'])      # hourly means for a month; d['Min'] and d['Max'] for the envelope
+"""
+import sqlite3
+
+import numpy as np
+
+import utils
+
+SERIES_FILENAME = 'monitor_series.sqlite'
+ROLLUP_INTERVALS = [60, 3600]   # seconds
+MAX_POINTS = 2000               # default point budget for query
+SYNC_CHUNK = 100000             # rss_mon rows copied per query by sync
+SYNC_INTERVAL = 60.0            # seconds between syncs by the monitor host (see dss28core.monitor_host)
+
+def _rollupTable(interval):
+    return 'rollup_%d' % interval
+
+_schema = [
+    """CREATE TABLE IF NOT EXISTS sensors (
+        ID INTEGER PRIMARY KEY AUTOINCREMENT,
+        LatchAddress INTEGER NOT NULL,
+        LatchData INTEGER NOT NULL,
+        AdcChan INTEGER NOT NULL,
+        Name TEXT,
+        UNIQUE (LatchAddress, LatchData, AdcChan)
+    );""",
+    """CREATE TABLE IF NOT EXISTS samples (
+        SensorID INTEGER NOT NULL,
+        UnixTime REAL NOT NULL,
+        Value REAL,
+        PRIMARY KEY (SensorID, UnixTime)
+    );""",
+    """CREATE TABLE IF NOT EXISTS sync_state (
+        Source TEXT PRIMARY KEY,
+        LastID INTEGER
+    );""",
+] + ["""CREATE TABLE IF NOT EXISTS %s (
+        SensorID INTEGER NOT NULL,
+        Bin REAL NOT NULL,
+        Count INTEGER,
+        Sum REAL,
+        Min REAL,
+        Max REAL,
+        PRIMARY KEY (SensorID, Bin)
+    );""" % _rollupTable(interval) for interval in ROLLUP_INTERVALS]
+
+def _groups(*keys):
+    """
+    internal: for sorted arrays *keys*, the start index of each run of equal keys and the run lengths
+    """
+    n = len(keys[0])
+    if n == 0:
+        return np.zeros((0,),dtype=int),np.zeros((0,),dtype=int)
+    change = np.zeros((n-1,),dtype=bool)
+    for k in keys:
+        change |= k[1:] != k[:-1]
+    starts = np.concatenate(([0],np.flatnonzero(change) + 1))
+    return starts,np.diff(np.concatenate((starts,[n])))
+
+class MonitorSeries():
+    """
+    *filename* is the SQLite file. By default $DSS28/monitor_series.sqlite
+    """
+    def __init__(self,filename=None):
+        if filename is None:
+            filename = utils.dss28Path(SERIES_FILENAME)
+        self.filename = filename
+        self.db = sqlite3.connect(filename,timeout=30)
+        for stmt in _schema:
+            self.db.execute(stmt)
+        self.db.commit()
+        self._sensorIds = {}
+        self._loadSensors()
+
+    def close(self):
+        self.db.close()
+
+    def _loadSensors(self):
+        c = self.db.cursor()
+        c.execute("SELECT ID,LatchAddress,LatchData,AdcChan,Name FROM sensors;")
+        for sid,la,ld,ch,name in c.fetchall():
+            self._sensorIds[(la,ld,ch)] = sid
+            if name:
+                self._sensorIds[name] = sid
+
+    def sensors(self):
+        """
+        Return a list of dictionaries describing the sensors in the store
+        """
+        c = self.db.cursor()
+        c.execute("SELECT * FROM sensors ORDER BY LatchAddress,LatchData,AdcChan;")
+        descr = [x[0] for x in c.description]
+        return [dict(zip(descr,r)) for r in c.fetchall()]
+
+    def sensorId(self,sensor,create=False):
+        """
+        ID of *sensor*, given as (LatchAddress, LatchData, AdcChan) or by name. With *create*, a sensor tuple which
+        is not yet in the store is added
+        """
+        if not isinstance(sensor,basestring):
+            sensor = tuple([int(x) for x in sensor])
+        try:
+            return self._sensorIds[sensor]
+        except KeyError:
+            pass
+        if not create or isinstance(sensor,basestring):
+            raise KeyError("unknown monitor point %s" % str(sensor))
+        c = self.db.cursor()
+        c.execute("INSERT OR IGNORE INTO sensors (LatchAddress,LatchData,AdcChan) VALUES (?,?,?);",sensor)
+        c.execute("SELECT ID FROM sensors WHERE LatchAddress = ? AND LatchData = ? AND AdcChan = ?;",sensor)
+        sid = c.fetchone()[0]
+        self._sensorIds[sensor] = sid
+        return sid
+
+    def setNames(self,points):
+        """
+        Set sensor names from *points*, a dictionary with Name, LatchAddress, LatchData and AdcChan arrays (eg. the
+        rss_monitor_points table)
+        """
+        for name,la,ld,ch in zip(points['Name'],points['LatchAddress'],points['LatchData'],points['AdcChan']):
+            sid = self.sensorId((la,ld,ch),create=True)
+            self.db.execute("UPDATE sensors SET Name = ? WHERE ID = ?;",(name,sid))
+            self._sensorIds[name] = sid
+        self.db.commit()
+
+    def add(self,latchaddress,latchdata,adcchan,unixtime,value,commit=True):
+        """
+        Add samples (equal length arrays of LatchAddress, LatchData, AdcChan, UnixTime and Value) and update the
+        rollups. Samples already in the store are ignored, but would be counted twice in the rollups, so each sample
+        should be added only once (:meth:`sync` takes care of this)
+        """
+        keys = np.column_stack((latchaddress,latchdata,adcchan)).astype('int64')
+        t = np.asarray(unixtime,dtype='float64')
+        v = np.asarray(value,dtype='float64')
+        if len(t) == 0:
+            return 0
+        ukeys,inverse = np.unique(keys.view([('',keys.dtype)]*3).ravel(),return_inverse=True)
+        sids = np.array([self.sensorId(tuple(k),create=True) for k in ukeys],dtype='int64')[inverse]
+        order = np.lexsort((t,sids))
+        sids = sids[order]
+        t = t[order]
+        v = v[order]
+        c = self.db.cursor()
+        c.executemany("INSERT OR IGNORE INTO samples (SensorID,UnixTime,Value) VALUES (?,?,?);",
+                      zip(sids.tolist(),t.tolist(),v.tolist()))
+        for interval in ROLLUP_INTERVALS:
+            self._rollup(c,interval,sids,t,v)
+        if commit:
+            self.db.commit()
+        return len(t)
+
+    def _rollup(self,c,interval,sids,t,v):
+        """
+        internal: merge samples (sorted by sensor and time) into the rollup bins of *interval*
+        """
+        table = _rollupTable(interval)
+        bins = np.floor(t/interval)*interval
+        good = np.isfinite(v)
+        sids,bins,v = sids[good],bins[good],v[good]
+        starts,counts = _groups(sids,bins)
+        if len(starts) == 0:
+            return
+        new = dict(SensorID=sids[starts],Bin=bins[starts],Count=counts,Sum=np.add.reduceat(v,starts),
+                   Min=np.minimum.reduceat(v,starts),Max=np.maximum.reduceat(v,starts))
+        rows = {}
+        for k in range(len(starts)):
+            rows[(new['SensorID'][k],new['Bin'][k])] = [int(new['Count'][k]),new['Sum'][k],new['Min'][k],new['Max'][k]]
+        # merge with the bins already stored
+        sstarts,scounts = _groups(new['SensorID'])
+        for s,n in zip(sstarts,scounts):
+            c.execute("SELECT Bin,Count,Sum,Min,Max FROM %s WHERE SensorID = ? AND Bin >= ? AND Bin <= ?;" % table,
+                      (int(new['SensorID'][s]),new['Bin'][s],new['Bin'][s+n-1]))
+            for b,count,total,vmin,vmax in c.fetchall():
+                row = rows.get((new['SensorID'][s],b))
+                if row is not None:
+                    rows[(new['SensorID'][s],b)] = [row[0]+count,row[1]+total,min(row[2],vmin),max(row[3],vmax)]
+        c.executemany("INSERT OR REPLACE INTO %s (SensorID,Bin,Count,Sum,Min,Max) VALUES (?,?,?,?,?,?);" % table,
+                      [(int(sid),float(b),row[0],float(row[1]),float(row[2]),float(row[3]))
+                       for (sid,b),row in rows.items()])
+
+    def sync(self,gdb,chunk=SYNC_CHUNK):
+        """
+        Copy the rss_mon rows added since the last sync from the GavrtDB *gdb*, and update the sensor names from
+        rss_monitor_points. Returns the number of rows copied
+        """
+        c = self.db.cursor()
+        c.execute("SELECT LastID FROM sync_state WHERE Source = 'rss_mon';")
+        r = c.fetchone()
+        lastid = r[0] if r else 0
+        if not [key for key in self._sensorIds.keys() if isinstance(key,basestring)]:
+            self.setNames(gdb.get("SELECT Name,LatchAddress,LatchData,AdcChan FROM rss_monitor_points;"))
+        total = 0
+        while True:
+            d = gdb.get("""SELECT ID,UnixTime,LatchAddress,LatchData,AdcChan,Voltage FROM rss_mon WHERE ID > %s
+                           ORDER BY ID LIMIT %s;""",(lastid,chunk))
+            if not d:
+                break
+            self.add(d['LatchAddress'],d['LatchData'],d['AdcChan'],d['UnixTime'],d['Voltage'],commit=False)
+            lastid = int(d['ID'][-1])
+            self.db.execute("INSERT OR REPLACE INTO sync_state (Source,LastID) VALUES ('rss_mon',?);",(lastid,))
+            self.db.commit()
+            total += len(d['ID'])
+            if len(d['ID']) < chunk:
+                break
+        return total
+
+    def resolution(self,sensor,t0,t1,maxpoints=MAX_POINTS):
+        """
+        The resolution :meth:`query` uses for *sensor* over *t0* to *t1*: 0 for the samples themselves if there are
+        no more than *maxpoints* of them, otherwise the finest rollup interval giving no more than *maxpoints* bins
+        (or the coarsest interval)
+        """
+        sid = self.sensorId(sensor)
+        coarsest = ROLLUP_INTERVALS[-1]
+        if self._countSamples(sid,t0,t1) <= maxpoints:
+            return 0
+        for interval in ROLLUP_INTERVALS:
+            if (t1 - t0)/interval <= maxpoints:
+                return interval
+        return coarsest
+
+    def _countSamples(self,sid,t0,t1):
+        """
+        internal: number of samples of sensor *sid* with *t0* <= UnixTime <= *t1*, from the coarsest rollup for the
+        bins lying wholly inside the span and from the samples themselves for the partial bins at either end
+        """
+        interval = ROLLUP_INTERVALS[-1]
+        b0 = np.ceil(t0/interval)*interval
+        b1 = np.floor(t1/interval)*interval
+        c = self.db.cursor()
+        if b1 - b0 < interval:
+            c.execute("SELECT COUNT(*) FROM samples WHERE SensorID = ? AND UnixTime >= ? AND UnixTime <= ?;",
+                      (sid,t0,t1))
+            return c.fetchone()[0]
+        c.execute("SELECT SUM(Count) FROM %s WHERE SensorID = ? AND Bin >= ? AND Bin < ?;" % _rollupTable(interval),
+                  (sid,b0,b1))
+        n = c.fetchone()[0] or 0
+        c.execute("""SELECT COUNT(*) FROM samples WHERE SensorID = ? AND
+                     ((UnixTime >= ? AND UnixTime < ?) OR (UnixTime >= ? AND UnixTime <= ?));""",(sid,t0,b0,b1,t1))
+        return n + c.fetchone()[0]
+
+    def query(self,sensor,t0,t1,maxpoints=MAX_POINTS,resolution=None):
+        """
+        Read *sensor* for *t0* <= UnixTime <= *t1* at the resolution chosen by :meth:`resolution` (or the given
+        *resolution*: 0 or one of ROLLUP_INTERVALS)
+
+        Returns a dictionary with keys:
+
+        * UnixTime - sample times, or start times of the rollup bins
+        * Value - sample values, or bin means
+        * Min, Max, Count - bin minimum, maximum and number of samples (equal to Value and 1 for samples)
+        * resolution - 0 for samples, otherwise the rollup interval in seconds
+        """
+        sid = self.sensorId(sensor)
+        if resolution is None:
+            resolution = self.resolution(sensor,t0,t1,maxpoints)
+        c = self.db.cursor()
+        if resolution == 0:
+            c.execute("SELECT UnixTime,Value FROM samples WHERE SensorID = ? AND UnixTime >= ? AND UnixTime <= ? ORDER BY UnixTime;",
+                      (sid,t0,t1))
+            rows = np.array(c.fetchall(),dtype='float64').reshape((-1,2))
+            return dict(UnixTime=rows[:,0],Value=rows[:,1],Min=rows[:,1],Max=rows[:,1],
+                        Count=np.ones((len(rows),),dtype='int64'),resolution=0)
+        if resolution not in ROLLUP_INTERVALS:
+            raise ValueError("resolution must be 0 or one of %s" % str(ROLLUP_INTERVALS))
+        c.execute("SELECT Bin,Count,Sum,Min,Max FROM %s WHERE SensorID = ? AND Bin >= ? AND Bin <= ? ORDER BY Bin;" %
+                  _rollupTable(resolution),(sid,np.floor(t0/resolution)*resolution,t1))
+        rows = np.array(c.fetchall(),dtype='float64').reshape((-1,5))
+        return dict(UnixTime=rows[:,0],Value=rows[:,2]/np.maximum(rows[:,1],1),Min=rows[:,3],Max=rows[:,4],
+                    Count=rows[:,1].astype('int64'),resolution=resolution)
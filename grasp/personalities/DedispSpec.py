@@ -8,8 +8,42 @@ import time
 
 from IbobPersonality import IbobPersonality
 
+K_DM = 4.148808e3   # dispersion constant in MHz**2 pc**-1 cm**3 s
+
+IDD_CACHE_SIZE = 64
+_iddCache = {}
+
+def compileIDD(dm,freqs,t_int):
+    """
+    Compute the incoherent dedispersion (IDD) coefficient table for dispersion measure *dm* (pc/cm**3).
+
+    *freqs* are the sky frequencies (MHz) of the IDD channels (see _iddfrq) and *t_int* the integration time (s).
+    Row 0 of the returned table holds the delay of each channel in integrations relative to the highest
+    frequency, laid out as expected by :meth:`_BaseDedisp.setIDD` (coeffs[k,m] is written to address (k<<10)+m).
+
+    Tables are cached by (dm, freqs, t_int), so switching back and forth between DMs costs nothing; the returned
+    arrays are read only.
+    """
+    freqs = np.asarray(freqs,dtype='float64')
+    key = (float(dm),tuple(np.round(freqs,6)),float(t_int))
+    try:
+        return _iddCache[key]
+    except KeyError:
+        pass
+    if (freqs <= 0).any():
+        raise ValueError("IDD channel frequencies must be positive, use sky frequencies (rf0)")
+    fmax = freqs.max()
+    delays = K_DM*dm*(1.0/freqs**2 - 1.0/fmax**2)/t_int
+    coeffs = np.round(delays).astype('int64')[np.newaxis,:]
+    coeffs.flags.writeable = False
+    if len(_iddCache) >= IDD_CACHE_SIZE:
+        _iddCache.pop(_iddCache.keys()[0])
+    _iddCache[key] = coeffs
+    return coeffs
+
 
 class _BaseDedisp(IbobPersonality):
+    _eqMax = ((1<<28)-1)/8.0
     def __init__(self,parent = None,adcClock=1024.0):
         self._adcClock = adcClock
         self._parent = parent
@@ -27,6 +61,9 @@ class _BaseDedisp(IbobPersonality):
                 "arrays": {
                     "II" : (256,)
                 },
+                "dtypes": {
+                    "II" : 'uint32'
+                },
             },
 
             "ADCSnapshot" : {
@@ -40,6 +77,9 @@ class _BaseDedisp(IbobPersonality):
                 },
                 "arrays": {
                     "adcI" : (16384,)
+                },
+                "dtypes": {
+                    "adcI" : 'int8'
                 }
             },
             "DedispersedTotalPower" : {
@@ -52,6 +92,9 @@ class _BaseDedisp(IbobPersonality):
                   },
                   "arrays": {
                      "II" : (2048,)
+                 },
+                  "dtypes": {
+                     "II" : 'uint32'
                  }
           },
             "TriggeredDedispersedTotalPower" : {
@@ -63,6 +106,9 @@ class _BaseDedisp(IbobPersonality):
                   },
                   "arrays": {
                      "II" : (2048,)
+                 },
+                  "dtypes": {
+                     "II" : 'uint32'
                  }
           }
         }
@@ -123,9 +169,10 @@ class _BaseDedisp(IbobPersonality):
         #acc_len = 2048 # hardwire for now to known working condition
         period = acc_len*16384
         
-        self.regwrite("cs/vacc/acc_len",acc_len-1)
-        self.regwrite("period1",period-2)
-        self._write_info({'IntegrationTime': t_int})
+        with self.config():
+            self.regwrite("cs/vacc/acc_len",acc_len-1)
+            self.regwrite("period1",period-2)
+            self._write_info({'IntegrationTime': t_int})
         
     def setTvg(self,tvg):
         self.regwrite("tvg",tvg)
@@ -139,30 +186,77 @@ class _BaseDedisp(IbobPersonality):
         eqs[mask] = 0
         self.setEQ(eqs)
         
-    def setEQ(self,eqI):
+    def setEQ(self,eqI,full=False):
+        """
+        Set the EQ coefficients. Only coefficients which changed since the last upload are sent unless *full* is True
+        """
         self.eqI = eqI
-        eqI = (eqI*8).round().astype('int')
-        
-        t = time.time()
-        tries = 0
-        for k in range(eqI.shape[0]):
-            #tries += self.setcheck('iddaddr',k)
-            data = 8<<28
-            data += eqI[k]
-            #tries += self.setcheck('coeff',data)
-            tries += self.sendcoeff(k, data)
-            #print k,":",tries
+        eqI = (np.asarray(eqI)*8).round().astype('int')
+        values = (8<<28) + eqI
+        self._uploadCoefficients('eq','setcoeff 0x%(address)08X 0x%(value)08X',range(eqI.shape[0]),values,full=full)
         self.regwrite('coeff',0)
-        print "done in",(time.time()-t), "tries",tries
         
-    def setIDD(self,coeffs,smooth=1,reverse=False):
-        tries = 0
-        for k in range(coeffs.shape[0]):
-            for m in range(coeffs.shape[1]):
-                data = 1<<29    #iddwe is bit 29
-                addr = (k<<10) + (m)
-                data += coeffs[k,m]
-                tries += self.sendcoeff(addr,data)
+    def iddSkyFrequencies(self,rf0=None,sideband=1):
+        """
+        Sky frequencies (MHz) of the IDD channels, rf0 + sideband*baseband with the baseband frequencies from
+        _iddfrq() (shifted by 2*adcClock for the low clock designs, as in
+        :func:`~dss28core.channelwindow.channelFrequencies`).
+
+        If *rf0* is not given, f0 and Sideband of this iBOB's receiver are read from the current RSS configuration
+        with :meth:`~gavrtdb.GavrtDB.getRXStatusByIBob`.
+        """
+        if rf0 is None:
+            if self._parent is None:
+                raise ValueError("rf0 must be given when the personality is not attached to an iBOB")
+            rxstatus = self._gdb.getRXStatusByIBob(self._ibobID)
+            rf0 = rxstatus['f0']
+            sideband = rxstatus['Sideband']
+        bb = np.asarray(self._iddfrq(),dtype='float64')
+        if self._adcClock < 200:
+            bb = bb + 2*self._adcClock
+        return rf0 + sideband*bb
+
+    def integrationTime(self):
+        """
+        Integration time (s) the iBOB is running with, from the cs/vacc/acc_len register read back with
+        :meth:`~dss28core.IbobServer.IbobServer.read_registers` (the inverse of :meth:`setIntegrationTime`).
+        """
+        if self._parent is None:
+            raise ValueError("t_int must be given when the personality is not attached to an iBOB")
+        acc_len = self._parent.read_registers(['cs/vacc/acc_len']).get('cs/vacc/acc_len')
+        if acc_len is None:
+            raise ValueError("could not read cs/vacc/acc_len from iBOB %s" % self._ibobID)
+        self._controlRegisters['cs/vacc/acc_len'] = acc_len
+        return (acc_len + 1)*1024.0/(self._adcClock*1e6)
+
+    def iddTable(self,dm,rf0=None,sideband=1,t_int=None):
+        """
+        Compile (or fetch from the cache) the IDD coefficient table for *dm* at the channel frequencies given by
+        :meth:`iddSkyFrequencies`.
+
+        If the integration time *t_int* (s) is not given, it is read back from the iBOB with
+        :meth:`integrationTime`.
+        """
+        if t_int is None:
+            t_int = self.integrationTime()
+        return compileIDD(dm,self.iddSkyFrequencies(rf0,sideband),t_int)
+
+    def setDM(self,dm,rf0=None,sideband=1,smooth=1,reverse=False,full=False,t_int=None):
+        """
+        Set the hardware dedispersion to *dm* (pc/cm**3). See :meth:`iddTable` and :meth:`setIDD`
+        """
+        self.setIDD(self.iddTable(dm,rf0=rf0,sideband=sideband,t_int=t_int),smooth=smooth,reverse=reverse,full=full)
+
+    def setIDD(self,coeffs,smooth=1,reverse=False,full=False):
+        """
+        Upload the IDD coefficient table *coeffs*. Only the coefficients which differ from the last table uploaded to
+        this iBOB are sent unless *full* is True.
+        """
+        coeffs = np.asarray(coeffs)
+        k,m = np.indices(coeffs.shape)
+        addresses = ((k<<10) + m).ravel()
+        values = ((1<<29) + coeffs).ravel()    #iddwe is bit 29
+        self._uploadCoefficients('idd','setcoeff 0x%(address)08X 0x%(value)08X',addresses,values,full=full)
         self.regwrite('coeff',0)
         ctrl = self._controlRegisters['cs/IDD/iddctrl'] & 0x3 #save trigger settings in bottom two bits
         if reverse:
@@ -197,7 +291,7 @@ class _BaseDedisp(IbobPersonality):
     def _reconstructMeasurement(self,m):
         if m.type == 'S':       #check what kind of data we got from the iBOB
             bram0 = m.brams[0,:].view(dtype='uint32').byteswap()        #reinterpret as uint32
-            dataI = bram0.astype('float')
+            dataI = bram0
             #dataI and dataQ now have the properly interpreted data
             
             name = "SpectralPower"    #The name could be used to refer to the appropriate part of the h5 file hierarchy to store the data in
@@ -215,18 +309,7 @@ class _BaseDedisp(IbobPersonality):
             #no need to return anything, m.tabledict and m.arraydict can be passed on to the dataserver now
             return (name, arraydict, tabledict)
         if m.type == 'A':
-            bram0 = m.brams[0,:].view(dtype='int8').astype('float32')
-            bram1 = m.brams[1,:].view(dtype='int8').astype('float32')
-            adcI = np.zeros((bram0.shape[0]*2,),dtype='float32')
-            
-            adcI[0::8] = bram1[3::4]
-            adcI[1::8] = bram1[2::4]
-            adcI[2::8] = bram1[1::4]
-            adcI[3::8] = bram1[0::4]
-            adcI[4::8] = bram0[3::4]
-            adcI[5::8] = bram0[2::4]
-            adcI[6::8] = bram0[1::4]
-            adcI[7::8] = bram0[0::4]
+            adcI = self._unscrambleAdc(m)
             #adcQ = np.array(m.brams[1,:].view(dtype='int8'),dtype='float')
             
             name = "ADCSnapshot"
@@ -242,7 +325,7 @@ class _BaseDedisp(IbobPersonality):
             #no need to return anything, m.tabledict and m.arraydict can be passed on to the dataserver now
             return (name, arraydict, tabledict)
         if m.type == 'E':
-            data = np.array(m.brams[0,:].view(dtype='uint32').byteswap(),dtype='float')
+            data = m.brams[0,:].view(dtype='uint32').byteswap()
             offset = m.extra_param_18
             data = np.roll(data,-offset,axis=0)
             name = "TriggeredDedispersedTotalPower"
@@ -256,7 +339,7 @@ class _BaseDedisp(IbobPersonality):
                  }
             return (name, arraydict, tabledict)
         if m.type == 'D':
-            data = np.array(m.brams[0,:].view(dtype='uint32').byteswap(),dtype='float')
+            data = m.brams[0,:].view(dtype='uint32').byteswap()
             name = "DedispersedTotalPower"
             tabledict = {
                   'AccNumber':m.accum_num,
@@ -279,6 +362,10 @@ class DDCDedisp(_BaseDedisp):
         print "ddcdedisp: now adcClock",self._adcClock
     def _bbfrq(self):
         return np.fft.fftshift(np.arange(384,640))*self._adcClock/1024.0
+
+    def _eqBandpass(self,spectra):
+        # the spectra are fftshifted with respect to the hardware (IDD/EQ) channel order, see _bbfrq and _iddfrq
+        return np.fft.ifftshift(np.median(spectra,axis=0))
     
     def _iddfrq(self):
         return np.arange(384,640)*self._adcClock/1024.0
@@ -5,8 +5,10 @@ iBOB Personalities
 These are personalities for ibobs
 """
 import time
+from contextlib import contextmanager
 import numpy as np
 import gavrtdb
+import ppstiming
 
 class IbobPersonality(object):
     """
@@ -28,6 +30,11 @@ class IbobPersonality(object):
         self._measTypes = self._measTypesDict.keys()
         self._infoTable = {}
         self._controlRegisters = {}
+        
+        self._txDepth = 0           # configuration transaction nesting, see config()
+        self._txInfo = None
+        self._txChanged = False
+        self._txWritedb = False
                                         
         if parent is not None:
             self._gdb = gavrtdb.GavrtDB(True)
@@ -39,40 +46,96 @@ class IbobPersonality(object):
             self._regwrite = parent.write_register
             self.regread = parent.read_register
             self.sendget = parent.sendget_command
-            self._write_info = parent.write_spec_info
+            self._write_info = self._writeInfo
     
-    def readFromIbob(self):
+    def readFromIbob(self,max_age=None):
+        """
+        Update _controlRegisters from the iBOB with one bulk readback (see
+        :meth:`~dss28core.IbobServer.IbobServer.read_registers`). Values at most *max_age* seconds old may come from
+        the server's cache; by default the server's REGISTER_CACHE_TTL applies.
+        """
         try:
-            for reg in self._controlRegisters:
-                self._controlRegisters[reg] = self.regread(reg)
+            if max_age is None:
+                values = self._parent.read_registers(self._controlRegisters.keys())
+            else:
+                values = self._parent.read_registers(self._controlRegisters.keys(),max_age)
+            for reg,value in values.items():
+                if value is not None:
+                    self._controlRegisters[reg] = value
         except Exception,e:
             print 'read_from_iBOB:',e
+    read_from_iBOB = readFromIbob
+    def _infoDict(self):
+        idict = {}
+        for key,value in self._controlRegisters.items():
+            idict[key.replace('/','_')] = value 
+        return idict
     def storeConfig(self,writedb=True):
         """
         Store current iBOB configuration in H5 file if available and optionally in database
         
         Intended to be called by StartRecord
         """
-        idict = {}
-        for key,value in self._controlRegisters.items():
-            idict[key.replace('/','_')] = value 
-        self._parent.write_spec_info(idict)
+        self._parent.write_spec_info(self._infoDict())
         if writedb:
             self._gdb.insertRecord('ibob_config', dict(UnixTime=time.time(), StatusDict=repr(self._controlRegisters), iBOB=self._ibobID))
-    def regwrite(self,reg,val,writedb=True):
+    
+    @contextmanager
+    def config(self,writedb=True):
+        """
+        Configuration transaction.
+        
+        Register writes made with regwrite inside the block are sent to the iBOB immediately, but the InfoTable row
+        (including anything passed to _write_info) and the ibob_config database row are written only once, when the
+        outermost block exits. Set *writedb* False to skip the database row.
+        
+        Example::
+        
+            with p.config():
+                p.setIntegrationTime(40e-3)
+                p.setTvg(0)
+        """
+        if self._txDepth == 0:
+            self._txInfo = {}
+            self._txChanged = False
+            self._txWritedb = False
+        self._txDepth += 1
         try:
-            if self._controlRegisters.has_key(reg):
-                self._controlRegisters[reg] = val
-                idict = {}
-                for key,value in self._controlRegisters.items():
-                    idict[key.replace('/','_')] = value 
-                self._parent.write_spec_info(idict)
+            yield self
+        finally:
+            self._txDepth -= 1
+            if self._txDepth == 0:
+                self._commitConfig(writedb)
+    
+    def _commitConfig(self,writedb):
+        info = self._txInfo
+        self._txInfo = None
+        if self._txChanged:
+            info.update(self._infoDict())
+        try:
+            if info:
+                self._parent.write_spec_info(info)
         except Exception, e:
-            print reg,val,e
-        if writedb:
+            print "config: could not write info",e
+        if writedb and self._txWritedb:
             self._gdb.insertRecord('ibob_config', dict(UnixTime=time.time(), StatusDict=repr(self._controlRegisters), iBOB=self._ibobID))
-
-        self._parent.write_register(reg,val)
+    
+    def _writeInfo(self,info):
+        if self._txDepth:
+            self._txInfo.update(info)
+        else:
+            self._parent.write_spec_info(info)
+    
+    def regwrite(self,reg,val,writedb=True):
+        """
+        Write *val* to register *reg* and record the configuration (see :meth:`config`)
+        """
+        with self.config():
+            if self._controlRegisters.has_key(reg):
+                self._controlRegisters[reg] = val
+                self._txChanged = True
+            self._txWritedb = self._txWritedb or writedb
+            self._parent.write_register(reg,val)
     regWrite = regwrite
     def adcReset(self,interleave=False):
         """
@@ -103,6 +166,25 @@ class IbobPersonality(object):
         self._sendget('endudp')
     
     
+    def _armPPS(self,second):
+        """
+        Arm the iBOB to synchronize on the PPS edge starting UNIX second *second*
+        """
+        self._sendget('pps x%x' % second)
+
+    def _syncAtPhase(self,phase,second=None):
+        """
+        Sleep (without busy waiting) until *phase* of the next second, or of UNIX second *second* if given, then arm
+        the PPS synchronization for the following PPS edge. Passing the same *second* to a group of iBOBs arms them
+        all on the same edge. The wakeup error is recorded in ppstiming.jitter.
+        """
+        target = None
+        if second is not None:
+            target = second + phase
+        stt = ppstiming.armAtPhase(self._armPPS,phase,target=target,label='iBOB%s' % getattr(self,'_ibobID','?'))
+        print "armed at:",stt
+        return stt
+
     def requestAdcSnapshot(self):
         """
         Request an ADC snapshot
@@ -110,6 +192,85 @@ class IbobPersonality(object):
         """
         return self._regwrite('snap/ctrl',7)
     
+    def _unscrambleAdc(self,m):
+        """
+        Reassemble the ADC snapshot of single input (interleaved ADC) designs from the two snapshot brams.
+
+        Returns the samples as int8 so statistics can be computed before any conversion to floating point
+        """
+        bram0 = m.brams[0,:].view(dtype='int8')
+        bram1 = m.brams[1,:].view(dtype='int8')
+        adcI = np.empty((bram0.shape[0]*2,),dtype='int8')
+
+        adcI[0::8] = bram1[3::4]
+        adcI[1::8] = bram1[2::4]
+        adcI[2::8] = bram1[1::4]
+        adcI[3::8] = bram1[0::4]
+        adcI[4::8] = bram0[3::4]
+        adcI[5::8] = bram0[2::4]
+        adcI[6::8] = bram0[1::4]
+        adcI[7::8] = bram0[0::4]
+        return adcI
+
+    def _uploadCoefficients(self,table,command,addresses,values,ok='OK',full=False):
+        """
+        Upload a coefficient table through the parent :class:`~dss28core.IbobServer.IbobServer`, which sends only the
+        coefficients that changed since the last upload, in batches (see
+        :meth:`~dss28core.IbobServer.IbobServer.write_coefficients`)
+        """
+        t = time.time()
+        sent = self._parent.write_coefficients(table,command,[int(a) for a in addresses],[int(v) for v in values],
+                                               ok,full)
+        print "sent",sent,"of",len(values),table,"coefficients in",(time.time()-t)
+        return sent
+
+    def _eqBandpass(self,spectra):
+        """
+        Bandpass (one value per EQ coefficient) of a block of SpectralPower II *spectra*
+        """
+        return np.median(spectra,axis=0)
+
+    def autoEQ(self,target=None,nspec=16,full=False):
+        """
+        Flatten the bandpass for personalities which implement setEQ.
+
+        The bandpass is the median of the last *nspec* realtime spectra. Since the EQ scales voltage, each coefficient
+        is multiplied by sqrt(target/power); *target* defaults to the median power across the band. Channels with no
+        power keep their coefficient. Returns the new EQ.
+        """
+        eq = getattr(self,'eqI',None)
+        if eq is None:
+            raise Exception("current EQ is unknown, use setEQ first")
+        eq = np.asarray(eq,dtype='float64')
+        spectra,timestamps = self._parent.get_recent('SpectralPower','II',nspec)
+        bandpass = self._eqBandpass(np.asarray(spectra,dtype='float64'))
+        if bandpass.shape != eq.shape:
+            raise Exception("bandpass has %d channels but EQ has %d" % (bandpass.shape[0],eq.shape[0]))
+        if target is None:
+            target = np.median(bandpass[bandpass > 0])
+        with np.errstate(divide='ignore',invalid='ignore'):
+            neweq = eq*np.sqrt(target/bandpass)
+        bad = ~np.isfinite(neweq)
+        neweq[bad] = eq[bad]
+        neweq = np.clip(neweq,0,self._eqMax)
+        self.setEQ(neweq,full=full)
+        return neweq
+
+    def _combine64(self,lsb,msb):
+        """
+        Combine the uint32 *lsb* and *msb* halves of 64 bit accumulations into a uint64 array
+        """
+        return lsb.astype('uint64') | (msb.astype('uint64') << 32)
+
+    def _arrayDtype(self,measurement_type,name):
+        """
+        On-disk dtype of array *name* of *measurement_type*.
+
+        Entries of _measTypesDict may contain an optional "dtypes" dictionary mapping array names to numpy dtypes,
+        eg. "dtypes": {"adcI": 'int8'}. Arrays which are not listed are stored as float32.
+        """
+        return np.dtype(self._measTypesDict[measurement_type].get('dtypes',{}).get(name,'float32'))
+
     def _reconstructMeasurement(self,m):    #this function will be called by the parser after the packets have been
                                             #reconstructed in order to convert the raw brams to meaningful data.
         raise("NotImplemented")
@@ -40,6 +40,9 @@ class OnePolRealSpectrometer(IbobPersonality):
                 },
                 "arrays": {
                     "adcI" : (16384,)
+                },
+                "dtypes": {
+                    "adcI" : 'int8'
                 }
             }
         }
@@ -90,9 +93,10 @@ class OnePolRealSpectrometer(IbobPersonality):
         self._t_int = t_int
         acc_len = self._adcClock*1e6*t_int/(1024.0)       #Notice we need to know a property of the iBOB (ADC_clock) to calculate this
         period = acc_len*1024
-        self.regwrite("cfgspec/vacc/acc_len",acc_len-1)
-        self.regwrite("period",period-2)
-        self._write_info({'IntegrationTime': t_int})
+        with self.config():
+            self.regwrite("cfgspec/vacc/acc_len",acc_len-1)
+            self.regwrite("period",period-2)
+            self._write_info({'IntegrationTime': t_int})
         
     def setTvg(self,tvg):
         self.regwrite("tvg",tvg)
@@ -104,11 +108,7 @@ class OnePolRealSpectrometer(IbobPersonality):
         if m.type == 'S':       #check what kind of data we got from the iBOB
             bram0 = m.brams[0,:].view(dtype='uint32').byteswap()        #reinterpret as uint32
             bram1 = m.brams[1,:].view(dtype='uint32').byteswap()
-            dataI = np.empty((bram0.shape[0],),'float')
-
-            msb_lsb_sum = (bram0 + (bram1 *(2.0**32)))
-            
-            dataI[:] = msb_lsb_sum 
+            dataI = self._combine64(bram0,bram1)
             
             #dataI and dataQ now have the properly interpreted data
             
@@ -138,18 +138,7 @@ class OnePolRealSpectrometer(IbobPersonality):
             #no need to return anything, m.tabledict and m.arraydict can be passed on to the dataserver now
             return (name, arraydict, tabledict)
         if m.type == 'A':
-            bram0 = m.brams[0,:].view(dtype='int8').astype('float32')
-            bram1 = m.brams[1,:].view(dtype='int8').astype('float32')
-            adcI = np.zeros((bram0.shape[0]*2,),dtype='float32')
-            
-            adcI[0::8] = bram1[3::4]
-            adcI[1::8] = bram1[2::4]
-            adcI[2::8] = bram1[1::4]
-            adcI[3::8] = bram1[0::4]
-            adcI[4::8] = bram0[3::4]
-            adcI[5::8] = bram0[2::4]
-            adcI[6::8] = bram0[1::4]
-            adcI[7::8] = bram0[0::4]
+            adcI = self._unscrambleAdc(m)
             #adcQ = np.array(m.brams[1,:].view(dtype='int8'),dtype='float')
             
             name = "ADCSnapshot"
@@ -168,6 +157,7 @@ class OnePolRealSpectrometer(IbobPersonality):
 
 
 class OnePolReal512ChannelSpectrometer(OnePolRealSpectrometer):
+    _eqMax = ((1<<20)-1)/8.0
     def __init__(self,parent = None,adcClock=1024.0):
         self._adcClock = adcClock
         
@@ -206,9 +196,10 @@ class OnePolReal512ChannelSpectrometer(OnePolRealSpectrometer):
                 raise("Integration time is too long:",t_int)
             self._t_int = t_int
             period = acc_len*1024
-            self.regwrite("cs/vacc/acc_len",acc_len-1)
-            self.regwrite("period",period-2)
-            self._write_info({'IntegrationTime': t_int})
+            with self.config():
+                self.regwrite("cs/vacc/acc_len",acc_len-1)
+                self.regwrite("period",period-2)
+                self._write_info({'IntegrationTime': t_int})
             
             
     def bumpEQ(self,factor):
@@ -219,19 +210,16 @@ class OnePolReal512ChannelSpectrometer(OnePolRealSpectrometer):
         eqs[mask] = 0
         self.setEQ(eqs)
         
-    def setEQ(self,eqI):
+    def setEQ(self,eqI,full=False):
+        """
+        Set the EQ coefficients. Only coefficients which changed since the last upload are sent unless *full* is True
+        """
         self.eqI = eqI
-        eqI = (eqI*8).round().astype('int')
-        
-        t = time.time()
-        tries = 0
-        for k in range(eqI.shape[0]):
-            data = 0x80000000
-            data += eqI[k]
-            data += (k<<20)
-            tries += self.sendcoeff(data)
+        eqI = (np.asarray(eqI)*8).round().astype('int64')
+        k = np.arange(eqI.shape[0])
+        values = 0x80000000 + eqI + (k<<20)
+        self._uploadCoefficients('eq','regwrite cs/coeff 0x%(value)x',k,values,ok='\r',full=full)
         self.regwrite('cs/coeff',0)
-        print "done in",(time.time()-t), "tries",tries
         
     def sendcoeff(self,data):
         self._write_register('cs/coeff', data)
@@ -244,11 +232,7 @@ class OnePolReal512ChannelSpectrometer(OnePolRealSpectrometer):
         if m.type == 'S':       #check what kind of data we got from the iBOB
             bram0 = m.brams[0,:].view(dtype='uint32').byteswap()[:512]        #reinterpret as uint32
             bram1 = m.brams[1,:].view(dtype='uint32').byteswap()[:512]
-            dataI = np.empty((bram0.shape[0],),'float')
-
-            msb_lsb_sum = (bram0 + (bram1 *(2.0**32)))
-            
-            dataI[:] = msb_lsb_sum 
+            dataI = self._combine64(bram0,bram1)
                         
             
             name = "SpectralPower"    #The name could be used to refer to the appropriate part of the h5 file hierarchy to store the data in
@@ -265,7 +249,7 @@ class OnePolReal512ChannelSpectrometer(OnePolRealSpectrometer):
             return (name, arraydict, tabledict)
         if m.type == 'B':
             data = m.brams[0,:].view(dtype='uint8')[:512]
-            dataI = data.astype('float')
+            dataI = data
             name = "SpectralPower"
             arraydict = {"II": dataI}
             tabledict = {"Timestamp":m.timestamp,
@@ -275,18 +259,7 @@ class OnePolReal512ChannelSpectrometer(OnePolRealSpectrometer):
             return (name, arraydict, tabledict)
         
         if m.type == 'A':
-            bram0 = m.brams[0,:].view(dtype='int8').astype('float32')
-            bram1 = m.brams[1,:].view(dtype='int8').astype('float32')
-            adcI = np.zeros((bram0.shape[0]*2,),dtype='float32')
-            
-            adcI[0::8] = bram1[3::4]
-            adcI[1::8] = bram1[2::4]
-            adcI[2::8] = bram1[1::4]
-            adcI[3::8] = bram1[0::4]
-            adcI[4::8] = bram0[3::4]
-            adcI[5::8] = bram0[2::4]
-            adcI[6::8] = bram0[1::4]
-            adcI[7::8] = bram0[0::4]
+            adcI = self._unscrambleAdc(m)
             
             name = "ADCSnapshot"
             arraydict = {"adcI": adcI}        #This is a dictionary of the data to be put in the measurement arrays. The keys provide the names of the arrays
@@ -300,6 +273,8 @@ class OnePolReal512ChannelSpectrometer(OnePolRealSpectrometer):
         return (name, arraydict, tabledict)
 
 class OnePolRealKurtosisSpectrometer(IbobPersonality):
+    _accLenRegister = 'cs/vacc/acc_len'     # written by setIntegrationTime, read back for the SK estimator
+
     def __init__(self,parent = None,adcClock=1024.0):
         self._adcClock = adcClock
         
@@ -325,6 +300,10 @@ class OnePolRealKurtosisSpectrometer(IbobPersonality):
                 "arrays": {
                     "II" : (1024,),
                     "SK" : (1024,),
+                    "SKFlag" : (128,),      # SK RFI flags packed 8 channels per byte, see dss28core.spectralkurtosis
+                },
+                "dtypes": {
+                    "SKFlag" : 'uint8'
                 },
             },
             
@@ -341,6 +320,9 @@ class OnePolRealKurtosisSpectrometer(IbobPersonality):
                 },
                 "arrays": {
                     "adcI" : (16384,)
+                },
+                "dtypes": {
+                    "adcI" : 'int8'
                 }
             }
         }
@@ -383,12 +365,12 @@ class OnePolRealKurtosisSpectrometer(IbobPersonality):
         self.startUdp()
         self.sync()
     
-    def sync(self):
-        while np.abs(np.fmod(time.time(),1)-0.25)> 0.1:
-            pass
-        stt = int(np.ceil(time.time()))
-        self._sendget('pps x%x' % stt)
-        print "armed at:",stt
+    def sync(self,second=None):
+        """
+        Arm the PPS synchronization, sending the command at 0.25 s into the next second (or into UNIX second
+        *second*, to arm several iBOBs on the same edge). Returns the armed second
+        """
+        return self._syncAtPhase(0.25,second)
                     
 
     def setIntegrationTime(self,t_int):
@@ -402,13 +384,26 @@ class OnePolRealKurtosisSpectrometer(IbobPersonality):
         self._t_int = t_int
         acc_len = self._adcClock*1e6*t_int/(1024.0)       #Notice we need to know a property of the iBOB (ADC_clock) to calculate this
         period = acc_len*1024
-        self.regwrite("cs/vacc/acc_len",acc_len-1)
-        self.regwrite("period",period-2)
-        self._write_info({'IntegrationTime': t_int})
+        with self.config():
+            self.regwrite("cs/vacc/acc_len",acc_len-1)
+            self.regwrite("period",period-2)
+            self._write_info({'IntegrationTime': t_int})
         
     def setTvg(self,tvg):
         self.regwrite("tvg",tvg)
         
+    def _accLength(self,registers=None):
+        """
+        Number of spectra accumulated per integration (M in the SK estimator), from the value of the acc_len
+        register in *registers* (default: _controlRegisters). Returns None if the register value is not known
+        """
+        if registers is None:
+            registers = self._controlRegisters
+        value = registers.get(self._accLenRegister)
+        if value is None:
+            return None
+        return value + 1
+        
     def _bbfrq(self):
         return np.arange(1024)*self._adcClock/1024.0
 
@@ -416,16 +411,12 @@ class OnePolRealKurtosisSpectrometer(IbobPersonality):
         if m.type == 'S':       #check what kind of data we got from the iBOB
             bram0 = m.brams[0,:].view(dtype='uint32').byteswap()        #reinterpret as uint32
             bram1 = m.brams[1,:].view(dtype='uint32').byteswap()
-            dataI = np.empty((bram0.shape[0],),'float')
-
-            msb_lsb_sum = (bram0 + (bram1 *(2.0**32)))
-            
-            dataI[:] = msb_lsb_sum 
+            dataI = self._combine64(bram0,bram1)
             
-            bram2 = m.brams[2,:].view(dtype='uint32').byteswap().astype('float')        #reinterpret as uint32
-            bram3 = m.brams[3,:].view(dtype='uint32').byteswap().astype('float')
+            bram2 = m.brams[2,:].view(dtype='uint32').byteswap()        #reinterpret as uint32
+            bram3 = m.brams[3,:].view(dtype='uint32').byteswap()
             
-            skdata = (bram2 + (bram3 *(2.0**32)))
+            skdata = self._combine64(bram2,bram3)
             
             #dataI and dataQ now have the properly interpreted data
             
@@ -458,7 +449,7 @@ class OnePolRealKurtosisSpectrometer(IbobPersonality):
             return (name, arraydict, tabledict)
         if m.type == 'B':
             data = m.brams[0,:].view(dtype='uint8')
-            dataI = data.astype('float')
+            dataI = data
 #            scale = 1<<(self._mode & 0x07)
 #            dataI *= scale
             name = "SpectralPower"
@@ -471,18 +462,7 @@ class OnePolRealKurtosisSpectrometer(IbobPersonality):
             return (name, arraydict, tabledict)
         
         if m.type == 'A':
-            bram0 = m.brams[0,:].view(dtype='int8').astype('float32')
-            bram1 = m.brams[1,:].view(dtype='int8').astype('float32')
-            adcI = np.zeros((bram0.shape[0]*2,),dtype='float32')
-            
-            adcI[0::8] = bram1[3::4]
-            adcI[1::8] = bram1[2::4]
-            adcI[2::8] = bram1[1::4]
-            adcI[3::8] = bram1[0::4]
-            adcI[4::8] = bram0[3::4]
-            adcI[5::8] = bram0[2::4]
-            adcI[6::8] = bram0[1::4]
-            adcI[7::8] = bram0[0::4]
+            adcI = self._unscrambleAdc(m)
             #adcQ = np.array(m.brams[1,:].view(dtype='int8'),dtype='float')
             
             name = "ADCSnapshot"
@@ -510,6 +490,7 @@ class OnePolReal512ChannelKurtosisSpectrometer(OnePolRealKurtosisSpectrometer):
         self._measTypesDict["SpectralPower"]["arrays"] = {
                     "II" : (512,),
                     "SK" : (512,),
+                    "SKFlag" : (64,),
                 }
 
     def restart(self):
@@ -532,9 +513,10 @@ class OnePolReal512ChannelKurtosisSpectrometer(OnePolRealKurtosisSpectrometer):
                 raise("Integration time is too long:",t_int)
             self._t_int = t_int
             period = acc_len*1024
-            self.regwrite("cs/vacc/acc_len",acc_len-1)
-            self.regwrite("period",period-2)
-            self._write_info({'IntegrationTime': t_int})
+            with self.config():
+                self.regwrite("cs/vacc/acc_len",acc_len-1)
+                self.regwrite("period",period-2)
+                self._write_info({'IntegrationTime': t_int})
             
     def _bbfrq(self):
         return np.arange(512)*self._adcClock/512.0
@@ -543,16 +525,12 @@ class OnePolReal512ChannelKurtosisSpectrometer(OnePolRealKurtosisSpectrometer):
         if m.type == 'S':       #check what kind of data we got from the iBOB
             bram0 = m.brams[0,:].view(dtype='uint32').byteswap()[:512]        #reinterpret as uint32
             bram1 = m.brams[1,:].view(dtype='uint32').byteswap()[:512]
-            dataI = np.empty((bram0.shape[0],),'float')
-
-            msb_lsb_sum = (bram0 + (bram1 *(2.0**32)))
-            
-            dataI[:] = msb_lsb_sum 
+            dataI = self._combine64(bram0,bram1)
             
-            bram2 = m.brams[2,:].view(dtype='uint32').byteswap().astype('float')        #reinterpret as uint32
-            bram3 = m.brams[3,:].view(dtype='uint32').byteswap().astype('float')
+            bram2 = m.brams[2,:].view(dtype='uint32').byteswap()        #reinterpret as uint32
+            bram3 = m.brams[3,:].view(dtype='uint32').byteswap()
             
-            skdata = (bram2 + (bram3 *(2.0**32)))
+            skdata = self._combine64(bram2,bram3)
             
             #dataI and dataQ now have the properly interpreted data
             
@@ -584,7 +562,7 @@ class OnePolReal512ChannelKurtosisSpectrometer(OnePolRealKurtosisSpectrometer):
             return (name, arraydict, tabledict)
         if m.type == 'B':
             data = m.brams[0,:].view(dtype='uint8')[:512]
-            dataI = data.astype('float')
+            dataI = data
 #            scale = 1<<(self._mode & 0x07)
 #            dataI *= scale
             name = "SpectralPower"
@@ -596,18 +574,7 @@ class OnePolReal512ChannelKurtosisSpectrometer(OnePolRealKurtosisSpectrometer):
             return (name, arraydict, tabledict)
         
         if m.type == 'A':
-            bram0 = m.brams[0,:].view(dtype='int8').astype('float32')
-            bram1 = m.brams[1,:].view(dtype='int8').astype('float32')
-            adcI = np.zeros((bram0.shape[0]*2,),dtype='float32')
-            
-            adcI[0::8] = bram1[3::4]
-            adcI[1::8] = bram1[2::4]
-            adcI[2::8] = bram1[1::4]
-            adcI[3::8] = bram1[0::4]
-            adcI[4::8] = bram0[3::4]
-            adcI[5::8] = bram0[2::4]
-            adcI[6::8] = bram0[1::4]
-            adcI[7::8] = bram0[0::4]
+            adcI = self._unscrambleAdc(m)
             #adcQ = np.array(m.brams[1,:].view(dtype='int8'),dtype='float')
             
             name = "ADCSnapshot"
@@ -27,6 +27,9 @@ class Cospec(IbobPersonality):
                 },
                 "arrays": {
                     "adcI" : (16384,)
+                },
+                "dtypes": {
+                    "adcI" : 'int8'
                 }
             }
         }
@@ -102,18 +105,7 @@ class Cospec(IbobPersonality):
 
     def _reconstructMeasurement(self,m):
         if m.type == 'A':
-            bram0 = m.brams[0,:].view(dtype='int8').astype('float32')
-            bram1 = m.brams[1,:].view(dtype='int8').astype('float32')
-            adcI = np.zeros((bram0.shape[0]*2,),dtype='float32')
-            
-            adcI[0::8] = bram1[3::4]
-            adcI[1::8] = bram1[2::4]
-            adcI[2::8] = bram1[1::4]
-            adcI[3::8] = bram1[0::4]
-            adcI[4::8] = bram0[3::4]
-            adcI[5::8] = bram0[2::4]
-            adcI[6::8] = bram0[1::4]
-            adcI[7::8] = bram0[0::4]
+            adcI = self._unscrambleAdc(m)
             #adcQ = np.array(m.brams[1,:].view(dtype='int8'),dtype='float')
             
             name = "ADCSnapshot"
@@ -34,6 +34,10 @@ class TwoPolDDCSpectrometer(IbobPersonality):
                     "II" : (8192,),
                     "QQ" : (8192,)
                 },
+                "dtypes": {
+                    "II" : 'uint32',
+                    "QQ" : 'uint32'
+                },
             },
 
             "ADCSnapshot" : {
@@ -49,6 +53,10 @@ class TwoPolDDCSpectrometer(IbobPersonality):
                 "arrays": {
                     "adcI" : (8192,),
                     "adcQ" : (8192,)
+                },
+                "dtypes": {
+                    "adcI" : 'int8',
+                    "adcQ" : 'int8'
                 }
             }
         }
@@ -91,21 +99,20 @@ class TwoPolDDCSpectrometer(IbobPersonality):
             raise Exception("Requested integration length results in acc_len setting %d > 65535. Reduce requested integration time." % (acc_len-1,))
         t_int_actual = acc_len*8192/((self._adcClock/4)*1e6)
         self._t_int = t_int_actual
-        self.regwrite("cfgspec/vacc/acc_len",acc_len-1)
-        self.regwrite("period",period-2)
-        self._write_info({'PeriodRegister': (period-2),
-                                 'AccLenRegister': (acc_len-1),
-                                 'IntegrationTime': t_int_actual})
+        with self.config():
+            self.regwrite("cfgspec/vacc/acc_len",acc_len-1)
+            self.regwrite("period",period-2)
+            self._write_info({'PeriodRegister': (period-2),
+                                     'AccLenRegister': (acc_len-1),
+                                     'IntegrationTime': t_int_actual})
         self.sync()
 
-    def sync(self):
-        while np.abs(np.fmod(time.time(),1)-0.25)> 0.1:
-            pass
-        while np.abs(np.fmod(time.time(),1)-0.25)< 0.1:
-            pass
-        stt = int(np.ceil(time.time()))
-        self._sendget('pps x%x' % stt)
-        print "armed at:",stt
+    def sync(self,second=None):
+        """
+        Arm the PPS synchronization, sending the command at 0.35 s into the next second (or into UNIX second
+        *second*, to arm several iBOBs on the same edge). Returns the armed second
+        """
+        return self._syncAtPhase(0.35,second)
         
     def setTvg(self,tvg):
         self.regwrite("tvg",tvg)
@@ -121,8 +128,8 @@ class TwoPolDDCSpectrometer(IbobPersonality):
             bram0 = m.brams[0,:].view(dtype='uint32').byteswap()        #reinterpret as uint32
             bram1 = m.brams[1,:].view(dtype='uint32').byteswap()
             # two inputs, each with 512 channels:
-            dataI = np.fft.fftshift(bram1.astype('float32'))
-            dataQ = np.fft.fftshift(bram0.astype('float32'))
+            dataI = np.fft.fftshift(bram1)
+            dataQ = np.fft.fftshift(bram0)
             
             name = "SpectralPower"    #The name could be used to refer to the appropriate part of the h5 file hierarchy to store the data in
             arraydict = {"II": dataI,
@@ -139,8 +146,8 @@ class TwoPolDDCSpectrometer(IbobPersonality):
                            
             return (name, arraydict, tabledict)
         if m.type == 'A':
-            adcI = np.array(m.brams[1,:].view(dtype='int8'),dtype='float')
-            adcQ = np.array(m.brams[0,:].view(dtype='int8'),dtype='float')
+            adcI = m.brams[1,:].view(dtype='int8')
+            adcQ = m.brams[0,:].view(dtype='int8')
             
             name = "ADCSnapshot"
             arraydict = {"adcI": adcI,
@@ -47,6 +47,10 @@ class TwoPolRealSpectrometer(IbobPersonality):
                 "arrays": {
                     "adcI" : (8192,),
                     "adcQ" : (8192,)
+                },
+                "dtypes": {
+                    "adcI" : 'int8',
+                    "adcQ" : 'int8'
                 }
             }
         }
@@ -80,11 +84,12 @@ class TwoPolRealSpectrometer(IbobPersonality):
         self._t_int = t_int
         acc_len = self._adcClock*1e6*t_int/(1024.0)       #Notice we need to know a property of the iBOB (ADC_clock) to calculate this
         period = acc_len*1024
-        self.regwrite("cfgspec/vacc/acc_len",acc_len-1)
-        self.regwrite("period",period-3)
-        self._write_info({'PeriodRegister': (period-3),
-                                 'AccLenRegister': (acc_len-1),
-                                 'IntegrationTime': t_int})
+        with self.config():
+            self.regwrite("cfgspec/vacc/acc_len",acc_len-1)
+            self.regwrite("period",period-3)
+            self._write_info({'PeriodRegister': (period-3),
+                                     'AccLenRegister': (acc_len-1),
+                                     'IntegrationTime': t_int})
         
     def setTvg(self,tvg):
         self.regwrite("tvg",tvg)
@@ -97,23 +102,12 @@ class TwoPolRealSpectrometer(IbobPersonality):
             bram0 = m.brams[0,:].view(dtype='uint32').byteswap()        #reinterpret as uint32
             bram1 = m.brams[1,:].view(dtype='uint32').byteswap()
             # two inputs, each with 512 channels:
-            dataI = np.empty((bram0.shape[0]/2,),'float')
-            dataQ = np.empty((bram0.shape[0]/2,),'float')
-            lsb_I_even = np.array(bram0[0::4],dtype='float')
-            lsb_I_odd = np.array(bram0[1::4],dtype='float')
-            lsb_Q_even = np.array(bram0[2::4],dtype='float')
-            lsb_Q_odd = np.array(bram0[3::4],dtype='float')
-            msb_I_even = np.array(bram1[0::4],dtype='float')
-            msb_I_odd = np.array(bram1[1::4],dtype='float')
-            msb_Q_even = np.array(bram1[2::4],dtype='float')
-            msb_Q_odd = np.array(bram1[3::4],dtype='float')
-            # if you take out this ".0" on the 2.0**32, it will break!
-            msb_lsb_sum = (lsb_I_even + (msb_I_even *(2.0**32)))
-            
-            dataI[::2] = msb_lsb_sum 
-            dataI[1::2] = lsb_I_odd + (msb_I_odd  *(2.0**32))
-            dataQ[::2] = lsb_Q_even + (msb_Q_even *(2.0**32))
-            dataQ[1::2] = lsb_Q_odd + (msb_Q_odd  *(2.0**32))
+            dataI = np.empty((bram0.shape[0]/2,),'uint64')
+            dataQ = np.empty((bram0.shape[0]/2,),'uint64')
+            dataI[::2] = self._combine64(bram0[0::4],bram1[0::4])
+            dataI[1::2] = self._combine64(bram0[1::4],bram1[1::4])
+            dataQ[::2] = self._combine64(bram0[2::4],bram1[2::4])
+            dataQ[1::2] = self._combine64(bram0[3::4],bram1[3::4])
             
             #dataI and dataQ now have the properly interpreted data
             
@@ -132,8 +126,8 @@ class TwoPolRealSpectrometer(IbobPersonality):
             #no need to return anything, m.tabledict and m.arraydict can be passed on to the dataserver now
             return (name, arraydict, tabledict)
         if m.type == 'A':
-            adcI = np.array(m.brams[0,:].view(dtype='int8'),dtype='float')
-            adcQ = np.array(m.brams[1,:].view(dtype='int8'),dtype='float')
+            adcI = m.brams[0,:].view(dtype='int8')
+            adcQ = m.brams[1,:].view(dtype='int8')
             
             name = "ADCSnapshot"
             arraydict = {"adcI": adcI,
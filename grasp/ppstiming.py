@@ -0,0 +1,147 @@
+"""
+:mod:`ppstiming`
+----------------
+
+Sleeping until a given sub-second phase of the system clock, for arming iBOBs on the next PPS edge.
+
+Several personalities must send their *pps* arming command well clear of the second boundary. Rather than spinning
+on time.time(), :func:`sleepUntil` sleeps until an absolute time with clock_nanosleep(CLOCK_REALTIME, TIMER_ABSTIME)
+(through ctypes, falling back to time.sleep where it is not available), so no CPU is used while waiting and the
+wakeup is typically within ~100 us of the target.
+
+:func:`armTogether` arms several iBOBs for the same PPS edge from concurrent threads, and every arming is recorded
+in :data:`jitter` (wakeup time minus target time) so the achieved timing can be checked::
+
+    import ppstiming
+    ppstiming.armTogether([p._armPPS for p in spectrometers], phase=0.25)
+    print ppstiming.jitter.stats()
+"""
+from __future__ import with_statement
+import collections
+import ctypes
+import ctypes.util
+import errno
+import math
+import threading
+import time
+
+CLOCK_REALTIME = 0
+TIMER_ABSTIME = 1
+
+class _timespec(ctypes.Structure):
+    _fields_ = [('tv_sec',ctypes.c_long),('tv_nsec',ctypes.c_long)]
+
+def _loadClockNanosleep():
+    for name in ['rt','c']:
+        try:
+            lib = ctypes.CDLL(ctypes.util.find_library(name))
+            func = lib.clock_nanosleep
+        except Exception:
+            continue
+        func.argtypes = [ctypes.c_int,ctypes.c_int,ctypes.POINTER(_timespec),ctypes.POINTER(_timespec)]
+        func.restype = ctypes.c_int
+        return func
+    return None
+
+_clock_nanosleep = _loadClockNanosleep()
+
+def sleepUntil(t):
+    """
+    Sleep until the absolute UNIX time *t*. Returns the time at wakeup
+    """
+    if _clock_nanosleep is not None:
+        sec = int(t)
+        nsec = min(int(round((t - sec)*1e9)),999999999)
+        ts = _timespec(sec,nsec)
+        while True:
+            err = _clock_nanosleep(CLOCK_REALTIME,TIMER_ABSTIME,ctypes.byref(ts),None)
+            if err != errno.EINTR:
+                break
+        if err == 0:
+            return time.time()
+    while True:
+        dt = t - time.time()
+        if dt <= 0:
+            break
+        time.sleep(dt)
+    return time.time()
+
+def nextPhase(phase,guard=0.05,now=None):
+    """
+    Return the next UNIX time, at least *guard* seconds from *now*, whose fractional second is *phase*
+    """
+    if now is None:
+        now = time.time()
+    t = math.floor(now) + phase
+    while t < now + guard:
+        t += 1
+    return t
+
+class JitterLog(object):
+    """
+    Record of the most recent *size* timed wakeups
+    """
+    def __init__(self,size=1000):
+        self._lock = threading.Lock()
+        self.records = collections.deque(maxlen=size)
+
+    def add(self,label,target,actual):
+        with self._lock:
+            self.records.append((label,target,actual))
+
+    def recent(self,n=10):
+        """
+        Return the last *n* records as (label, target time, wakeup time)
+        """
+        with self._lock:
+            return list(self.records)[-n:]
+
+    def stats(self,label=None):
+        """
+        Return dictionary with count, mean, rms and max of the wakeup errors (s), optionally only for *label*
+        """
+        with self._lock:
+            err = [actual - target for (l,target,actual) in self.records if label is None or l == label]
+        if not err:
+            return dict(count=0,mean=0.0,rms=0.0,max=0.0)
+        n = float(len(err))
+        return dict(count=len(err),mean=sum(err)/n,rms=math.sqrt(sum([e*e for e in err])/n),max=max(err))
+
+jitter = JitterLog()
+
+def armAtPhase(arm,phase=0.25,target=None,label=''):
+    """
+    Sleep until *phase* of a second (or until *target*, if given) and call arm(second), where second is the UNIX
+    second of the next PPS edge. Returns that second.
+    """
+    if target is None:
+        target = nextPhase(phase)
+    actual = sleepUntil(target)
+    jitter.add(label,target,actual)
+    second = int(math.ceil(actual))
+    arm(second)
+    return second
+
+def armTogether(arms,phase=0.25,guard=0.2,labels=None):
+    """
+    Call each of the *arms* callables (see :func:`armAtPhase`) from its own thread at the same target time, so all
+    are armed for the same PPS edge. Returns the list of armed seconds.
+    """
+    target = nextPhase(phase,guard=guard)
+    if labels is None:
+        labels = [str(k) for k in range(len(arms))]
+    seconds = [None]*len(arms)
+    errors = []
+    def run(k):
+        try:
+            seconds[k] = armAtPhase(arms[k],target=target,label=labels[k])
+        except Exception, e:
+            errors.append((labels[k],e))
+    threads = [threading.Thread(target=run,args=(k,)) for k in range(len(arms))]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    if errors:
+        raise Exception("arming failed: %s" % ', '.join(['%s: %s' % err for err in errors]))
+    return seconds
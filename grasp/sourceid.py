@@ -0,0 +1,215 @@
+"""
+:mod:`sourceid`
+---------------
+
+Identification of the source being observed at many times at once, the batch counterpart of
+:meth:`gavrtdb.GavrtDB.getSourceAt`.
+
+:meth:`~gavrtdb.GavrtDB.getSourceAt` costs three to six queries per time, one of them a scan of the whole source
+catalog. Here the antenna_cmd and scans rows covering all the requested times are loaded with a few range queries,
+the antenna_temp rows only for the few seconds before each time (see :func:`loadPositions`), antenna positions are
+converted to RA/Dec in one vectorized call, and nearest sources are looked up in an index of the catalog which is
+kept in the GavrtDB table cache (see :class:`gavrtdb.TableCache`).
+
+Example::
+
+    import gavrtdb
+    gdb = gavrtdb.GavrtDB()
+    src = gdb.getSourcesAt(scans['StartTime'])
+    src['name'][src['method'] == 'position']
+"""
+
+import numpy as np
+
+try:
+    from scipy.spatial import cKDTree
+except ImportError:
+    cKDTree = None
+
+POSITION_VALID = 10.0           # seconds an antenna position record is valid for (as in getSourceAt)
+NEAREST_CHUNK = 1024            # positions per block in the plain NumPy nearest source search
+POSITION_CHUNK = 500            # time windows per antenna_temp query
+
+class SourceCatalog(object):
+    """
+    Index of the gavrt_sources.source catalog for nearest source lookups
+
+    *sources* is a dictionary with source_id, name, RA and Dec arrays. The distance between positions is
+    abs(dRA) + abs(dDec), as in the catalog query of :meth:`~gavrtdb.GavrtDB.getSourceAt`, so the same source is
+    found. A KD-tree is used if scipy is available.
+    """
+    def __init__(self,sources):
+        if not sources:
+            sources = dict(source_id=[],name=[],RA=[],Dec=[])
+        order = np.argsort(np.asarray(sources['source_id'],dtype='int64'),kind='mergesort')
+        self.ids = np.asarray(sources['source_id'],dtype='int64')[order]
+        self.names = np.asarray(sources['name'],dtype=object)[order]
+        self.ra = np.asarray(sources['RA'],dtype='float64')[order]
+        self.dec = np.asarray(sources['Dec'],dtype='float64')[order]
+        self._points = np.column_stack((self.ra,self.dec))
+        if cKDTree is not None and len(self.ids):
+            self._tree = cKDTree(self._points)
+        else:
+            self._tree = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    def nearest(self,ra,dec):
+        """
+        Index of the catalog source nearest to each position, -1 if the catalog is empty
+        """
+        pos = np.column_stack((np.ravel(ra),np.ravel(dec))).astype('float64')
+        if len(self.ids) == 0:
+            return -np.ones((len(pos),),dtype='int64')
+        if self._tree is not None:
+            dist,idx = self._tree.query(pos,p=1)
+            return np.asarray(idx,dtype='int64')
+        idx = np.empty((len(pos),),dtype='int64')
+        for start in range(0,len(pos),NEAREST_CHUNK):
+            block = pos[start:start+NEAREST_CHUNK]
+            dist = (np.abs(block[:,0,None] - self.ra[None,:]) + np.abs(block[:,1,None] - self.dec[None,:]))
+            idx[start:start+NEAREST_CHUNK] = dist.argmin(axis=1)
+        return idx
+
+    def lookup(self,ids):
+        """
+        Index of each of the source *ids* in the catalog, -1 for ids which are not in it
+        """
+        ids = np.asarray(ids,dtype='int64')
+        if len(self.ids) == 0:
+            return -np.ones(ids.shape,dtype='int64')
+        idx = np.minimum(np.searchsorted(self.ids,ids),len(self.ids)-1)
+        return np.where(self.ids[idx] == ids,idx,-1)
+
+def getCatalog(gdb):
+    """
+    The :class:`SourceCatalog`, loaded through *gdb* and cached until gavrt_sources.source changes
+    """
+    return gdb.cached('gavrt_sources.source','catalog',
+                      lambda: SourceCatalog(gdb.get("SELECT source_id,name,RA,`Dec` FROM gavrt_sources.source;")))
+
+def positionWindows(t):
+    """
+    The windows POSITION_VALID seconds long before each of the times *t*, with overlapping windows merged. Returns
+    arrays of window start and end times
+    """
+    ts = np.unique(np.asarray(t,dtype='float64'))
+    if len(ts) == 0:
+        return ts,ts
+    starts = ts - POSITION_VALID
+    breaks = np.flatnonzero(starts[1:] > ts[:-1]) + 1
+    return starts[np.concatenate(([0],breaks))],ts[np.concatenate((breaks-1,[len(ts)-1]))]
+
+def loadPositions(gdb,t):
+    """
+    Load the antenna_temp rows recorded in the POSITION_VALID seconds before each of the times *t*, with one query
+    per POSITION_CHUNK windows (see :func:`positionWindows`) rather than every position between the first and last
+    time. Returns a dictionary of UnixTime, AZ and EL arrays sorted by time
+    """
+    lo,hi = positionWindows(t)
+    parts = []
+    for start in range(0,len(lo),POSITION_CHUNK):
+        windows = zip(lo[start:start+POSITION_CHUNK],hi[start:start+POSITION_CHUNK])
+        cond = ' OR '.join(['(UnixTime >= %s AND UnixTime < %s)']*len(windows))
+        args = tuple([float(x) for window in windows for x in window])
+        rows = gdb.get("SELECT UnixTime,AZ,EL FROM antenna_temp WHERE %s;" % cond,args)
+        if rows:
+            parts.append(rows)
+    out = {}
+    for col in ['UnixTime','AZ','EL']:
+        out[col] = np.concatenate([np.asarray(rows[col],dtype='float64') for rows in parts] + [np.empty((0,))])
+    order = np.argsort(out['UnixTime'],kind='mergesort')
+    for col in out.keys():
+        out[col] = out[col][order]
+    return out
+
+def identifySources(gdb,t):
+    """
+    Determine the source observed at each of the UnixTimes *t*, following the same rules as
+    :meth:`~gavrtdb.GavrtDB.getSourceAt`: the commanded source if there is one, otherwise the catalog source
+    nearest to the antenna position or the source of the current scan.
+
+    Returns a dictionary of arrays with one entry per time:
+
+    * *name*, *RA*, *Dec*, *id* - the source, as returned by getSourceAt (None, NaN, NaN, -1 where the source could
+      not be determined; getSourceAt raises an exception in that case)
+    * *method* - 'commanded', 'position' or 'scan' according to how the source was found, None if it was not
+    """
+    import dss28astro
+    t = np.atleast_1d(np.asarray(t,dtype='float64'))
+    n = len(t)
+    out = dict(name=np.empty((n,),dtype=object),RA=np.empty((n,)),Dec=np.empty((n,)),id=-np.ones((n,),dtype='int64'),
+               method=np.empty((n,),dtype=object))
+    out['RA'][:] = np.nan
+    out['Dec'][:] = np.nan
+    if n == 0:
+        return out
+    t0 = t.min()
+    t1 = t.max()
+
+    # First look in commanded source table
+    cmd = gdb.getConfigHistory('antenna_cmd',t0,t1,columns='ID,UnixTime,Name,RA,`Dec`,SourceID')
+    idx = cmd.index(t)
+    commanded = idx >= 0
+    if commanded.any():
+        out['name'][commanded] = cmd.rows['Name'][idx[commanded]]
+        out['RA'][commanded] = cmd.rows['RA'][idx[commanded]]
+        out['Dec'][commanded] = cmd.rows['Dec'][idx[commanded]]
+        out['id'][commanded] = cmd.rows['SourceID'][idx[commanded]]
+        out['method'][commanded] = 'commanded'
+    rest = np.flatnonzero(~commanded)
+    if len(rest) == 0:
+        return out
+    t = t[rest]
+    t0 = t.min()
+    t1 = t.max()
+    catalog = getCatalog(gdb)
+
+    # The source used for the most recent scan, which also decides how old an antenna position may be used
+    scans = gdb.getConfigHistory('scans',t0,t1,timecol='StartTime',columns='ID,StartTime,SourceID')
+    idx = scans.index(t)
+
+    # Failing a commanded source, use the antenna position: the last one before each time, if recent enough to be valid. Where
+    # there is no scan getSourceAt uses the last position however old, so those few are looked up one by one
+    antpos = loadPositions(gdb,t)
+    posTime = np.empty((len(t),))
+    posTime[:] = np.nan
+    az = posTime.copy()
+    el = posTime.copy()
+    last = np.searchsorted(antpos['UnixTime'],t,side='left') - 1
+    found = last >= 0
+    posTime[found] = antpos['UnixTime'][last[found]]
+    az[found] = antpos['AZ'][last[found]]
+    el[found] = antpos['EL'][last[found]]
+    with np.errstate(invalid='ignore'):
+        posValid = (t - posTime) < POSITION_VALID
+    for k in np.flatnonzero(~posValid & (idx < 0)):
+        row = gdb.get("SELECT UnixTime,AZ,EL FROM antenna_temp WHERE UnixTime < %s ORDER BY UnixTime DESC LIMIT 1;",
+                      (float(t[k]),))
+        if row:
+            posTime[k],az[k],el[k] = row['UnixTime'][0],row['AZ'][0],row['EL'][0]
+
+    # Each position record is converted only once however many times use it
+    havepos = ~np.isnan(posTime)
+    nearest = -np.ones((len(t),),dtype='int64')
+    if havepos.any():
+        ut,first,inverse = np.unique(posTime[havepos],return_index=True,return_inverse=True)
+        mjd = dss28astro.MJD(ut)
+        ra,dec = dss28astro.azel_to_radec(az[havepos][first],el[havepos][first],mjd)
+        nearest[havepos] = catalog.nearest(ra,dec)[inverse]
+    scanSource = np.zeros((len(t),),dtype='int64')
+    scanSource[idx >= 0] = scans.rows['SourceID'][idx[idx >= 0]]
+    scanIdx = catalog.lookup(scanSource)
+
+    # nearest source if the position is current or there is no scan; otherwise the scan's source, if it has one
+    usePosition = (nearest >= 0) & ((idx < 0) | posValid)
+    useScan = ~usePosition & (scanSource != 0) & (scanIdx >= 0)
+    for mask,found,method in [(usePosition,nearest,'position'),(useScan,scanIdx,'scan')]:
+        sel = rest[mask]
+        out['name'][sel] = catalog.names[found[mask]]
+        out['RA'][sel] = catalog.ra[found[mask]]
+        out['Dec'][sel] = catalog.dec[found[mask]]
+        out['id'][sel] = catalog.ids[found[mask]]
+        out['method'][sel] = method
+    return out
@@ -0,0 +1,451 @@
+"""
+:mod:`sqlitedb`
+---------------
+
+SQLite stand-in for the GAVRT MySQL database, for profiling and load testing the database code away from the site.
+
+The connections made here behave like MySQLdb connections as far as :mod:`gavrtdb` and :mod:`dbextensions` use
+them: MySQL style queries (``%s`` parameters, backquoted names, ``INSERT IGNORE``, ``ON DUPLICATE KEY UPDATE``) are
+translated, cursor descriptions carry MySQL field type codes, and the gavrt_sources and information_schema
+databases are attached so queries on gavrt_sources.source and INFORMATION_SCHEMA.COLUMNS work unchanged.
+
+The schema covers the tables the code reads and writes, with the columns it uses. :func:`generate` fills them with
+synthetic data and :mod:`dbbench` times the common query patterns against it.
+
+Example::
+
+    import gavrtdb, sqlitedb
+    backend = sqlitedb.SQLiteBackend('/tmp/gavrt.sqlite')
+    sqlitedb.generate(backend.connect(),days=1)
+    gavrtdb.setBackend(backend)
+    gdb = gavrtdb.GavrtDB()
+    gdb.getScanStatus()
+
+or set GAVRTDB_SQLITE=/tmp/gavrt.sqlite in the environment to use it from the start.
+"""
+import os
+import re
+import sqlite3
+import time
+
+import numpy as np
+
+# MySQL field type codes given in cursor descriptions
+FIELD_TYPE_DOUBLE = 5
+FIELD_TYPE_LONGLONG = 8
+FIELD_TYPE_VAR_STRING = 253
+
+PEEK_ROWS = 1000        # rows read ahead after a query to determine the type of each result column
+
+_attached = ['gavrt_sources','information_schema']
+
+def _columns(names,decl):
+    return ',\n        '.join(['`%s` %s' % (name,decl) for name in names])
+
+_rssColumns = (['StartTime REAL','ReadyTime REAL'] + ['`Fiber%d` INTEGER' % k for k in range(8)] +
+               ['`RX%d_Synth` REAL' % rx for rx in range(1,5)] +
+               ['`RX%d%s_%s` %s' % (rx,pol,name,decl) for rx in range(1,5) for pol in 'AB'
+                for name,decl in [('Feed','TEXT'),('IFFilter','TEXT'),('Mode','TEXT'),('BBFilter','TEXT'),
+                                  ('Atten','REAL')]] +
+               ['`%s%s` %s' % (feed,name,decl) for feed in ['HF','LF']
+                for name,decl in [('PolXNoise','TEXT'),('PolYNoise','TEXT'),('CombGen','INTEGER'),
+                                  ('PolBasis','TEXT'),('PolTransfer','TEXT')]])
+
+_spssColumns = (['UnixTime REAL'] + ['`iBOBDesignID%d` INTEGER' % k for k in range(8)] +
+                ['`iBOBADCClock%d` REAL' % k for k in range(8)])
+
+_forxColumns = ['Minus12V','Plus12V','FOTXMon'] + ['FORXMon%d' % k for k in range(8)] + ['RackTemp']
+
+_schema = [
+    """CREATE TABLE IF NOT EXISTS rss_config (
+        ID INTEGER PRIMARY KEY AUTOINCREMENT,
+        %s
+    );""" % ',\n        '.join(_rssColumns),
+    """CREATE TABLE IF NOT EXISTS spss_config (
+        ID INTEGER PRIMARY KEY AUTOINCREMENT,
+        %s
+    );""" % ',\n        '.join(_spssColumns),
+    """CREATE TABLE IF NOT EXISTS ibob_config (
+        ID INTEGER PRIMARY KEY AUTOINCREMENT,
+        UnixTime REAL,
+        iBOB INTEGER,
+        StatusDict TEXT
+    );""",
+    """CREATE TABLE IF NOT EXISTS ibob_designs (
+        ID INTEGER PRIMARY KEY AUTOINCREMENT,
+        Personality TEXT,
+        IPF TEXT,
+        Directory TEXT
+    );""",
+    """CREATE TABLE IF NOT EXISTS projects (
+        ID INTEGER PRIMARY KEY AUTOINCREMENT,
+        Name TEXT
+    );""",
+    """CREATE TABLE IF NOT EXISTS observers (
+        ID INTEGER PRIMARY KEY AUTOINCREMENT,
+        Name TEXT
+    );""",
+    """CREATE TABLE IF NOT EXISTS data_files (
+        ID INTEGER PRIMARY KEY AUTOINCREMENT,
+        Path TEXT
+    );""",
+    """CREATE TABLE IF NOT EXISTS scans (
+        ID INTEGER PRIMARY KEY AUTOINCREMENT,
+        ProjectID INTEGER,
+        Session INTEGER,
+        Scan INTEGER,
+        CurrentObserverID INTEGER,
+        SourceID INTEGER,
+        BEE2DataFileID INTEGER,
+        ScanType TEXT,
+        StartTime REAL,
+        EndTime REAL
+    );""",
+    """CREATE TABLE IF NOT EXISTS rss_monitor_points (
+        ID INTEGER PRIMARY KEY AUTOINCREMENT,
+        Name TEXT,
+        LatchAddress INTEGER,
+        LatchData INTEGER,
+        AdcChan INTEGER
+    );""",
+    """CREATE TABLE IF NOT EXISTS rss_mon (
+        ID INTEGER PRIMARY KEY AUTOINCREMENT,
+        UnixTime REAL,
+        LatchAddress INTEGER,
+        LatchData INTEGER,
+        AdcChan INTEGER,
+        Voltage REAL
+    );""",
+    """CREATE TABLE IF NOT EXISTS forx_mon (
+        ID INTEGER PRIMARY KEY AUTOINCREMENT,
+        UnixTime REAL,
+        %s
+    );""" % _columns(_forxColumns,'REAL'),
+    """CREATE TABLE IF NOT EXISTS spss_power (
+        ID INTEGER PRIMARY KEY AUTOINCREMENT,
+        UnixTime REAL,
+        SetVoltage REAL,
+        SetCurrent REAL,
+        MeasuredVoltage REAL,
+        MeasuredCurrent REAL,
+        Status INTEGER,
+        Fault INTEGER
+    );""",
+    """CREATE TABLE IF NOT EXISTS tct_status (
+        ID INTEGER PRIMARY KEY AUTOINCREMENT,
+        UnixTime REAL,
+        Status INTEGER,
+        Offset REAL
+    );""",
+    """CREATE TABLE IF NOT EXISTS spss_ups (
+        ID INTEGER PRIMARY KEY AUTOINCREMENT,
+        UnixTime REAL UNIQUE,
+        %s
+    );""" % _columns(['Vmin','Vmax','Vout','Wout','Freq','Capacity','Vbat','Temperature'],'REAL'),
+    """CREATE TABLE IF NOT EXISTS antenna_cmd (
+        ID INTEGER PRIMARY KEY AUTOINCREMENT,
+        UnixTime REAL,
+        Name TEXT,
+        RA REAL,
+        `Dec` REAL,
+        SourceID INTEGER
+    );""",
+    """CREATE TABLE IF NOT EXISTS antenna_temp (
+        ID INTEGER PRIMARY KEY AUTOINCREMENT,
+        UnixTime REAL,
+        AZ REAL,
+        EL REAL
+    );""",
+    """CREATE TABLE IF NOT EXISTS gavrt_sources.source (
+        source_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT,
+        RA REAL,
+        `Dec` REAL
+    );""",
+    """CREATE TABLE IF NOT EXISTS information_schema.COLUMNS (
+        TABLE_NAME TEXT,
+        COLUMN_NAME TEXT,
+        COLUMN_TYPE TEXT
+    );""",
+    """CREATE INDEX IF NOT EXISTS rss_config_time ON rss_config (ReadyTime);""",
+    """CREATE INDEX IF NOT EXISTS spss_config_time ON spss_config (UnixTime);""",
+    """CREATE INDEX IF NOT EXISTS ibob_config_time ON ibob_config (iBOB, UnixTime);""",
+    """CREATE INDEX IF NOT EXISTS scans_time ON scans (StartTime);""",
+    """CREATE INDEX IF NOT EXISTS rss_mon_point ON rss_mon (LatchAddress, LatchData);""",
+    """CREATE INDEX IF NOT EXISTS antenna_cmd_time ON antenna_cmd (UnixTime);""",
+    """CREATE INDEX IF NOT EXISTS antenna_temp_time ON antenna_temp (UnixTime);""",
+]
+
+SCAN_TYPES = ('Drift','Track','Map','Calibration','Test')
+
+def _translate(query):
+    """
+    internal: MySQL query to SQLite
+    """
+    query = query.replace('`','"').replace('%s','?')
+    query = re.sub(r'^\s*INSERT\s+IGNORE\s+',"INSERT OR IGNORE ",query,flags=re.I)
+    if re.search(r'\sON\s+DUPLICATE\s+KEY\s+UPDATE\s',query,flags=re.I):
+        query = re.sub(r'\sON\s+DUPLICATE\s+KEY\s+UPDATE\s.*?(;?\s*)$',r'\1',query,flags=re.I|re.S)
+        query = re.sub(r'^\s*INSERT\s+',"INSERT OR REPLACE ",query,flags=re.I)
+    return query
+
+def _plain(value):
+    if isinstance(value,np.generic):
+        return value.item()
+    return value
+
+def _args(args):
+    if args is None:
+        return ()
+    if not isinstance(args,(tuple,list)):
+        args = (args,)
+    return [_plain(a) for a in args]
+
+def _typecode(value):
+    if isinstance(value,float):
+        return FIELD_TYPE_DOUBLE
+    if isinstance(value,(int,long)):
+        return FIELD_TYPE_LONGLONG
+    return FIELD_TYPE_VAR_STRING
+
+class Cursor(object):
+    """
+    MySQLdb style cursor on a :class:`Connection`
+    """
+    def __init__(self,conn):
+        self.connection = conn
+        self._cursor = conn._conn.cursor()
+        self._buffer = []
+        self.description = None
+        self.rowcount = -1
+        self.lastrowid = None
+
+    def execute(self,query,args=None):
+        self._cursor.execute(_translate(query),_args(args))
+        self._done()
+        return self.rowcount
+
+    def executemany(self,query,args):
+        args = list(args)
+        if len(args) == 1:
+            self._cursor.execute(_translate(query),_args(args[0]))     # executemany does not set lastrowid
+        else:
+            self._cursor.executemany(_translate(query),[_args(a) for a in args])
+        self._done()
+        return self.rowcount
+
+    def _done(self):
+        self.rowcount = self._cursor.rowcount
+        self.lastrowid = self._cursor.lastrowid
+        if self.lastrowid:
+            self.connection._insert_id = self.lastrowid
+        self._buffer = []
+        self.description = None
+        if self._cursor.description is None:
+            return
+        # SQLite does not report column types, so take them from the first non NULL value of each column
+        self._buffer = self._cursor.fetchmany(PEEK_ROWS)
+        codes = []
+        for k in range(len(self._cursor.description)):
+            code = FIELD_TYPE_VAR_STRING
+            for row in self._buffer:
+                if row[k] is not None:
+                    code = _typecode(row[k])
+                    break
+            codes.append(code)
+        self.description = tuple([(d[0],code,None,None,None,None,True)
+                                  for d,code in zip(self._cursor.description,codes)])
+
+    def fetchone(self):
+        if self._buffer:
+            return self._buffer.pop(0)
+        return self._cursor.fetchone()
+
+    def fetchmany(self,size=1):
+        rows = self._buffer[:size]
+        self._buffer = self._buffer[size:]
+        if len(rows) < size:
+            rows = rows + self._cursor.fetchmany(size - len(rows))
+        return rows
+
+    def fetchall(self):
+        rows = self._buffer + self._cursor.fetchall()
+        self._buffer = []
+        return rows
+
+    def close(self):
+        self._cursor.close()
+
+class Connection(object):
+    """
+    MySQLdb style connection to the SQLite database *filename*, with the gavrt_sources and information_schema
+    databases attached from files next to it. The schema is created if missing
+    """
+    def __init__(self,filename):
+        self.filename = filename
+        self._conn = sqlite3.connect(filename,timeout=30,check_same_thread=False)
+        self._conn.text_factory = str
+        self._insert_id = 0
+        self._autocommit = False
+        base = os.path.splitext(filename)[0]
+        for name in _attached:
+            self._conn.execute("ATTACH DATABASE ? AS %s" % name,('%s.%s.sqlite' % (base,name),))
+        for stmt in _schema:
+            self._conn.execute(_translate(stmt))
+        self._conn.commit()
+
+    def cursor(self,cursorclass=None):
+        return Cursor(self)
+
+    def commit(self):
+        self._conn.commit()
+
+    def rollback(self):
+        self._conn.rollback()
+
+    def autocommit(self,on):
+        self._autocommit = on
+        if on:
+            self._conn.commit()
+            self._conn.isolation_level = None
+        else:
+            self._conn.isolation_level = ''
+
+    def insert_id(self):
+        return self._insert_id
+
+    def ping(self):
+        self._conn.execute("SELECT 1")
+
+    def close(self):
+        self._conn.close()
+
+def connect(filename):
+    return Connection(filename)
+
+class SQLiteBackend(object):
+    """
+    Backend for :func:`gavrtdb.setBackend` which makes the GavrtDB connection pool use the SQLite database
+    *filename* instead of the MySQL server. The same file is used for read only and read/write access
+    """
+    def __init__(self,filename):
+        self.filename = filename
+
+    def connect(self,rw=False):
+        conn = Connection(self.filename)
+        conn.autocommit(True)
+        return conn
+
+    def isConnectionError(self,e):
+        return isinstance(e,sqlite3.ProgrammingError) and 'closed' in str(e)
+
+    def __repr__(self):
+        return "SQLiteBackend(%r)" % self.filename
+
+def generate(conn,days=1.0,start=None,seed=0,sources=5000,ibobs=range(8),antenna_interval=1.0,
+             monitor_interval=10.0):
+    """
+    Fill the database on *conn* with *days* of synthetic data starting at UnixTime *start* (default: *days* ago).
+    Returns the (start, end) times covered.
+
+    Configuration tables change every few minutes (rss_config, spss_config, ibob_config) and scans last about
+    fifteen minutes; antenna_temp has a row every *antenna_interval* seconds and the monitor tables (rss_mon,
+    forx_mon, spss_power) every *monitor_interval* seconds, tct_status and spss_ups every minute. Static tables
+    (ibob_designs, projects, observers, data_files, gavrt_sources.source, the ScanType enum) are filled as well.
+    """
+    rs = np.random.RandomState(seed)
+    if start is None:
+        start = time.time() - days*86400
+    end = start + days*86400
+    autocommit = conn._autocommit
+    conn.autocommit(False)      # one transaction, rather than one per row
+    c = conn.cursor()
+
+    def insert(table,columns,rows):
+        c.executemany("INSERT INTO %s (%s) VALUES (%s)" % (table,', '.join(['`%s`' % col for col in columns]),
+                                                           ', '.join(['%s']*len(columns))),rows)
+
+    def times(interval,jitter=0.0):
+        t = np.arange(start,end,interval)
+        if jitter:
+            t = np.sort(t + rs.uniform(0,jitter*interval,len(t)))
+        return t
+
+    designs = ['DummyPersonality','Cospec','TwoPolDDCSpectrometer','OnePolReal512ChannelKurtosisSpectrometer',
+               'OnePolReal512ChannelSpectrometer','OnePolRealKurtosisSpectrometer','OnePolRealSpectrometer',
+               'DDCDedisp','WideX4Dedisp']
+    insert('ibob_designs',['Personality','IPF','Directory'],
+           [(name,'%s.bit' % name.lower(),'/designs/%s' % name.lower()) for name in designs])
+    insert('projects',['Name'],[('Project %d' % k,) for k in range(20)])
+    insert('observers',['Name'],[('Observer %d' % k,) for k in range(50)])
+    insert('data_files',['Path'],[('/data/file%05d.h5' % k,) for k in range(100)])
+    insert('gavrt_sources.source',['name','RA','Dec'],
+           [('SRC%05d' % k,rs.uniform(0,360),rs.uniform(-40,90)) for k in range(sources)])
+    c.execute("DELETE FROM information_schema.COLUMNS WHERE TABLE_NAME = 'scans' AND COLUMN_NAME = 'ScanType';")
+    insert('information_schema.COLUMNS',['TABLE_NAME','COLUMN_NAME','COLUMN_TYPE'],
+           [('scans','ScanType','enum' + repr(SCAN_TYPES))])
+    insert('rss_monitor_points',['Name','LatchAddress','LatchData','AdcChan'],
+           [('Point %d.%d.%d' % (la,ld,ch),la,ld,ch) for la in range(4) for ld in range(4) for ch in range(4)])
+
+    rows = []
+    for t in times(600.0,jitter=0.5):
+        rec = [t-2.0,t] + list(rs.randint(0,16,8)) + list(rs.uniform(6000,9000,4))
+        for rx in range(4):
+            for pol in range(2):
+                rec += [['HF','LF'][rs.randint(2)],['400','2000'][rs.randint(2)],['IQ','UL'][rs.randint(2)],
+                        ['LPF','BPF','HPF'][rs.randint(3)],rs.randint(0,64)/2.0]
+        for feed in range(2):
+            rec += [['OFF','ON'][rs.randint(2)],['OFF','ON'][rs.randint(2)],rs.randint(2),
+                    ['LIN','CIRC'][rs.randint(2)],['NORM','REV'][rs.randint(2)]]
+        rows.append(rec)
+    insert('rss_config',[col.split()[0].strip('`') for col in _rssColumns],rows)
+
+    rows = []
+    for t in times(1800.0,jitter=0.5):
+        rows.append([t] + list(rs.randint(2,len(designs)+1,8)) + list(rs.choice([1024.0,800.0,128.0],8)))
+    insert('spss_config',[col.split()[0].strip('`') for col in _spssColumns],rows)
+
+    rows = []
+    for t in times(300.0,jitter=0.5):
+        for ib in ibobs:
+            regs = {'ctrl':int(rs.randint(0,2**16)),'period':int(rs.randint(1000,100000)),
+                    'fftshift':int(rs.randint(0,2**12)),'tvg':0}
+            rows.append((t + ib,ib,repr(regs)))
+    insert('ibob_config',['UnixTime','iBOB','StatusDict'],rows)
+
+    rows = []
+    for n,t in enumerate(times(900.0,jitter=0.2)):
+        sourceid = 0 if rs.uniform() < 0.2 else rs.randint(1,sources+1)
+        rows.append((rs.randint(1,21),n/20,n%20,rs.randint(1,51),sourceid,rs.randint(0,101),
+                     SCAN_TYPES[rs.randint(len(SCAN_TYPES))],t,t + rs.uniform(60,800)))
+    insert('scans',['ProjectID','Session','Scan','CurrentObserverID','SourceID','BEE2DataFileID','ScanType',
+                    'StartTime','EndTime'],rows)
+
+    rows = []
+    for t in times(3600.0,jitter=0.5):
+        sourceid = rs.randint(1,sources+1)
+        rows.append((t,'SRC%05d' % (sourceid-1),rs.uniform(0,360),rs.uniform(-40,90),sourceid))
+    insert('antenna_cmd',['UnixTime','Name','RA','Dec','SourceID'],rows)
+
+    t = times(antenna_interval)
+    insert('antenna_temp',['UnixTime','AZ','EL'],
+           zip(t,(np.cumsum(rs.normal(0,0.01,len(t))) % 360),np.clip(45+np.cumsum(rs.normal(0,0.01,len(t))),5,90)))
+
+    t = times(monitor_interval)
+    rows = []
+    for tt in t:
+        la,ld = rs.randint(0,4,2)
+        rows.extend([(tt,la,ld,ch,rs.normal(1.0,0.1)) for ch in range(4)])
+    insert('rss_mon',['UnixTime','LatchAddress','LatchData','AdcChan','Voltage'],rows)
+    insert('forx_mon',['UnixTime']+_forxColumns,
+           [[tt] + list(rs.normal(5,0.1,len(_forxColumns))) for tt in t])
+    insert('spss_power',['UnixTime','SetVoltage','SetCurrent','MeasuredVoltage','MeasuredCurrent','Status','Fault'],
+           [(tt,12.0,5.0,rs.normal(12,0.05),rs.normal(4,0.1),0,0) for tt in t])
+
+    t = times(60.0)
+    insert('tct_status',['UnixTime','Status','Offset'],[(tt,0,rs.normal(0,1e-3)) for tt in t])
+    insert('spss_ups',['UnixTime','Vmin','Vmax','Vout','Wout','Freq','Capacity','Vbat','Temperature'],
+           [[tt] + list(rs.normal([118,122,120,1500,60,100,27,30],[1,1,1,50,0.1,0,0.1,1])) for tt in t])
+    conn.commit()
+    conn.autocommit(autocommit)
+    return start,end
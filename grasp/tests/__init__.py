@@ -0,0 +1,5 @@
+"""
+Behaviour tests for grasp. Run from the directory containing grasp with::
+
+    python -m unittest discover -s grasp/tests -t .
+"""
@@ -0,0 +1,52 @@
+import unittest
+
+import numpy as np
+
+from grasp.dss28core import adcstats
+
+class AdcStatsTest(unittest.TestCase):
+    def setUp(self):
+        rs = np.random.RandomState(0)
+        self.samples = np.clip(np.round(rs.randn(16384)*40 + 3),-128,127).astype('int8')
+
+    def testHistogram(self):
+        samples = np.array([-128,-128,-1,0,0,0,5,127],dtype='int8')
+        hist = adcstats.histogram(samples)
+        self.assertEqual(hist.shape,(adcstats.HISTOGRAM_BINS,))
+        self.assertEqual(hist.sum(),len(samples))
+        self.assertEqual(hist[0],2)
+        self.assertEqual(hist[127],1)
+        self.assertEqual(hist[128],3)
+        self.assertEqual(hist[133],1)
+        self.assertEqual(hist[255],1)
+
+    def testMoments(self):
+        x = self.samples.astype('float64')
+        st = adcstats.snapshotStats(self.samples)
+        self.assertEqual(st['Histogram'].sum(),len(x))
+        self.assertAlmostEqual(st['Mean'],x.mean())
+        self.assertAlmostEqual(st['RMS'],np.sqrt((x**2).mean()))
+        self.assertAlmostEqual(st['ClipFraction'],np.mean((x == 127) | (x == -128)))
+        self.assertEqual(st['PSD'].shape,(adcstats.NFFT//2 + 1,))
+
+    def testTone(self):
+        n = np.arange(16384)
+        samples = np.round(100*np.cos(2*np.pi*n*32/256.0)).astype('int8')
+        psd = adcstats.snapshotStats(samples)['PSD']
+        self.assertEqual(psd.argmax(),32)
+
+    def testMeasurement(self):
+        mtype = adcstats.statsMeasType({'adcI':(16384,),'adcQ':(16384,)})
+        self.assertEqual(sorted(mtype['arrays'].keys()),['histI','histQ','psdI','psdQ'])
+        arrays,table = adcstats.statsMeasurement({'adcI':self.samples,'adcQ':-self.samples},
+                                                 {'Timestamp':10.0,'AccNumber':3})
+        self.assertEqual(sorted(arrays.keys()),sorted(mtype['arrays'].keys()))
+        for name,shape in mtype['arrays'].items():
+            self.assertEqual(arrays[name].shape,shape)
+        self.assertEqual(table['AccNumber'],3)
+        self.assertAlmostEqual(table['MeanI'],self.samples.astype('float64').mean())
+        self.assertAlmostEqual(table['MeanQ'],(-self.samples).astype('float64').mean())
+        self.assertTrue(set(table.keys()) <= set(mtype['table'].keys()))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+import unittest
+
+import numpy as np
+
+from grasp.dss28core import channelwindow
+
+class Personality(object):
+    """
+    The parts of a personality used by channelFrequencies
+    """
+    def __init__(self,adcClock,nchan=8):
+        self._adcClock = adcClock
+        self.nchan = nchan
+
+    def _bbfrq(self):
+        return np.arange(self.nchan)*self._adcClock/(2.0*self.nchan)
+
+class ResolveWindowsTest(unittest.TestCase):
+    def testWindows(self):
+        freqs = 1000 + np.arange(16)*0.5
+        self.assertEqual(channelwindow.resolveWindows(freqs,[(1001.0,1002.0),(1007.5,1006.9)]),[(2,5),(14,16)])
+
+    def testNonContiguous(self):
+        # fftshifted spectrum: the window wraps around the end of the array
+        freqs = np.fft.fftshift(np.arange(-4,4))
+        self.assertEqual(channelwindow.resolveWindows(freqs,[(-1,1)]),[(0,2),(7,8)])
+
+    def testEmptyWindow(self):
+        self.assertRaises(ValueError,channelwindow.resolveWindows,np.arange(8.0),[(3.2,3.8)])
+
+class ChannelFrequenciesTest(unittest.TestCase):
+    def testBaseband(self):
+        p = Personality(1024.0)
+        self.assertTrue(np.allclose(channelwindow.channelFrequencies(p),p._bbfrq()))
+
+    def testSky(self):
+        p = Personality(1024.0)
+        freqs = channelwindow.channelFrequencies(p,dict(f0=8000.0,Sideband=-1))
+        self.assertTrue(np.allclose(freqs,8000.0 - p._bbfrq()))
+
+    def testLowClock(self):
+        p = Personality(128.0)
+        freqs = channelwindow.channelFrequencies(p,dict(f0=2000.0,Sideband=1))
+        self.assertTrue(np.allclose(freqs,2000.0 + 256.0 + p._bbfrq()))
+
+class ChannelWindowerTest(unittest.TestCase):
+    def setUp(self):
+        measTypes = {'SpectralPower':{'arrays':{'II':(16,),'SKFlag':(2,)}}}
+        self.windower = channelwindow.ChannelWindower(measTypes,{'SpectralPower':dict(windows=[(2,5),(10,12)],
+                                                                 nchan=16,overview=4)})
+
+    def testStoredArrays(self):
+        self.assertEqual(self.windower.storedArrays('SpectralPower'),
+                         {'II_w0':('II',(3,),False),'II_w1':('II',(2,),False),'II_overview':('II',(4,),True),
+                          'SKFlag':('SKFlag',(2,),False)})
+
+    def testSelect(self):
+        data = np.arange(16.0)
+        out = self.windower.select('SpectralPower',{'II':data,'SKFlag':np.zeros(2,'uint8')})
+        self.assertEqual(sorted(out.keys()),['II_overview','II_w0','II_w1','SKFlag'])
+        self.assertEqual(list(out['II_w0']),[2,3,4])
+        self.assertEqual(list(out['II_w1']),[10,11])
+        self.assertEqual(list(out['II_overview']),[1.5,5.5,9.5,13.5])
+
+if __name__ == '__main__':
+    unittest.main()
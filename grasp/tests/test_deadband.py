@@ -0,0 +1,103 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from grasp import deadband, gavrtdb, sqlitedb
+
+class RecorderTest(unittest.TestCase):
+    def setUp(self):
+        self.rows = []
+        self.recorder = deadband.DeadbandRecorder(self,'tct_status',dict(Offset=0.1),heartbeat=100)
+
+    def queueRecord(self,table,rec):
+        self.rows.append(rec)
+
+    def update(self,t,**rec):
+        rec['UnixTime'] = t
+        return self.recorder.update(rec)
+
+    def testDeadband(self):
+        self.assertTrue(self.update(0,Offset=0.0,Status=0))
+        self.assertFalse(self.update(1,Offset=0.09,Status=0))
+        self.assertFalse(self.update(2,Offset=-0.05,Status=0))
+        self.assertTrue(self.update(3,Offset=0.11,Status=0))
+        # compared with the last recorded value, not the last offered one
+        self.assertFalse(self.update(4,Offset=0.02,Status=0))
+        self.assertTrue(self.update(5,Offset=0.0,Status=0))
+        # no deadband: any change is recorded
+        self.assertTrue(self.update(6,Offset=0.0,Status=1))
+        self.assertEqual([rec['UnixTime'] for rec in self.rows],[0,3,5,6])
+        self.assertEqual(self.recorder.stats,dict(updates=7,recorded=4))
+
+    def testHeartbeat(self):
+        self.assertTrue(self.update(0,Offset=0.0))
+        self.assertFalse(self.update(99,Offset=0.0))
+        self.assertTrue(self.update(100,Offset=0.0))
+        self.assertFalse(self.update(150,Offset=0.0))
+
+    def testNaN(self):
+        self.update(0,Offset=0.0,Mode='a')
+        self.assertTrue(self.update(1,Offset=np.nan,Mode='a'))
+        self.assertFalse(self.update(2,Offset=np.nan,Mode='a'))
+        self.assertTrue(self.update(3,Offset=0.0,Mode='a'))
+        self.assertTrue(self.update(4,Offset=0.0,Mode='b'))
+
+class ReadSeriesTest(unittest.TestCase):
+    t0 = 2e9
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        gavrtdb.setBackend(sqlitedb.SQLiteBackend(os.path.join(self.dir,'gavrt.sqlite')))
+        self.spooldir = gavrtdb._inserts.spooldir
+        gavrtdb._inserts.spooldir = os.path.join(self.dir,'spool')
+        self.gdb = gavrtdb.GavrtDB(rw=True)
+        recorder = deadband.DeadbandRecorder(self.gdb,'tct_status',dict(Offset=0.1),heartbeat=900)
+        rs = np.random.RandomState(0)
+        self.status = np.zeros((3600,),dtype=int)
+        self.status[2000:2100] = 1
+        self.offset = 0.01*rs.randn(3600)
+        self.offset[1000:1200] += 0.5
+        for k in range(3600):
+            recorder.update(dict(UnixTime=self.t0+k,Status=self.status[k],Offset=self.offset[k]))
+        gavrtdb.flushInserts()
+        self.recorded = recorder.stats['recorded']
+
+    def tearDown(self):
+        gavrtdb.setBackend(None)
+        gavrtdb._inserts.spooldir = self.spooldir
+        shutil.rmtree(self.dir)
+
+    def testReconstruction(self):
+        self.assertTrue(self.recorded < 20)
+        d = deadband.readSeries(self.gdb,'tct_status',self.t0,self.t0+3600,step=1)
+        self.assertEqual(list(d['UnixTime']),list(self.t0 + np.arange(3600)))
+        # each row is in effect from the time it was recorded
+        self.assertEqual(list(d['Status']),list(self.status))
+        self.assertTrue(np.abs(d['Offset'] - self.offset).max() <= 0.1)
+
+    def testRows(self):
+        d = deadband.readSeries(self.gdb,'tct_status',self.t0+1500,self.t0+3600)
+        times = d['UnixTime']
+        # the row in effect at t0 comes first
+        self.assertTrue(times[0] < self.t0+1500 <= times[1])
+        self.assertEqual(len(times),len(self.gdb.get("SELECT ID FROM tct_status WHERE UnixTime >= %s;",
+                                                     (self.t0+1500,))['ID']) + 1)
+
+    def testColumns(self):
+        d = deadband.readSeries(self.gdb,'tct_status',self.t0,self.t0+3600,columns='Status',step=60)
+        self.assertEqual(sorted(d.keys()),['ID','Status','UnixTime'])
+        self.assertEqual(len(d['Status']),60)
+        d = deadband.readSeries(self.gdb,'tct_status',self.t0,self.t0+3600,columns='`Offset`')
+        self.assertEqual(sorted(d.keys()),['ID','Offset','UnixTime'])
+
+    def testBeforeFirstRow(self):
+        d = deadband.readSeries(self.gdb,'tct_status',self.t0-100,self.t0+10,step=5)
+        self.assertTrue(np.isnan(d['Offset'][:20]).all())
+        self.assertTrue(np.isfinite(d['Offset'][20:]).all())
+        self.assertEqual(list(d['Status'][20:]),[0,0])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+import unittest
+
+import numpy as np
+
+from grasp.dss28core import downsample
+
+class IntegrationReducerTest(unittest.TestCase):
+    def reduce(self,rates,n,dt,t0=100.0):
+        reducer = downsample.IntegrationReducer({'SpectralPower':{'arrays':{'II':(4,),'SKFlag':(2,)}}},
+                                                {'SpectralPower':{'rates':rates}})
+        out = []
+        for k in range(n):
+            flags = np.zeros((2,),dtype='uint8')
+            flags[0] = 1 << (k % 8)
+            out += reducer.add('SpectralPower',{'II':np.ones(4)*k,'SKFlag':flags},{'Timestamp':t0+k*dt,'AccNumber':k})
+        return out,reducer.flush()
+
+    def testBins(self):
+        out,rest = self.reduce([1.0],60,0.04)
+        self.assertEqual(len(out),2)
+        for n,(tag,arrays,table) in enumerate(out):
+            first = 25*n
+            self.assertEqual(tag,'1s')
+            self.assertEqual(table['Timestamp'],100.0 + n)
+            self.assertEqual(table['Count'],25)
+            self.assertEqual(table['AccNumber'],first)
+            self.assertAlmostEqual(table['StartTime'],100.0 + first*0.04)
+            self.assertAlmostEqual(table['EndTime'],100.0 + (first+24)*0.04)
+            self.assertTrue(np.allclose(arrays['II'],first + 12.0))
+            self.assertTrue(np.all(arrays['II_min'] == first))
+            self.assertTrue(np.all(arrays['II_max'] == first + 24))
+        # the partly filled last bin is returned by flush
+        self.assertEqual(len(rest),1)
+        measurement_type,(tag,arrays,table) = rest[0]
+        self.assertEqual(measurement_type,'SpectralPower')
+        self.assertEqual(table['Count'],10)
+        self.assertTrue(np.allclose(arrays['II'],54.5))
+
+    def testSeveralRates(self):
+        out,rest = self.reduce([1.0,0.5],50,0.04)
+        counts = {}
+        for tag,arrays,table in out + [done for measurement_type,done in rest]:
+            counts[tag] = counts.get(tag,0) + table['Count']
+        self.assertEqual(counts,{'1s':50,'0p5s':50})
+
+    def testFlagsCombinedWithOr(self):
+        out,rest = self.reduce([1.0],25,0.04)
+        tag,arrays,table = rest[0][1]
+        self.assertEqual(arrays['SKFlag'].dtype,np.uint8)
+        self.assertEqual(list(arrays['SKFlag']),[255,0])
+        self.assertFalse(arrays.has_key('SKFlag_min'))
+
+    def testReducedArrays(self):
+        arrays = downsample.reducedArrays({'II':(16,),'SKFlag':(2,)},'1s')
+        self.assertEqual(arrays,{'II':('II_1s',(16,),'float32'),'II_min':('II_1s_min',(16,),'float32'),
+                                 'II_max':('II_1s_max',(16,),'float32'),'SKFlag':('SKFlag_1s',(2,),'uint8')})
+
+    def testRateTag(self):
+        self.assertEqual(downsample.rateTag(1),'1s')
+        self.assertEqual(downsample.rateTag(0.5),'0p5s')
+
+if __name__ == '__main__':
+    unittest.main()
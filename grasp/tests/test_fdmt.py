@@ -0,0 +1,81 @@
+import unittest
+
+import numpy as np
+
+from grasp import fdmt
+
+class FDMTTest(unittest.TestCase):
+    dm = 150.0
+    tsamp = 1e-3
+    ntime = 4096
+    arrival = 2000      # sample at which the pulse reaches the top of the band
+
+    def setUp(self):
+        rs = np.random.RandomState(1)
+        self.freqs = 1400 + np.arange(256)*0.5
+        self.search = fdmt.DMSearch(self.freqs,self.tsamp,300.0)
+        self.spectra = rs.randn(self.ntime,len(self.freqs)).astype('float32') + 100
+        for c,f in enumerate(self.freqs):
+            delay = fdmt.dmDelay(self.dm,f,self.search.f_max)
+            self.spectra[self.arrival + int(round(delay/self.tsamp)),c] += 3
+        self.timestamps = np.arange(self.ntime)*self.tsamp
+        # candidate times refer to the bottom of the band
+        self.sample = self.arrival + fdmt.dmDelay(self.dm,self.search.f_min,self.search.f_max)/self.tsamp
+        self.dmStep = self.search.dms[1]
+
+    def checkCandidates(self,candidates):
+        self.assertEqual(len(candidates),1,candidates)
+        c = candidates[0]
+        self.assertAlmostEqual(c['DM'],self.dm,delta=2*self.dmStep)
+        self.assertAlmostEqual(c['Sample'],self.sample,delta=2)
+        self.assertEqual(c['Timestamp'],self.timestamps[c['Sample']])
+        self.assertTrue(c['SNR'] > 20)
+
+    def testRecoverDM(self):
+        plane,candidates = self.search.search(self.spectra,self.timestamps,processes=1)
+        self.assertEqual(plane.shape,(self.search.maxDT,self.ntime))
+        self.checkCandidates(candidates)
+
+    def testDescendingFrequencies(self):
+        search = fdmt.DMSearch(self.freqs[::-1],self.tsamp,300.0)
+        plane,candidates = search.search(self.spectra[:,::-1],self.timestamps,processes=1)
+        self.checkCandidates(candidates)
+
+    def testChunks(self):
+        plane,candidates = self.search.search(self.spectra,self.timestamps,chunk=1000,processes=1)
+        self.checkCandidates(candidates)
+        whole = self.search.dmTime(self.spectra)
+        overlap = self.search.maxDT
+        self.assertTrue(np.allclose(plane[:,overlap:],whole[:,overlap:],atol=1e-3))
+
+    def testStreaming(self):
+        for size in [500,25,4]:
+            search = fdmt.StreamingSearch(self.freqs,self.tsamp,300.0,history=2048)
+            candidates = []
+            for start in range(0,self.ntime,size):
+                candidates += search.process(self.spectra[start:start+size],self.timestamps[start:start+size])
+            self.checkCandidates(candidates + search.flush())
+
+    def testStreamingPerDump(self):
+        search = fdmt.StreamingSearch(self.freqs,self.tsamp,300.0)
+        candidates = []
+        for k in range(self.ntime):
+            candidates += search.process(self.spectra[k],self.timestamps[k])
+        self.checkCandidates(candidates + search.flush())
+
+    def testStreamingBlock(self):
+        # a small first block is buffered until maxDT spectra have arrived
+        search = fdmt.StreamingSearch(self.freqs,self.tsamp,300.0,block=10)
+        self.assertEqual(search.process(self.spectra[:10],self.timestamps[:10]),[])
+        candidates = []
+        for start in range(10,self.ntime,7):
+            candidates += search.process(self.spectra[start:start+7],self.timestamps[start:start+7])
+        self.checkCandidates(candidates + search.flush())
+        self.assertEqual(search.flush(),[])
+
+    def testDelay(self):
+        self.assertAlmostEqual(fdmt.dmDelay(1.0,1000.0,np.inf),fdmt.K_DM*1e-6)
+        self.assertEqual(fdmt.dmDelay(100.0,1400.0,1400.0),0.0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,227 @@
+import os
+import json
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from grasp import gavrtdb, sqlitedb
+
+class Unreachable(object):
+    """
+    Backend whose server cannot be reached
+    """
+    def connect(self,rw=False):
+        raise IOError("no server")
+
+    def isConnectionError(self,e):
+        return True
+
+class SQLiteTestCase(unittest.TestCase):
+    """
+    Runs GavrtDB against a fresh SQLite stand-in database
+    """
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.backend = sqlitedb.SQLiteBackend(os.path.join(self.dir,'gavrt.sqlite'))
+        gavrtdb.setBackend(self.backend)
+        self.gdb = gavrtdb.GavrtDB(rw=True)
+
+    def tearDown(self):
+        gavrtdb.setBackend(None)
+        shutil.rmtree(self.dir)
+
+class ConnectionPoolTest(SQLiteTestCase):
+    def testReuse(self):
+        pool = gavrtdb.ConnectionPool(size=1)
+        a = pool.acquire()
+        b = pool.acquire()
+        self.assertEqual(pool.getStats()['inuse'],2)
+        pool.release(a)
+        pool.release(b)     # more than size idle connections: closed
+        stats = pool.getStats()
+        self.assertEqual((stats['created'],stats['inuse'],stats['idle_read']),(2,0,1))
+        self.assertTrue(pool.acquire() is a)
+        self.assertEqual(pool.getStats()['reused'],1)
+
+    def testModesKeptApart(self):
+        pool = gavrtdb.ConnectionPool()
+        pool.release(pool.acquire(True),True)
+        pool.acquire(False)
+        stats = pool.getStats()
+        self.assertEqual((stats['created'],stats['reused'],stats['idle_write']),(2,0,1))
+
+    def testDiscard(self):
+        pool = gavrtdb.ConnectionPool()
+        pool.discard(pool.acquire())
+        stats = pool.getStats()
+        self.assertEqual((stats['inuse'],stats['errors'],stats['idle_read']),(0,1,0))
+
+    def testDeadConnection(self):
+        pool = gavrtdb.ConnectionPool(ping_interval=0.0)
+        db = pool.acquire()
+        pool.release(db)
+        db.close()
+        self.assertFalse(pool.acquire() is db)
+        stats = pool.getStats()
+        self.assertEqual((stats['pings'],stats['dead'],stats['created'],stats['inuse']),(1,1,2,1))
+
+    def testFailedConnect(self):
+        gavrtdb.setBackend(Unreachable())
+        pool = gavrtdb.ConnectionPool()
+        self.assertRaises(IOError,pool.acquire)
+        stats = pool.getStats()
+        self.assertEqual((stats['created'],stats['inuse']),(0,0))
+
+    def testQueries(self):
+        self.gdb.insertRecord('tct_status',dict(UnixTime=1.0,Status=0,Offset=0.5))
+        self.assertEqual(list(self.gdb.get("SELECT Offset FROM tct_status;")['Offset']),[0.5])
+        stats = gavrtdb.poolStats()
+        self.assertEqual(stats['inuse'],0)
+        self.assertTrue(stats['reused'] >= 1)
+
+def deadPid():
+    """
+    The ID of a process which has exited
+    """
+    pid = os.fork()
+    if pid == 0:
+        os._exit(0)
+    os.waitpid(pid,0)
+    return pid
+
+class InsertQueueTest(SQLiteTestCase):
+    def setUp(self):
+        SQLiteTestCase.setUp(self)
+        self.spooldir = os.path.join(self.dir,'spool')
+        self.queue = gavrtdb.InsertQueue(interval=0.05,spooldir=self.spooldir)
+
+    def tearDown(self):
+        self.queue.close()
+        SQLiteTestCase.tearDown(self)
+
+    def put(self,*times):
+        for t in times:
+            self.queue.put('tct_status',dict(UnixTime=t,Status=0,Offset=0.0))
+        self.assertTrue(self.queue.flush())
+
+    def times(self):
+        return list(self.gdb.get("SELECT UnixTime FROM tct_status ORDER BY ID;").get('UnixTime',[]))
+
+    def spoolFile(self,name,*times):
+        path = os.path.join(self.spooldir,name)
+        f = open(path,'w')
+        for t in times:
+            f.write(json.dumps(['tct_status',['Offset','Status','UnixTime'],False,[0.0,0,t]]) + '\n')
+        f.close()
+        return path
+
+    def testBatches(self):
+        self.put(*range(1200))
+        self.assertEqual(self.times(),range(1200))
+        stats = self.queue.getStats()
+        self.assertEqual((stats['inserted'],stats['pending'],stats['spooled']),(1200,0,0))
+
+    def testSpoolAndReplay(self):
+        gavrtdb.setBackend(Unreachable())
+        self.put(1.0,2.0)
+        self.assertEqual(os.listdir(self.spooldir),['%d.spool' % os.getpid()])
+        self.assertEqual(self.queue.getStats()['spooled'],2)
+        gavrtdb.setBackend(self.backend)
+        self.put(3.0)
+        self.assertEqual(self.times(),[1.0,2.0,3.0])
+        self.assertEqual(os.listdir(self.spooldir),[])
+        self.assertEqual(self.queue.getStats()['replayed'],2)
+
+    def testLeftoverSpools(self):
+        os.makedirs(self.spooldir)
+        dead = deadPid()
+        files = [self.spoolFile('%d.spool.replay' % dead,1.0),                      # replayed by an older version
+                 self.spoolFile('%d.spool' % dead,2.0,3.0),
+                 self.spoolFile('%d.spool.%d.replay' % (os.getppid(),dead),4.0)]    # replay interrupted
+        live = self.spoolFile('%d.spool' % os.getppid(),10.0)
+        for k,path in enumerate(files + [live]):
+            os.utime(path,(1000+k,1000+k))
+        self.put(5.0)
+        self.assertEqual(self.times(),[1.0,2.0,3.0,4.0,5.0])
+        # the spool of a running process is left for it to replay
+        self.assertEqual(os.listdir(self.spooldir),[os.path.basename(live)])
+
+    def testProcessAlive(self):
+        self.assertTrue(gavrtdb._processAlive(os.getpid()))
+        self.assertTrue(gavrtdb._processAlive(1))
+        self.assertFalse(gavrtdb._processAlive(deadPid()))
+
+    def testRejected(self):
+        self.queue.put('no_such_table',dict(UnixTime=1.0))
+        self.put(2.0)
+        self.assertEqual(self.times(),[2.0])
+        stats = self.queue.getStats()
+        self.assertEqual((stats['inserted'],stats['rejected']),(1,1))
+        rejected = open(os.path.join(self.spooldir,'%d.spool.rejected' % os.getpid())).readlines()
+        self.assertEqual([json.loads(line)[0] for line in rejected],['no_such_table'])
+
+class ConfigHistoryTest(unittest.TestCase):
+    def setUp(self):
+        # rows 2 and 3 take effect at the same time, ID 3 is the later one
+        self.history = gavrtdb.ConfigHistory(dict(ID=np.array([4,3,1,2]),UnixTime=np.array([30.0,20.0,10.0,20.0]),
+                                                  Mode=np.array(['d','c','a','b'],dtype=object)),'UnixTime')
+
+    def testIndex(self):
+        self.assertEqual(len(self.history),4)
+        self.assertEqual(list(self.history.rows['ID']),[1,2,3,4])
+        # the row in effect at t took effect strictly before t
+        self.assertEqual(list(self.history.index([5.0,10.0,10.5,20.0,25.0,30.0,1e9])),[-1,-1,0,0,2,2,3])
+
+    def testAt(self):
+        at = self.history.at([5.0,25.0])
+        self.assertTrue(np.isnan(at['ID'][0]))
+        self.assertEqual(at['ID'][1],3)
+        self.assertEqual(list(at['Mode']),[None,'c'])
+        self.assertEqual(sorted(self.history.at([25.0],['Mode']).keys()),['Mode'])
+        self.assertEqual(self.history.row(1),dict(ID=2,UnixTime=20.0,Mode='b'))
+
+    def testEmpty(self):
+        history = gavrtdb.ConfigHistory({},'UnixTime')
+        self.assertEqual(len(history),0)
+        self.assertTrue(np.isnan(history.at([1.0,2.0],['ID'])['ID']).all())
+
+class GetConfigTest(SQLiteTestCase):
+    def setUp(self):
+        SQLiteTestCase.setUp(self)
+        self.start,self.end = sqlitedb.generate(self.backend.connect(),days=0.05,start=1e9,ibobs=[3])
+
+    def testHistory(self):
+        rows = self.gdb.get("SELECT ID,UnixTime FROM ibob_config WHERE iBOB = 3 ORDER BY ID;")
+        t0 = (rows['UnixTime'][1] + rows['UnixTime'][2])/2
+        t1 = rows['UnixTime'][5]
+        history = self.gdb.getConfigHistory('ibob_config',t0,t1,where='iBOB = %s',args=(3,),columns='ID,UnixTime')
+        # the row in effect at t0 and the rows taking effect before t1
+        self.assertEqual(list(history.rows['ID']),list(rows['ID'][1:5]))
+        self.assertEqual(sorted(history.rows.keys()),['ID','UnixTime'])
+
+    def testMatchesSingleLookups(self):
+        # the single lookups fail before the first row of each table
+        first = max(self.gdb.get("SELECT MIN(ReadyTime) AS t FROM rss_config;")['t'][0],
+                    self.gdb.get("SELECT MIN(UnixTime) AS t FROM spss_config;")['t'][0],
+                    self.gdb.get("SELECT MIN(UnixTime) AS t FROM ibob_config;")['t'][0])
+        t = np.linspace(first + 1,self.end,40)
+        config = self.gdb.getConfigAt(t,3)
+        for k,tk in enumerate(t):
+            rss = self.gdb.getRSSStatusAt(tk)
+            self.assertEqual(config['RSSConfigID'][k],rss['ID'])
+            self.assertEqual(config['f0'][k],self.gdb.getRXStatusByIBob(3,rss=rss)['f0'])
+            self.assertEqual(config['SPSSConfigID'][k],self.gdb.getSPSSStatusAt(tk)['ID'])
+            ibob = self.gdb.getIBOBStatusAt(tk,3)
+            self.assertEqual(config['IBOBConfigID'][k],ibob['ID'])
+            self.assertEqual(config['Registers']['ctrl'][k],ibob['StatusDict']['ctrl'])
+
+    def testBeforeFirstRow(self):
+        config = self.gdb.getConfigAt([self.start - 1],3)
+        for key in ['RSSConfigID','SPSSConfigID','IBOBConfigID','ADCClock']:
+            self.assertTrue(np.isnan(config[key][0]))
+        self.assertEqual(config['Personality'][0],None)
+
+if __name__ == '__main__':
+    unittest.main()
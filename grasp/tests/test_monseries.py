@@ -0,0 +1,102 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from grasp import gavrtdb, monseries, sqlitedb
+
+class MonitorSeriesTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.ms = monseries.MonitorSeries(os.path.join(self.dir,'series.sqlite'))
+        rs = np.random.RandomState(0)
+        self.t = np.sort(rs.uniform(0,3*3600,5000)) + 1e9
+        self.v = rs.randn(len(self.t))
+
+    def tearDown(self):
+        self.ms.close()
+        shutil.rmtree(self.dir)
+
+    def add(self,sensor,t,v):
+        n = len(t)
+        return self.ms.add([sensor[0]]*n,[sensor[1]]*n,[sensor[2]]*n,t,v)
+
+    def checkRollup(self,q,t,v,interval):
+        bins = np.floor(t/interval)*interval
+        self.assertEqual(list(q['UnixTime']),sorted(set(bins)))
+        for k,b in enumerate(q['UnixTime']):
+            sel = bins == b
+            self.assertEqual(q['Count'][k],sel.sum())
+            self.assertAlmostEqual(q['Value'][k],v[sel].mean())
+            self.assertEqual(q['Min'][k],v[sel].min())
+            self.assertEqual(q['Max'][k],v[sel].max())
+
+    def testRollups(self):
+        self.assertEqual(self.add((1,2,0),self.t,self.v),len(self.t))
+        self.add((1,2,1),self.t,self.v + 10)     # another sensor does not mix in
+        for interval in monseries.ROLLUP_INTERVALS:
+            q = self.ms.query((1,2,0),self.t[0],self.t[-1],resolution=interval)
+            self.assertEqual(q['resolution'],interval)
+            self.checkRollup(q,self.t,self.v,interval)
+
+    def testIncremental(self):
+        # samples added in several calls, splitting bins, give the same rollups
+        for part in np.array_split(np.arange(len(self.t)),7):
+            self.add((1,2,0),self.t[part],self.v[part])
+        for interval in monseries.ROLLUP_INTERVALS:
+            self.checkRollup(self.ms.query((1,2,0),self.t[0],self.t[-1],resolution=interval),self.t,self.v,interval)
+
+    def testSamples(self):
+        self.add((1,2,0),self.t,self.v)
+        q = self.ms.query((1,2,0),self.t[100],self.t[199],resolution=0)
+        self.assertEqual(list(q['UnixTime']),list(self.t[100:200]))
+        self.assertEqual(list(q['Value']),list(self.v[100:200]))
+
+    def testResolution(self):
+        self.add((1,2,0),self.t,self.v)
+        t0,t1 = self.t[0],self.t[-1]
+        self.assertEqual(self.ms.resolution((1,2,0),t0,t1,maxpoints=len(self.t)),0)
+        self.assertEqual(self.ms.resolution((1,2,0),t0,t1,maxpoints=1000),60)
+        self.assertEqual(self.ms.resolution((1,2,0),t0,t1,maxpoints=10),3600)
+        self.assertEqual(self.ms.query((1,2,0),t0,t1,maxpoints=10)['resolution'],3600)
+        self.assertRaises(ValueError,self.ms.query,(1,2,0),t0,t1,resolution=10)
+
+    def testResolutionSpan(self):
+        # samples are counted only within the span, not over the whole hourly bins it overlaps
+        self.add((1,2,0),self.t,self.v)
+        hour = np.ceil(self.t[0]/3600)*3600
+        for t0,t1 in [(hour+600,hour+1200),(hour-300,hour+300),(hour-1800,hour+3600+1800),(self.t[0],self.t[-1])]:
+            n = ((self.t >= t0) & (self.t <= t1)).sum()
+            self.assertEqual(self.ms.resolution((1,2,0),t0,t1,maxpoints=n),0)
+            self.assertEqual(self.ms.resolution((1,2,0),t0,t1,maxpoints=n-1),60)
+
+    def testNonFinite(self):
+        v = self.v.copy()
+        v[::2] = np.nan
+        self.add((1,2,0),self.t,v)
+        good = np.isfinite(v)
+        self.checkRollup(self.ms.query((1,2,0),self.t[0],self.t[-1],resolution=3600),self.t[good],v[good],3600)
+
+    def testUnknownSensor(self):
+        self.assertRaises(KeyError,self.ms.query,(9,9,9),0,1)
+        self.assertRaises(KeyError,self.ms.query,'no such point',0,1)
+
+    def testSync(self):
+        backend = sqlitedb.SQLiteBackend(os.path.join(self.dir,'gavrt.sqlite'))
+        start,end = sqlitedb.generate(backend.connect(),days=0.05,start=1e9)
+        gavrtdb.setBackend(backend)
+        try:
+            gdb = gavrtdb.GavrtDB()
+            rows = gdb.get("SELECT UnixTime,Voltage FROM rss_mon WHERE LatchAddress = 1 AND LatchData = 2 AND AdcChan = 0;")
+            total = gdb.get("SELECT COUNT(*) AS n FROM rss_mon;")['n'][0]
+            self.assertEqual(self.ms.sync(gdb,chunk=1000),total)
+            self.assertEqual(self.ms.sync(gdb),0)
+            q = self.ms.query('Point 1.2.0',start,end,resolution=60)
+            self.checkRollup(q,rows['UnixTime'],rows['Voltage'],60)
+        finally:
+            gavrtdb.setBackend(None)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+import unittest
+
+import numpy as np
+
+from grasp.dss28core import spectralkurtosis
+
+def accumulate(power):
+    """
+    S1 and S2 of the (M, nchan) array of spectra *power*
+    """
+    return power.sum(axis=0),(power**2).sum(axis=0)
+
+class SKTest(unittest.TestCase):
+    def setUp(self):
+        self.rs = np.random.RandomState(0)
+        self.M = 256
+        self.nchan = 1024
+
+    def noise(self):
+        # power of complex Gaussian voltages
+        v = self.rs.randn(self.M,self.nchan) + 1j*self.rs.randn(self.M,self.nchan)
+        return np.abs(v)**2
+
+    def testGaussianNoise(self):
+        s1,s2 = accumulate(self.noise())
+        sk = spectralkurtosis.skEstimator(s1,s2,self.M)
+        lo,hi = spectralkurtosis.skThresholds(self.M)
+        std = (hi - 1)/3.0
+        self.assertAlmostEqual(sk.mean(),1.0,delta=5*std/np.sqrt(self.nchan))
+        self.assertAlmostEqual(sk.std(),std,delta=0.1*std)
+
+    def testFlags(self):
+        power = self.noise()
+        power[:,100] = 2.0      # steady tone: SK near 0
+        power[::16,200] *= 20   # pulsed interference: SK well above 1
+        s1,s2 = accumulate(power)
+        flagger = spectralkurtosis.SKFlagger(self.nchan)
+        flags = spectralkurtosis.unpackFlags(flagger.process(s1,s2,self.M),self.nchan)
+        self.assertTrue(flags[100])
+        self.assertTrue(flags[200])
+        self.assertTrue(flags.sum() < 0.01*self.nchan)
+        self.assertEqual(flagger.count,1)
+        self.assertEqual(flagger.occupancy()[100],1.0)
+
+    def testUnknownAccumulationLength(self):
+        s1,s2 = accumulate(self.noise())
+        flagger = spectralkurtosis.SKFlagger(self.nchan)
+        for M in [None,1]:
+            packed = flagger.process(s1,s2,M)
+            self.assertEqual(packed.shape,(self.nchan//8,))
+            self.assertFalse(packed.any())
+        self.assertEqual(flagger.count,2)
+
+    def testNoPower(self):
+        sk = spectralkurtosis.skEstimator(np.zeros(4),np.zeros(4),self.M)
+        self.assertTrue(np.isnan(sk).all())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -6,6 +6,7 @@ General purpose utilities
 """
 
 import cPickle
+import os
 
 def unpickle(fname):
     fh = open(fname,'r')
@@ -17,3 +18,13 @@ def pickle(obj,fname,protocol=2):
     fh = open(fname,'w')
     cPickle.dump(obj,fh,protocol=protocol)
     fh.close()
+
+def dss28Path(*parts):
+    """
+    Return a path inside the DSS28 working directory ($DSS28, or $HOME/dss28 if not defined)
+    """
+    try:
+        base = os.environ['DSS28']
+    except KeyError:
+        base = os.path.join(os.environ['HOME'],'dss28')
+    return os.path.join(base,*parts)